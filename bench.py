@@ -0,0 +1,582 @@
+# Đo hiệu năng định tuyến, không cần Streamlit
+#
+#   python bench.py search --pairs 300 --seed 0
+#   python bench.py search --graphml hanoi.graphml --methods astar,bidirectional-alt,ch,topology
+#   python bench.py search --methods legacy,astar,topology
+#   python bench.py suite --output bench-HEAD.json
+#   python bench.py suite --output bench-new.json --compare bench-HEAD.json
+#   python bench.py compare bench-HEAD.json bench-new.json
+#   python bench.py matrix --stops 30 --workers 4
+#   python bench.py ingest --vehicles 200 --minutes 30
+#   python bench.py profiles --vehicles 100 --pairs 300
+#
+# "search" so sánh các thuật toán trên cùng một tập cặp điểm ngẫu nhiên (theo seed); khoảng
+# cách được đối chiếu với A* để chắc chắn các chế độ mới cho cùng kết quả. "legacy" là
+# Astar_algorithm cũ của map_app.py (dict kề, haversine mỗi lần đẩy heap), dùng làm mốc
+# cho cột "x legacy".
+# "suite" đo riêng từng bước của một lượt tìm đường trong map_app.py: nạp đồ thị (GraphML
+# so với snapshot), bắt điểm, tìm đường, dựng tọa độ và HTML của folium. Mỗi bước báo
+# p50/p95/p99, số node mở rộng, số lần đẩy heap và bộ nhớ cấp phát đỉnh (tracemalloc,
+# đo ở một lượt riêng để không làm sai lệch thời gian), rồi ghi ra JSON để so giữa các commit.
+# Mỗi lượt được chạy --repeat lần và lấy thời gian nhỏ nhất để giảm nhiễu của máy đo.
+import argparse
+import json
+import math
+import os
+import platform
+import random
+import subprocess
+import sys
+import time
+import tracemalloc
+from collections import defaultdict
+from heapq import heappush, heappop
+
+import numpy as np
+
+import contraction
+import graph_store
+import matrix
+import route_geometry
+import routing
+import spatial_index
+import topology
+import tour
+import traffic_ingest
+import traffic_profiles
+import traffic_store
+
+REGRESSION_THRESHOLD = 0.10  # chậm hơn 10% ở p50 thì coi là suy giảm
+MEMORY_SAMPLE = 20  # số lượt chạy lại dưới tracemalloc để đo bộ nhớ
+REPEAT = 3
+
+
+def random_pairs(cg, count, seed):
+    rng = random.Random(seed)
+    return [(rng.randrange(cg.num_nodes), rng.randrange(cg.num_nodes)) for _ in range(count)]
+
+
+def random_points(cg, count, seed):
+    # Điểm nhấp chuột ngẫu nhiên trong khung bao của đồ thị
+    rng = np.random.default_rng(seed)
+    lat, lon = np.asarray(cg.lat), np.asarray(cg.lon)
+    return rng.uniform(lat.min(), lat.max(), count), rng.uniform(lon.min(), lon.max(), count)
+
+
+def summarize(times_ms, **extra):
+    times_ms = np.asarray(times_ms, dtype=np.float64)
+    stats = {
+        'count': int(len(times_ms)),
+        'mean_ms': float(times_ms.mean()),
+        'p50_ms': float(np.percentile(times_ms, 50)),
+        'p95_ms': float(np.percentile(times_ms, 95)),
+        'p99_ms': float(np.percentile(times_ms, 99)),
+        'max_ms': float(times_ms.max()),
+    }
+    stats.update(extra)
+    return stats
+
+
+def peak_memory_kb(fn, items):
+    if not items:
+        return None
+    tracemalloc.start()
+    try:
+        for item in items:
+            fn(item)
+        return tracemalloc.get_traced_memory()[1] / 1024
+    finally:
+        tracemalloc.stop()
+
+
+def time_stage(fn, items, memory_sample=MEMORY_SAMPLE, repeat=REPEAT):
+    # Trả về (thời gian từng lượt (ms), kết quả, bộ nhớ đỉnh (KB))
+    fn(items[0])  # làm nóng
+    times, results = [], []
+    for item in items:
+        best = None
+        for _ in range(repeat):
+            start = time.perf_counter()
+            result = fn(item)
+            elapsed = (time.perf_counter() - start) * 1000
+            best = elapsed if best is None else min(best, elapsed)
+        results.append(result)
+        times.append(best)
+    return times, results, peak_memory_kb(fn, items[:memory_sample])
+
+
+def legacy_search(cg):
+    ids = range(cg.num_nodes)
+    offsets, targets, weights = cg.offsets.tolist(), cg.targets.tolist(), cg.weights.tolist()
+    graph = {u: list(zip(targets[offsets[u]:offsets[u + 1]], weights[offsets[u]:offsets[u + 1]])) for u in ids}
+    nodes = dict(zip(ids, zip(cg.lat.tolist(), cg.lon.tolist())))
+
+    def calculate_distance(pa, pb):
+        lat1, lon1 = math.radians(pa[0]), math.radians(pa[1])
+        lat2, lon2 = math.radians(pb[0]), math.radians(pb[1])
+        c = math.sin(lat1) * math.sin(lat2) + math.cos(lat1) * math.cos(lat2) * math.cos(lon2 - lon1)
+        return math.acos(min(1.0, c)) * routing.EARTH_RADIUS
+
+    def search(pointA, pointB):
+        queue = [(0, pointA)]
+        father = defaultdict(int)
+        father[pointA] = -1
+        res = defaultdict(int)
+        res[pointA] = 0
+        expanded, pushes, max_heap = 0, 1, 1
+        while queue:
+            _, current = heappop(queue)
+            expanded += 1
+            if current == pointB:
+                break
+            for neighbor, cost in graph[current]:
+                g = res[current] + cost
+                h = calculate_distance(nodes[neighbor], nodes[pointB])
+                if neighbor not in father or g + h < res[neighbor] + h:
+                    heappush(queue, (g + h, neighbor))
+                    father[neighbor] = current
+                    res[neighbor] = g
+                    pushes += 1
+            max_heap = max(max_heap, len(queue))
+        if pointB not in father:
+            return routing.Route(math.inf, [], expanded, pushes, max_heap)
+        path = [pointB]
+        while father[path[-1]] != -1:
+            path.append(father[path[-1]])
+        path.reverse()
+        return routing.Route(res[pointB], path, expanded, pushes, max_heap)
+    return search
+
+
+def bench_search(engine, pairs, methods, weights=None, ch=None, topo=None, repeat=1):
+    results = {}
+    for method in methods:
+        if method == 'legacy':
+            search = lambda pair, legacy=legacy_search(engine.cg): legacy(*pair)
+        elif method == 'ch':
+            metric = ch.customize(weights) if weights is not None else None
+            search = lambda pair: ch.route(*pair, metric)
+        elif method == 'topology':
+            metric = topo.customize(weights) if weights is not None else None
+            search = lambda pair: topo.route(*pair, metric)
+        else:
+            search = lambda pair: engine.route(*pair, weights=weights, method=method)
+        times, routes, _ = time_stage(search, pairs, memory_sample=0, repeat=repeat)  # làm nóng landmark, workspace
+        results[method] = (np.asarray(times), routes)
+    return results
+
+
+def mismatches(routes, reference):
+    return sum(not (a.distance == b.distance or abs(a.distance - b.distance) <= 1e-6)
+               for a, b in zip(routes, reference))
+
+
+def print_search(results, baseline='astar'):
+    reference = results.get(baseline)
+    legacy = results.get('legacy')
+    print(f"{'method':<20}{'mean ms':>10}{'p50 ms':>10}{'p95 ms':>10}{'expanded':>11}{'pushes':>10}{'max heap':>10}{'mismatch':>10}"
+          + (f"{'x legacy':>10}" if legacy is not None else ''))
+    for method, (times, routes) in results.items():
+        mismatch = mismatches(routes, reference[1]) if reference is not None else 0
+        print(f"{method:<20}{times.mean():>10.3f}{np.percentile(times, 50):>10.3f}{np.percentile(times, 95):>10.3f}"
+              f"{np.mean([r.expanded for r in routes]):>11.1f}{np.mean([r.pushes for r in routes]):>10.1f}"
+              f"{max(r.max_heap for r in routes):>10}{mismatch:>10}"
+              + (f"{legacy[0].mean() / times.mean():>10.1f}" if legacy is not None else ''))
+
+
+def render_html(cg, path, arcs):
+    import folium
+    coords, _ = route_geometry.path_polyline(cg, path, arcs)
+    m = folium.Map(location=coords[0], zoom_start=16, tiles='OpenStreetMap')
+    folium.PolyLine(coords, color='blue', weight=5, opacity=0.8).add_to(m)
+    return m.get_root().render()
+
+
+def git_revision():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__)), check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run_suite(graphml, pairs_count, seed, methods, load_repeat, render_count, repeat=REPEAT):
+    import osmnx as ox
+    stages = {}
+
+    # Nạp đồ thị: parse GraphML + biên dịch (đường cũ) so với mở snapshot bằng memory-map
+    snapshot = graph_store.default_path(graphml)
+    graph_store.build_or_load(graphml, snapshot)
+
+    def load_graphml(_):
+        return graph_store.compile_graph(ox.load_graphml(graphml), landmarks=0)
+
+    times, _, peak = time_stage(load_graphml, list(range(load_repeat)), memory_sample=1, repeat=1)
+    stages['load.graphml'] = summarize(times, peak_kb=peak)
+    times, _, peak = time_stage(lambda _: graph_store.load_compiled(snapshot), list(range(20)), repeat=repeat)
+    stages['load.snapshot'] = summarize(times, peak_kb=peak)
+
+    cg = graph_store.load_compiled(snapshot)
+    times, built, peak = time_stage(lambda _: (routing.RoutingEngine(cg), spatial_index.SpatialIndex(cg)),
+                                    list(range(5)), memory_sample=1, repeat=repeat)
+    stages['load.indexes'] = summarize(times, peak_kb=peak)
+    engine, snapper = built[0]
+    ch = None
+    if 'ch' in methods:
+        path = contraction.default_path(graphml)
+        contraction.build_or_load(cg, path)
+        times, loaded, peak = time_stage(lambda _: contraction.load(cg, path), list(range(5)), memory_sample=1,
+                                         repeat=repeat)
+        stages['load.contraction'] = summarize(times, peak_kb=peak)
+        ch = loaded[0]
+        times, _, peak = time_stage(lambda _: ch.customize(cg.weights.tolist()), list(range(5)), memory_sample=1,
+                                    repeat=repeat)
+        stages['contraction.customize'] = summarize(times, peak_kb=peak)
+    topo = None
+    if 'topology' in methods:
+        times, built, peak = time_stage(lambda _: topology.Topology(cg, engine), list(range(5)), memory_sample=1,
+                                        repeat=repeat)
+        stages['load.topology'] = summarize(times, peak_kb=peak)
+        topo = built[0]
+        times, _, peak = time_stage(lambda _: topo.customize(cg.weights.tolist()), list(range(5)), memory_sample=1,
+                                    repeat=repeat)
+        stages['topology.customize'] = summarize(times, peak_kb=peak)
+
+    # Bắt điểm: mỗi lượt tìm đường bắt hai điểm nhấp chuột
+    lats, lons = random_points(cg, pairs_count, seed)
+    clicks = list(zip(lats.tolist(), lons.tolist()))
+    times, _, peak = time_stage(lambda p: snapper.nearest_node(*p), clicks, repeat=repeat)
+    stages['snap.node'] = summarize(times, peak_kb=peak)
+    times, _, peak = time_stage(lambda p: snapper.nearest_edge(*p), clicks, repeat=repeat)
+    stages['snap.edge'] = summarize(times, peak_kb=peak)
+
+    # Tìm đường
+    pairs = random_pairs(cg, pairs_count, seed)
+    results = bench_search(engine, pairs, methods, ch=ch, topo=topo, repeat=repeat)
+    reference = results[methods[0]][1]
+    for method, (times, routes) in results.items():
+        if method == 'ch':
+            search = lambda pair: ch.route(*pair)
+        elif method == 'topology':
+            search = lambda pair: topo.route(*pair)
+        else:
+            search = lambda pair, method=method: engine.route(*pair, method=method)
+        stages['search.' + method] = summarize(
+            times,
+            expanded=float(np.mean([r.expanded for r in routes])),
+            pushes=float(np.mean([r.pushes for r in routes])),
+            max_heap=int(max(r.max_heap for r in routes)),
+            mismatch=mismatches(routes, reference),
+            peak_kb=peak_memory_kb(search, pairs[:MEMORY_SAMPLE]))
+
+    # Vẽ: tọa độ tuyến và HTML bản đồ folium như map_app.py gửi về trình duyệt
+    routes = [r for r in reference if r.path][:render_count]
+    arcs = [cg.path_arcs(r.path) for r in routes]
+    items = list(zip([r.path for r in routes], arcs))
+    times, _, peak = time_stage(lambda item: cg.path_arcs(item[0]), items, repeat=repeat)
+    stages['render.arcs'] = summarize(times, peak_kb=peak)
+    times, _, peak = time_stage(lambda item: route_geometry.path_polyline(cg, *item), items, repeat=repeat)
+    stages['render.polyline'] = summarize(times, peak_kb=peak)
+    try:
+        times, html, peak = time_stage(lambda item: render_html(cg, *item), items, memory_sample=5, repeat=repeat)
+        stages['render.folium'] = summarize(times, peak_kb=peak, html_bytes=float(np.mean([len(h.encode()) for h in html])))
+    except ImportError:
+        print("⚠️ Bỏ qua render.folium: chưa cài folium")
+
+    meta = {
+        'graphml': os.path.basename(graphml),
+        'nodes': cg.num_nodes,
+        'arcs': cg.num_arcs,
+        'pairs': pairs_count,
+        'seed': seed,
+        'repeat': repeat,
+        'methods': methods,
+        'git': git_revision(),
+        'python': platform.python_version(),
+        'numpy': np.__version__,
+        'platform': platform.platform(),
+        'created': time.strftime('%Y-%m-%dT%H:%M:%S'),
+    }
+    return {'meta': meta, 'stages': stages}
+
+
+def print_suite(result):
+    meta = result['meta']
+    print(f"Đồ thị {meta['graphml']}: {meta['nodes']} node, {meta['arcs']} cung; {meta['pairs']} cặp điểm, seed {meta['seed']}")
+    print(f"{'stage':<24}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'expanded':>11}{'pushes':>10}{'max heap':>10}{'peak KB':>10}")
+    for name, s in result['stages'].items():
+        expanded = f"{s['expanded']:.1f}" if 'expanded' in s else '-'
+        pushes = f"{s['pushes']:.1f}" if 'pushes' in s else '-'
+        max_heap = s.get('max_heap', '-')
+        peak = f"{s['peak_kb']:.0f}" if 'peak_kb' in s else '-'
+        print(f"{name:<24}{s['p50_ms']:>10.3f}{s['p95_ms']:>10.3f}{s['p99_ms']:>10.3f}{expanded:>11}{pushes:>10}{max_heap:>10}{peak:>10}")
+    for name, s in result['stages'].items():
+        if s.get('mismatch'):
+            print(f"⚠️ {name}: {s['mismatch']} tuyến có độ dài khác {meta['methods'][0]}")
+        if 'html_bytes' in s:
+            print(f"HTML bản đồ trung bình: {s['html_bytes'] / 1024:.1f} KB")
+
+
+def compare(old, new, threshold=REGRESSION_THRESHOLD):
+    # In chênh lệch p50/p95 theo từng bước; trả về danh sách bước chậm đi quá ngưỡng
+    regressions = []
+    print(f"So sánh {old['meta'].get('git')} -> {new['meta'].get('git')}")
+    for key in ('graphml', 'nodes', 'pairs', 'seed', 'repeat'):
+        if old['meta'].get(key) != new['meta'].get(key):
+            print(f"⚠️ Hai lần đo khác {key}: {old['meta'].get(key)} / {new['meta'].get(key)}")
+    print(f"{'stage':<24}{'p50 cũ':>10}{'p50 mới':>10}{'Δ p50':>9}{'p95 cũ':>10}{'p95 mới':>10}{'Δ p95':>9}")
+    for name, s in new['stages'].items():
+        before = old['stages'].get(name)
+        if before is None:
+            print(f"{name:<24}{'-':>10}{s['p50_ms']:>10.3f}{'mới':>9}")
+            continue
+        d50 = s['p50_ms'] / before['p50_ms'] - 1 if before['p50_ms'] else 0.0
+        d95 = s['p95_ms'] / before['p95_ms'] - 1 if before['p95_ms'] else 0.0
+        flag = ''
+        if d50 > threshold:
+            regressions.append(name)
+            flag = '  ⚠️'
+        print(f"{name:<24}{before['p50_ms']:>10.3f}{s['p50_ms']:>10.3f}{d50:>+9.1%}"
+              f"{before['p95_ms']:>10.3f}{s['p95_ms']:>10.3f}{d95:>+9.1%}{flag}")
+    return regressions
+
+
+def load_result(path):
+    with open(path, encoding='utf-8') as f:
+        return json.load(f)
+
+
+def bench_matrix(cg, engine, stops, workers):
+    # Ma trận N x N: N * N lượt A* so với N lượt Dijkstra (trong tiến trình và qua MatrixPool)
+    start = time.perf_counter()
+    pairwise = np.array([[engine.route(a, b).distance for b in stops] for a in stops])
+    print(f"{'A* từng cặp':<24}{(time.perf_counter() - start) * 1000:>10.1f} ms")
+    me = matrix.MatrixEngine(cg)
+    start = time.perf_counter()
+    result = me.matrix(stops, stops, 1.0)
+    print(f"{'MatrixEngine':<24}{(time.perf_counter() - start) * 1000:>10.1f} ms")
+    if workers > 1:
+        pool = matrix.MatrixPool(graph_store.default_path(cg.meta.get('source', 'phuongmai.graphml')), workers)
+        try:
+            pool.matrix(stops[:1], stops, 1.0)  # khởi động tiến trình
+            start = time.perf_counter()
+            pooled = pool.matrix(stops, stops, 1.0)
+            print(f"{f'MatrixPool ({workers} tiến trình)':<24}{(time.perf_counter() - start) * 1000:>10.1f} ms")
+            assert np.array_equal(pooled.distance, result.distance)
+        finally:
+            pool.close()
+    start = time.perf_counter()
+    order = tour.solve(result.time)
+    print(f"{'tour.solve':<24}{(time.perf_counter() - start) * 1000:>10.1f} ms  "
+          f"(tổng {tour.route_cost(result.distance, order):.0f} m)")
+    print(f"Sai khác lớn nhất so với A*: {np.abs(np.where(np.isinf(pairwise), 0, result.distance - pairwise)).max():.6f} m")
+
+
+def simulate_probes(cg, engine, vehicles, minutes, seed, interval=(1, 3), noise=traffic_ingest.GPS_SIGMA,
+                    free_speed=8.3, slow_speed=3.0, slow_radius=200.0):
+    # Xe chạy qua lại giữa các node ngẫu nhiên, phát điểm GPS có nhiễu; các cạnh trong một
+    # vùng tròn đi chậm slow_speed. Trả về các điểm theo thứ tự thời gian và mặt nạ cạnh chậm.
+    rng = random.Random(seed)
+    snapper = spatial_index.SpatialIndex(cg)
+    xs, ys = snapper.xs, snapper.ys
+    center = rng.randrange(cg.num_nodes)
+    mid_x = (xs[cg.edge_u] + xs[cg.edge_v]) / 2
+    mid_y = (ys[cg.edge_u] + ys[cg.edge_v]) / 2
+    slow = np.hypot(mid_x - xs[center], mid_y - ys[center]) < slow_radius
+    speed = np.where(slow, slow_speed, free_speed)
+    arc_edge = np.asarray(cg.arc_edge)
+    weights = np.asarray(cg.weights)
+    fixes = []
+    for vehicle in range(vehicles):
+        t = rng.uniform(0, 60)
+        end = minutes * 60
+        node = rng.randrange(cg.num_nodes)
+        next_fix = t
+        while t < end:
+            path = engine.route(node, rng.randrange(cg.num_nodes)).path
+            if len(path) < 2:
+                node = rng.randrange(cg.num_nodes)
+                continue
+            for u, v in zip(path, path[1:]):
+                k = cg.arc_index(u, v)
+                duration = weights[k] / speed[arc_edge[k]]
+                while next_fix < t + duration:
+                    f = (next_fix - t) / duration
+                    x = xs[u] + f * (xs[v] - xs[u]) + rng.gauss(0, noise)
+                    y = ys[u] + f * (ys[v] - ys[u]) + rng.gauss(0, noise)
+                    lat, lon = snapper.unproject(x, y)
+                    fixes.append(traffic_ingest.Fix(f"xe-{vehicle}", next_fix, float(lat), float(lon)))
+                    next_fix += rng.uniform(*interval)
+                t += duration
+                if t >= end:
+                    break
+            node = path[-1]
+    fixes.sort(key=lambda fix: fix.time)
+    return fixes, slow
+
+
+def bench_ingest(cg, fixes, slow, batch):
+    store = traffic_store.TrafficStore(cg.num_edges)
+    start = time.perf_counter()
+    ingester = traffic_ingest.TrafficIngester(cg, store)
+    print(f"Dựng MapMatcher: {(time.perf_counter() - start) * 1000:.1f} ms")
+    start = time.perf_counter()
+    stats = traffic_ingest.run(ingester, fixes, batch, verbose=False)
+    elapsed = time.perf_counter() - start
+    matched = sum(s.matched for s in stats)
+    print(f"{len(fixes)} điểm, {len(stats)} lô: {elapsed:.2f} s, {len(fixes) / elapsed:,.0f} điểm/s, "
+          f"khớp {matched} bước, {store.version} phiên bản")
+    edges, levels = ingester.levels()
+    for name, mask in (("vùng chậm", slow[edges]), ("còn lại", ~slow[edges])):
+        if mask.any():
+            counts = np.bincount(levels[mask], minlength=7)[1:]
+            print(f"Cạnh {name}: {int(mask.sum())} cạnh có dữ liệu / {int((slow if name == 'vùng chậm' else ~slow).sum())}, "
+                  f"mức trung bình {levels[mask].mean():.2f}, phân bố mức 1..6: {counts.tolist()}")
+
+
+def bench_profiles(cg, engine, vehicles, minutes, pairs, batch, seed, rush_hour=8, calm_hour=3, speed=8.3):
+    # Dựng hồ sơ từ dữ liệu mô phỏng: vùng chậm lúc rush_hour giờ, mọi đường thông thoáng lúc
+    # calm_hour giờ; rồi so tìm đường theo giờ khởi hành với A* tĩnh trên đồ thị nút giao
+    rush, slow = simulate_probes(cg, engine, vehicles, minutes, seed)
+    calm, _ = simulate_probes(cg, engine, vehicles, minutes, seed + 1, slow_speed=8.3)
+    fixes = [f._replace(time=f.time + hour * 3600 - traffic_profiles.UTC_OFFSET)
+             for hour, part in ((calm_hour, calm), (rush_hour, rush)) for f in part]
+    start = time.perf_counter()
+    builder = traffic_profiles.ProfileBuilder(cg)
+    for part in traffic_ingest.batched(iter(fixes), batch):
+        builder.add(part)
+    profiles = builder.profiles()
+    elapsed = time.perf_counter() - start
+    print(f"Dựng hồ sơ: {len(fixes)} điểm trong {elapsed:.2f} s ({len(fixes) / elapsed:,.0f} điểm/s), "
+          f"{len(profiles.profiles)} hồ sơ, {profiles.nbytes / 1024:.1f} KB")
+    for hour in (calm_hour, rush_hour):
+        levels = profiles.levels_at(hour * 3600)
+        print(f"{hour:02d}:00 mức trung bình: vùng chậm {levels[slow].mean():.2f}, còn lại {levels[~slow].mean():.2f}")
+    topo = topology.Topology(cg, engine)
+    start = time.perf_counter()
+    router = traffic_profiles.TimeDependentRouter(topo, profiles)
+    print(f"TimeDependentRouter: dựng trong {(time.perf_counter() - start) * 1000:.1f} ms")
+    results = {}
+    rows = [('topology', lambda s, t: topo.route(s, t))]
+    rows += [(f"{hour:02d}:00", lambda s, t, hour=hour: router.route(s, t, hour * 3600, speed)) for hour in (calm_hour, rush_hour)]
+    for name, fn in rows:
+        times, expanded = [], 0
+        routes = []
+        for s, t in pairs:
+            start = time.perf_counter()
+            route = fn(s, t)
+            times.append((time.perf_counter() - start) * 1000)
+            expanded += route.expanded
+            routes.append(route)
+        results[name] = routes
+        p50, p95 = np.percentile(times, [50, 95])
+        print(f"{name:>9}: trung bình {np.mean(times):.3f} ms, p50 {p50:.3f} ms, p95 {p95:.3f} ms, "
+              f"mở rộng {expanded / len(pairs):.0f} node")
+    calm_routes, rush_routes = results[f"{calm_hour:02d}:00"], results[f"{rush_hour:02d}:00"]
+    found = [i for i, r in enumerate(rush_routes) if r.path and calm_routes[i].path]
+    ratio = np.array([rush_routes[i].distance / calm_routes[i].distance for i in found if calm_routes[i].distance > 0])
+    print(f"Thời gian đi {rush_hour:02d}:00 / {calm_hour:02d}:00: x{ratio.mean():.2f} trung bình, x{ratio.max():.2f} lớn nhất")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Đo hiệu năng tìm đường")
+    sub = parser.add_subparsers(dest='command', required=True)
+    search = sub.add_parser('search', help="so sánh các thuật toán tìm đường")
+    search.add_argument('--graphml', default='phuongmai.graphml')
+    search.add_argument('--pairs', type=int, default=200)
+    search.add_argument('--seed', type=int, default=0)
+    search.add_argument('--methods', default=','.join(routing.METHODS + ('ch', 'topology')))
+    suite = sub.add_parser('suite', help="đo từng bước nạp, bắt điểm, tìm đường, vẽ")
+    suite.add_argument('--graphml', default='phuongmai.graphml')
+    suite.add_argument('--pairs', type=int, default=200)
+    suite.add_argument('--seed', type=int, default=0)
+    suite.add_argument('--methods', default=','.join(routing.METHODS + ('ch', 'topology')))
+    suite.add_argument('--load-repeat', type=int, default=3, help="số lần parse GraphML")
+    suite.add_argument('--render', type=int, default=30, help="số tuyến dựng HTML folium")
+    suite.add_argument('--repeat', type=int, default=REPEAT, help="số lần chạy mỗi lượt, lấy thời gian nhỏ nhất")
+    suite.add_argument('--output', help="ghi kết quả JSON")
+    suite.add_argument('--compare', help="file JSON của lần đo trước để so sánh")
+    suite.add_argument('--threshold', type=float, default=REGRESSION_THRESHOLD)
+    mat = sub.add_parser('matrix', help="ma trận khoảng cách nhiều điểm")
+    mat.add_argument('--graphml', default='phuongmai.graphml')
+    mat.add_argument('--stops', type=int, default=30)
+    mat.add_argument('--seed', type=int, default=0)
+    mat.add_argument('--workers', type=int, default=0)
+    ingest = sub.add_parser('ingest', help="nạp dữ liệu GPS mô phỏng (map matching + độ tắc)")
+    ingest.add_argument('--graphml', default='phuongmai.graphml')
+    ingest.add_argument('--vehicles', type=int, default=200)
+    ingest.add_argument('--minutes', type=float, default=15)
+    ingest.add_argument('--batch', type=int, default=traffic_ingest.BATCH_SIZE)
+    ingest.add_argument('--seed', type=int, default=0)
+    prof = sub.add_parser('profiles', help="dựng hồ sơ khung giờ từ dữ liệu mô phỏng, đo tìm đường theo giờ khởi hành")
+    prof.add_argument('--graphml', default='phuongmai.graphml')
+    prof.add_argument('--vehicles', type=int, default=100)
+    prof.add_argument('--minutes', type=float, default=20)
+    prof.add_argument('--pairs', type=int, default=300)
+    prof.add_argument('--batch', type=int, default=traffic_ingest.BATCH_SIZE)
+    prof.add_argument('--seed', type=int, default=0)
+    diff = sub.add_parser('compare', help="so sánh hai file kết quả JSON")
+    diff.add_argument('old')
+    diff.add_argument('new')
+    diff.add_argument('--threshold', type=float, default=REGRESSION_THRESHOLD)
+    args = parser.parse_args()
+
+    if args.command == 'search':
+        start = time.perf_counter()
+        cg = graph_store.build_or_load(args.graphml)
+        engine = routing.RoutingEngine(cg)
+        print(f"Đồ thị: {cg.num_nodes} node, {cg.num_arcs} cung, nạp trong {(time.perf_counter() - start) * 1000:.1f} ms")
+        methods = args.methods.split(',')
+        ch = None
+        if 'ch' in methods:
+            start = time.perf_counter()
+            ch = contraction.build_or_load(cg, contraction.default_path(args.graphml))
+            print(f"CH: {ch.num_edges} cạnh ({ch.num_shortcuts} cạnh tắt), nạp trong {(time.perf_counter() - start) * 1000:.1f} ms")
+            start = time.perf_counter()
+            ch.customize(cg.weights.tolist())
+            print(f"CH customization: {(time.perf_counter() - start) * 1000:.1f} ms")
+        topo = None
+        if 'topology' in methods:
+            start = time.perf_counter()
+            topo = topology.Topology(cg, engine)
+            print(f"Đồ thị nút giao: {topo.num_nodes} node, {topo.num_arcs} cung, dựng trong "
+                  f"{(time.perf_counter() - start) * 1000:.1f} ms")
+        pairs = random_pairs(cg, args.pairs, args.seed)
+        print_search(bench_search(engine, pairs, methods, ch=ch, topo=topo))
+        return 0
+
+    if args.command == 'matrix':
+        cg = graph_store.build_or_load(args.graphml)
+        stops = [source for source, _ in random_pairs(cg, args.stops, args.seed)]
+        bench_matrix(cg, routing.RoutingEngine(cg), stops, args.workers)
+        return 0
+
+    if args.command == 'ingest':
+        cg = graph_store.build_or_load(args.graphml)
+        fixes, slow = simulate_probes(cg, routing.RoutingEngine(cg), args.vehicles, args.minutes, args.seed)
+        bench_ingest(cg, fixes, slow, args.batch)
+        return 0
+
+    if args.command == 'profiles':
+        cg = graph_store.build_or_load(args.graphml)
+        bench_profiles(cg, routing.RoutingEngine(cg), args.vehicles, args.minutes, random_pairs(cg, args.pairs, args.seed),
+                       args.batch, args.seed)
+        return 0
+
+    if args.command == 'compare':
+        return 1 if compare(load_result(args.old), load_result(args.new), args.threshold) else 0
+
+    result = run_suite(args.graphml, args.pairs, args.seed, args.methods.split(','), args.load_repeat, args.render,
+                       args.repeat)
+    print_suite(result)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(result, f, indent=1, ensure_ascii=False)
+        print(f"✅ Đã ghi {args.output}")
+    if args.compare:
+        return 1 if compare(load_result(args.compare), result, args.threshold) else 0
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,301 @@
+# Contraction Hierarchies (dạng customizable) cho đồ thị lớn
+#
+# Tiền xử lý ngoại tuyến gồm hai bước:
+#   1. Thứ tự co node (bậc nhỏ nhất trước) và đồ thị "hướng lên" gồm cạnh gốc cộng các
+#      cạnh tắt (shortcut) sinh ra khi co node. Bước này chỉ phụ thuộc cấu trúc đồ thị.
+#   2. Customization: tính trọng số cho mọi cạnh của đồ thị hướng lên bằng cách duyệt
+#      các tam giác dưới theo thứ tự co node. Bước này phụ thuộc trọng số, nên khi độ
+#      tắc đường thay đổi chỉ cần chạy lại bước 2 (vài chục mili giây) chứ không dựng lại.
+# Truy vấn đi lên theo cây khử (elimination tree) từ hai đầu, không cần hàng đợi ưu
+# tiên; cạnh tắt được bung ngược về dãy node gốc nên phần vẽ tuyến giữ nguyên.
+# Thứ tự bậc nhỏ nhất đủ tốt ở quy mô một phường; với cả Hà Nội cây khử sẽ cao và truy
+# vấn khó xuống dưới 1 ms, khi đó cần thứ tự nested dissection (chia đồ thị theo lát cắt nhỏ).
+import hashlib
+import json
+import os
+import shutil
+import sys
+import threading
+from heapq import heappush, heappop
+from typing import NamedTuple
+
+import numpy as np
+
+import routing
+
+FORMAT_VERSION = 1
+ARRAYS = ('rank', 'etree', 'up_offsets', 'up_targets', 'up_source', 'base_arc',
+          'tri_lo', 'tri_hi', 'tri_top', 'weights', 'middle')
+META_FILE = 'meta.json'
+INF = routing.INF
+
+
+class Metric(NamedTuple):
+    version: object
+    weights: list  # trọng số từng cạnh của đồ thị hướng lên
+    middle: list   # node ở giữa của cạnh tắt, -1 nếu là cạnh gốc
+
+
+def contraction_order(cg):
+    # Khử node theo bậc nhỏ nhất (minimum degree); nối mọi cặp hàng xóm còn lại của
+    # node bị khử. Chuỗi node bậc 2 sinh từ việc làm dày đồ thị được khử trước và
+    # không tạo thêm cạnh tắt nào.
+    n = cg.num_nodes
+    offsets, targets = cg.offsets.tolist(), cg.targets.tolist()
+    adj = [set(targets[offsets[v]:offsets[v + 1]]) - {v} for v in range(n)]
+    heap = [(len(adj[v]), v) for v in range(n)]
+    heap.sort()
+    rank = [-1] * n
+    upward = [None] * n
+    r = 0
+    while heap:
+        degree, v = heappop(heap)
+        if rank[v] >= 0 or degree != len(adj[v]):
+            continue
+        rank[v] = r
+        r += 1
+        nbrs = list(adj[v])
+        upward[v] = nbrs
+        for a in nbrs:
+            adj[a].discard(v)
+        for i, a in enumerate(nbrs):
+            for b in nbrs[i + 1:]:
+                if b not in adj[a]:
+                    adj[a].add(b)
+                    adj[b].add(a)
+        for a in nbrs:
+            heappush(heap, (len(adj[a]), a))
+        adj[v] = None
+    return rank, upward
+
+
+def build(cg):
+    rank, upward = contraction_order(cg)
+    n = cg.num_nodes
+    # Cạnh hướng lên của mỗi node được sắp theo hạng tăng dần: cạnh đầu tiên là cha
+    # của node trong cây khử
+    up_offsets = [0] * (n + 1)
+    up_targets, up_source = [], []
+    for v in range(n):
+        nbrs = sorted(upward[v], key=rank.__getitem__)
+        up_targets.extend(nbrs)
+        up_source.extend([v] * len(nbrs))
+        up_offsets[v + 1] = len(up_targets)
+    etree = [up_targets[up_offsets[v]] if up_offsets[v + 1] > up_offsets[v] else -1 for v in range(n)]
+
+    def edge(a, b):
+        for e in range(up_offsets[a], up_offsets[a + 1]):
+            if up_targets[e] == b:
+                return e
+        raise KeyError((a, b))
+
+    base_arc = []
+    for v, w in zip(up_source, up_targets):
+        try:
+            base_arc.append(cg.arc_index(v, w))
+        except KeyError:
+            base_arc.append(-1)  # cạnh tắt thuần túy
+
+    # Tam giác dưới (v, a, b): v hạng thấp nhất, duyệt theo thứ tự hạng của v
+    tri_lo, tri_hi, tri_top = [], [], []
+    for v in sorted(range(n), key=rank.__getitem__):
+        start, end = up_offsets[v], up_offsets[v + 1]
+        for i in range(start, end):
+            for j in range(i + 1, end):
+                tri_lo.append(i)
+                tri_hi.append(j)
+                tri_top.append(edge(up_targets[i], up_targets[j]))
+
+    arrays = {
+        'rank': np.asarray(rank, dtype=np.int32),
+        'etree': np.asarray(etree, dtype=np.int32),
+        'up_offsets': np.asarray(up_offsets, dtype=np.int64),
+        'up_targets': np.asarray(up_targets, dtype=np.int32),
+        'up_source': np.asarray(up_source, dtype=np.int32),
+        'base_arc': np.asarray(base_arc, dtype=np.int64),
+        'tri_lo': np.asarray(tri_lo, dtype=np.int64),
+        'tri_hi': np.asarray(tri_hi, dtype=np.int64),
+        'tri_top': np.asarray(tri_top, dtype=np.int64),
+    }
+    ch = ContractionHierarchy(cg, arrays, {'edge_fingerprint': cg.meta.get('edge_fingerprint'),
+                                           'weights_fingerprint': weights_fingerprint(cg.weights)})
+    metric = ch.customize(cg.weights.tolist())
+    ch.weights = np.asarray(metric.weights, dtype=np.float64)
+    ch.middle = np.asarray(metric.middle, dtype=np.int32)
+    ch.base_metric = metric
+    return ch
+
+
+class ContractionHierarchy:
+    def __init__(self, cg, arrays, meta=None):
+        self.cg = cg
+        for name in ARRAYS:
+            setattr(self, name, arrays.get(name))
+        self.meta = meta or {}
+        self.etree_list = np.asarray(self.etree).tolist()
+        self.up_offsets_list = np.asarray(self.up_offsets).tolist()
+        self.up_targets_list = np.asarray(self.up_targets).tolist()
+        self.base_metric = None
+        if self.weights is not None:
+            self.base_metric = Metric('base', np.asarray(self.weights).tolist(), np.asarray(self.middle).tolist())
+        self._latest = None
+        self._lock = threading.Lock()
+
+    @property
+    def num_edges(self):
+        return len(self.up_targets)
+
+    @property
+    def num_shortcuts(self):
+        return int((np.asarray(self.base_arc) < 0).sum())
+
+    def customize(self, arc_weights, version=None):
+        w = [arc_weights[a] if a >= 0 else INF for a in np.asarray(self.base_arc).tolist()]
+        middle = [-1] * len(w)
+        source = np.asarray(self.up_source).tolist()
+        for i, j, e in zip(np.asarray(self.tri_lo).tolist(), np.asarray(self.tri_hi).tolist(),
+                           np.asarray(self.tri_top).tolist()):
+            c = w[i] + w[j]
+            if c < w[e]:
+                w[e] = c
+                middle[e] = source[i]
+        return Metric(version, w, middle)
+
+    def metric_for(self, version, arc_weights):
+        # Giữ lại bản customization mới nhất theo phiên bản traffic
+        latest = self._latest
+        if latest is not None and latest.version == version:
+            return latest
+        with self._lock:
+            latest = self._latest
+            if latest is None or latest.version != version:
+                latest = self._latest = self.customize(arc_weights, version)
+        return latest
+
+    def _edge(self, low, high):
+        # Cạnh nối hai node, low là node có hạng thấp hơn
+        offsets, targets = self.up_offsets_list, self.up_targets_list
+        for e in range(offsets[low], offsets[low + 1]):
+            if targets[e] == high:
+                return e
+        raise KeyError((low, high))
+
+    def _upward(self, start, w):
+        offsets, targets, etree = self.up_offsets_list, self.up_targets_list, self.etree_list
+        dist = {start: 0.0}
+        parent = {start: (-1, -1)}
+        v = start
+        visited = 0
+        while v != -1:
+            dv = dist.get(v, INF)
+            if dv < INF:
+                visited += 1
+                for e in range(offsets[v], offsets[v + 1]):
+                    x = dv + w[e]
+                    u = targets[e]
+                    if x < dist.get(u, INF):
+                        dist[u] = x
+                        parent[u] = (v, e)
+            v = etree[v]
+        return dist, parent, visited
+
+    def _unpack(self, a, b, e, middle, out):
+        # Thêm vào out các node gốc sau a, tới b, trên cạnh e = (a, b)
+        stack = [(a, b, e)]
+        while stack:
+            a, b, e = stack.pop()
+            m = middle[e]
+            if m < 0:
+                out.append(b)
+            else:
+                stack.append((m, b, self._edge(m, b)))
+                stack.append((a, m, self._edge(m, a)))
+
+    def route(self, source, target, metric=None):
+        metric = metric or self.base_metric
+        w, middle = metric.weights, metric.middle
+        df, pf, vf = self._upward(source, w)
+        dr, pr, vr = self._upward(target, w)
+        best, meet = INF, -1
+        for v, d in df.items():
+            x = d + dr.get(v, INF)
+            if x < best:
+                best, meet = x, v
+        expanded = vf + vr
+        if meet < 0:
+            return routing.Route(INF, [], expanded, len(df) + len(dr))
+        chain = []
+        v = meet
+        while v != source:
+            u, e = pf[v]
+            chain.append((u, v, e))
+            v = u
+        path = [source]
+        for u, v, e in reversed(chain):
+            self._unpack(u, v, e, middle, path)
+        v = meet
+        while v != target:
+            u, e = pr[v]
+            self._unpack(v, u, e, middle, path)
+            v = u
+        return routing.Route(best, path, expanded, len(df) + len(dr))
+
+
+def weights_fingerprint(weights):
+    # Trọng số cơ sở lưu trong CH được customize từ cg.weights: cùng tập cạnh mà độ dài
+    # đổi (sửa graphml) thì CH cũ cho khoảng cách sai
+    return hashlib.sha1(np.ascontiguousarray(weights, dtype=np.float64).tobytes()).hexdigest()
+
+
+def save(ch, path):
+    tmp = f"{path}.tmp-{os.getpid()}"
+    shutil.rmtree(tmp, ignore_errors=True)
+    os.makedirs(tmp)
+    for name in ARRAYS:
+        np.save(os.path.join(tmp, name + '.npy'), np.ascontiguousarray(getattr(ch, name)))
+    meta = dict(ch.meta, format_version=FORMAT_VERSION, num_edges=ch.num_edges, num_shortcuts=ch.num_shortcuts)
+    with open(os.path.join(tmp, META_FILE), 'w', encoding='utf-8') as f:
+        json.dump(meta, f, indent=1)
+    shutil.rmtree(path, ignore_errors=True)
+    try:
+        os.rename(tmp, path)
+    except OSError:
+        shutil.rmtree(tmp, ignore_errors=True)
+
+
+def load(cg, path, mmap=True):
+    try:
+        with open(os.path.join(path, META_FILE), encoding='utf-8') as f:
+            meta = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if (meta.get('format_version') != FORMAT_VERSION or meta.get('edge_fingerprint') != cg.meta.get('edge_fingerprint')
+            or meta.get('weights_fingerprint') != weights_fingerprint(cg.weights)):
+        return None
+    mode = 'r' if mmap else None
+    arrays = {name: np.load(os.path.join(path, name + '.npy'), mmap_mode=mode) for name in ARRAYS}
+    return ContractionHierarchy(cg, arrays, meta)
+
+
+def default_path(graphml_path):
+    return os.path.splitext(graphml_path)[0] + '.ch'
+
+
+def build_or_load(cg, path):
+    ch = load(cg, path)
+    if ch is None:
+        save(build(cg), path)
+        ch = load(cg, path)
+    return ch
+
+
+if __name__ == '__main__':
+    import time
+    import graph_store
+    graphml = sys.argv[1] if len(sys.argv) > 1 else 'phuongmai.graphml'
+    out = sys.argv[2] if len(sys.argv) > 2 else default_path(graphml)
+    cg = graph_store.build_or_load(graphml)
+    start = time.perf_counter()
+    ch = build(cg)
+    save(ch, out)
+    print(f"✅ Đã dựng {out}: {ch.num_edges} cạnh ({ch.num_shortcuts} cạnh tắt) trong {time.perf_counter() - start:.1f} s")
@@ -0,0 +1,197 @@
+# Tra cứu địa chỉ ngoại tuyến từ tên đường trong đồ thị đã biên dịch
+#
+# Tên đường (edge_name của graph_store) được chuẩn hóa: bỏ dấu tiếng Việt, đ -> d, chữ
+# thường, bỏ dấu câu; mỗi tên còn có thêm bí danh không kèm "Phố"/"Đường"/"Đại lộ". Một
+# địa chỉ được so khớp chính xác (gazetteer rồi cache Nominatim), rồi theo tiền tố, rồi gần
+# đúng (difflib) trên chỉ mục này, nên chạy trong vài micro giây và không cần mạng. Khóa
+# ngắn hơn MIN_APPROXIMATE chỉ được khớp chính xác. Kết quả trả về là node của con đường
+# gần tâm của nó nhất.
+# Chỉ khi được yêu cầu (remote=True) mới hỏi Nominatim qua ox.geocode; kết quả trực
+# tuyến được lưu bền trong SQLite để lần sau tra được cả khi mất mạng.
+import difflib
+import re
+import sqlite3
+import threading
+import unicodedata
+from bisect import bisect_left
+from collections import OrderedDict
+from typing import NamedTuple
+
+import numpy as np
+
+GENERIC_PREFIXES = ('pho ', 'duong ', 'dai lo ')
+FUZZY_CUTOFF = 0.75
+PREFIX_SCAN = 64  # số khóa tối đa xét khi khớp tiền tố
+MIN_APPROXIMATE = 3  # số ký tự tối thiểu để khớp tiền tố/gần đúng, tránh "a" -> một con phố bất kỳ
+MEMORY_SIZE = 4096
+
+
+class GeocodeResult(NamedTuple):
+    lat: float
+    lon: float
+    name: str
+    source: str  # 'gazetteer', 'cache' hoặc 'remote'
+
+
+def normalize(text):
+    text = text.replace('đ', 'd').replace('Đ', 'D')
+    text = unicodedata.normalize('NFD', text)
+    text = ''.join(c for c in text if not unicodedata.combining(c))
+    return ' '.join(re.sub(r'[^0-9a-z]+', ' ', text.lower()).split())
+
+
+def _strip_generic(key):
+    for prefix in GENERIC_PREFIXES:
+        if key.startswith(prefix):
+            return key[len(prefix):]
+    return key
+
+
+def propagate_names(cg):
+    # Khi làm dày đồ thị, các đoạn con của một con phố có thể mất tên; kéo tên dọc theo
+    # chuỗi node bậc 2 cho tới ngã ba/ngã tư gần nhất hoặc cạnh đã có tên khác
+    edge_name = np.asarray(cg.edge_name).tolist()
+    offsets = np.asarray(cg.offsets).tolist()
+    arc_edge = np.asarray(cg.arc_edge).tolist()
+    edge_u, edge_v = np.asarray(cg.edge_u).tolist(), np.asarray(cg.edge_v).tolist()
+    stack = [(e, x) for e, name in enumerate(edge_name) if name >= 0 for x in (edge_u[e], edge_v[e])]
+    while stack:
+        e, x = stack.pop()
+        if offsets[x + 1] - offsets[x] != 2:
+            continue
+        a, b = arc_edge[offsets[x]], arc_edge[offsets[x] + 1]
+        nxt = b if a == e else a
+        if edge_name[nxt] >= 0:
+            continue
+        edge_name[nxt] = edge_name[e]
+        stack.append((nxt, edge_v[nxt] if edge_u[nxt] == x else edge_u[nxt]))
+    return np.asarray(edge_name, dtype=np.int32)
+
+
+class Gazetteer:
+    def __init__(self, cg):
+        names = cg.meta.get('names', [])
+        edge_name = propagate_names(cg)
+        lat, lon = np.asarray(cg.lat), np.asarray(cg.lon)
+        named = np.flatnonzero(edge_name >= 0)
+        order = named[np.argsort(edge_name[named], kind='stable')]
+        bounds = np.searchsorted(edge_name[order], np.arange(len(names) + 1))
+        self.entries = []
+        self.index = {}
+        for i, name in enumerate(names):
+            edges = order[bounds[i]:bounds[i + 1]]
+            if not len(edges):
+                continue
+            nodes = np.unique(np.concatenate((np.asarray(cg.edge_u)[edges], np.asarray(cg.edge_v)[edges])))
+            best = nodes[np.argmin((lat[nodes] - lat[nodes].mean()) ** 2 + (lon[nodes] - lon[nodes].mean()) ** 2)]
+            entry = len(self.entries)
+            self.entries.append((name, float(lat[best]), float(lon[best])))
+            for part in name.split('; '):
+                key = normalize(part)
+                for alias in (key, _strip_generic(key)):
+                    if alias:
+                        self.index.setdefault(alias, entry)
+        self.keys = sorted(self.index)
+
+    def __len__(self):
+        return len(self.entries)
+
+    def _result(self, key):
+        name, lat, lon = self.entries[self.index[key]]
+        return GeocodeResult(lat, lon, name, 'gazetteer')
+
+    def _prefix(self, key):
+        i = bisect_left(self.keys, key)
+        matches = []
+        for candidate in self.keys[i:i + PREFIX_SCAN]:
+            if not candidate.startswith(key):
+                break
+            matches.append(candidate)
+        return min(matches, key=len) if matches else None
+
+    def _candidates(self, address):
+        # Cả chuỗi, rồi từng phần giữa các dấu phẩy; bỏ số nhà ở đầu và "Phố"/"Đường"
+        parts = [address] + address.split(',')
+        seen = []
+        for part in parts:
+            key = normalize(part)
+            for variant in (key, re.sub(r'^(so )?\d+[a-z]? ', '', key)):
+                variant = _strip_generic(variant)
+                if variant and variant not in seen:
+                    seen.append(variant)
+        return seen
+
+    def lookup(self, address, approximate=True):
+        candidates = self._candidates(address)
+        for key in candidates:
+            if key in self.index:
+                return self._result(key)
+        if not approximate:
+            return None
+        candidates = [key for key in candidates if len(key) >= MIN_APPROXIMATE]
+        for key in candidates:
+            match = self._prefix(key)
+            if match:
+                return self._result(match)
+        for key in candidates:
+            match = difflib.get_close_matches(key, self.keys, n=1, cutoff=FUZZY_CUTOFF)
+            if match:
+                return self._result(match[0])
+        return None
+
+
+class Geocoder:
+    def __init__(self, gazetteer, cache_path=None):
+        self.gazetteer = gazetteer
+        self._memory = OrderedDict()
+        self._lock = threading.Lock()
+        self._db = None
+        if cache_path:
+            self._db = sqlite3.connect(cache_path, check_same_thread=False)
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute("CREATE TABLE IF NOT EXISTS geocode_cache "
+                             "(query TEXT PRIMARY KEY, lat REAL NOT NULL, lon REAL NOT NULL, name TEXT NOT NULL)")
+
+    def geocode(self, address, remote=False):
+        key = normalize(address)
+        if not key:
+            return None
+        result = self._memory.get(key)
+        if result is not None:
+            return result
+        # Khớp chính xác (kể cả kết quả Nominatim đã lưu) trước khi đoán theo tiền tố/gần đúng
+        result = self.gazetteer.lookup(address, approximate=False) or self._cached(key) or self.gazetteer.lookup(address)
+        if result is None and remote:
+            result = self._remote(key, address)
+        if result is not None:
+            with self._lock:
+                self._memory[key] = result
+                if len(self._memory) > MEMORY_SIZE:
+                    self._memory.popitem(last=False)
+        return result
+
+    def _cached(self, key):
+        if self._db is None:
+            return None
+        with self._lock:
+            row = self._db.execute("SELECT lat, lon, name FROM geocode_cache WHERE query = ?", (key,)).fetchone()
+        return GeocodeResult(row[0], row[1], row[2], 'cache') if row else None
+
+    def _remote(self, key, address):
+        import osmnx as ox
+        try:
+            lat, lon = ox.geocode(address)
+        except (ValueError, OSError) as e:
+            # Nominatim không tìm thấy (InsufficientResponseError là ValueError) hoặc lỗi mạng
+            print(f"⚠️ Không tra cứu được '{address}': {e}")
+            return None
+        if self._db is not None:
+            with self._lock, self._db:
+                self._db.execute("INSERT OR REPLACE INTO geocode_cache (query, lat, lon, name) VALUES (?, ?, ?, ?)",
+                                 (key, lat, lon, address))
+        return GeocodeResult(lat, lon, address, 'remote')
+
+    def close(self):
+        if self._db is not None:
+            self._db.close()
+            self._db = None
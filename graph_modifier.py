@@ -1,111 +1,251 @@
+# Tải đồ thị đi bộ từ OSM và làm dày cạnh (mỗi đoạn dài tối đa ~6 m) để bắt điểm chính xác
+#
+#   python graph_modifier.py
+#   python graph_modifier.py --place "Phường Kim Liên, Đống Đa, Hà Nội, Vietnam" --output kimlien.graphml
+#   python graph_modifier.py --input phuongmai_raw.graphml --workers 4
+#   python graph_modifier.py --input phuongmai.graphml --resimplify
+#
+# Mỗi cạnh (kể cả hình học LineString) được trải thành một dãy tọa độ; toàn bộ điểm chia
+# được tính một lượt bằng NumPy trên các dãy đã ghép liền, rồi đồ thị mới được dựng bằng
+# add_nodes_from/add_edges_from. Cạnh hai chiều chỉ được chia một lần nên hai chiều dùng
+# chung node. ID node mới được cấp tuần tự từ max(ID hiện có, 10**13) nên luôn tất định
+# và không trùng. Cuối cùng biên dịch snapshot định tuyến và contraction hierarchy.
+# --resimplify gộp một file đã làm dày về lại cạnh có hình học trước khi làm dày lại: bản
+# phuongmai.graphml cũ được làm dày bằng công thức khoảng cách đảo lat/lon (độ dài sai tới
+# ~3.7 lần) và mỗi chiều của một con đường được chia riêng thành hai dãy node trùng nhau.
+import argparse
+import time
+import tracemalloc
+from concurrent.futures import ProcessPoolExecutor
+
+import networkx as nx
+import numpy as np
 import osmnx as ox
-from shapely.geometry import LineString
-from math import radians, sin, cos, acos
-from random import randint
 
-# Đọc danh sách ID
-random_id = [int(x) for x in open('random_id.txt').readlines()]
-G = ox.graph_from_place("Phương Mai, Đống Đa, Hà Nội, Vietnam", network_type='walk')
+import contraction
+import graph_store
 
-max_length = 6  # mét
-MAX_EDGE_LENGTH = 500  # Giới hạn cạnh thêm thủ công tối đa 500m
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
 
-nodes = dict()
-cnt = 0
+DEFAULT_PLACE = "Phương Mai, Đống Đa, Hà Nội, Vietnam"
+DEFAULT_OUTPUT = "phuongmai.graphml"
+EARTH_RADIUS = 6371000
+MAX_LENGTH = 6  # mét
+COLLINEAR_TOLERANCE = 1e-9  # độ; điểm chia lệch khỏi đường thẳng ít hơn (~0.1 mm) thì bỏ
+NEW_ID_START = 10 ** 13
+COORD_DIGITS = 7
+DROPPED_ATTRS = ('geometry', 'length')
 
-# Lưu node để dễ tra
-for node in G.nodes(data=True):
-    nodes[node[0]] = node[1]
 
-def get_coordinates(node_id):
+def distances(lat1, lon1, lat2, lon2):
+    # Khoảng cách haversine (mét) giữa từng cặp điểm
+    lat1, lon1, lat2, lon2 = map(np.radians, (lat1, lon1, lat2, lon2))
+    a = np.sin((lat2 - lat1) / 2) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2) ** 2
+    return 2 * EARTH_RADIUS * np.arcsin(np.sqrt(np.minimum(a, 1.0)))
+
+
+def get_coordinates(G, node_id):
     node = G.nodes[node_id]
     return node['y'], node['x']
 
-def calculate_distance(pa, pb):
-    lat1, lon1 = radians(pa[0]), radians(pa[1])
-    lat2, lon2 = radians(pb[0]), radians(pb[1])
-    return acos(sin(lat1)*sin(lat2) + cos(lat1)*cos(lat2)*cos(lon2 - lon1)) * 6371000
-
-def add_edge(node1, node2):
-    global G
-    pa, pb = get_coordinates(node1), get_coordinates(node2)
-    dist = calculate_distance(pa, pb)
-    if dist > MAX_EDGE_LENGTH:
-        print(f"⚠️ Bỏ qua cạnh dài bất thường: {dist:.1f}m giữa {node1} và {node2}")
-        return
-    G.add_edge(node1, node2, length=dist, oneway=False)
-    G.add_edge(node2, node1, length=dist, oneway=False)
-
-# ⚠️ Bỏ dòng này nếu nghi ngờ node sai vùng
-# add_edge(10130399575, 104782499)
-# add_edge(10130399571, 104782499)
-# add_edge(10130399573, 104782499)
-
-def process_edge_linestring(edge):
-    global G, cnt
-    pa = get_coordinates(edge[0])
-    pb = get_coordinates(edge[1])
-    data = edge[2]
-    one_way = data.get('oneway', False)
-
-    if 'geometry' in data:
-        G.remove_edge(edge[0], edge[1])
-        l = list(data['geometry'].coords)
-        idx = [edge[0]]
-        for i in range(1, len(l)-1):
-            G.add_node(random_id[cnt], y=l[i][1], x=l[i][0])
-            nodes[random_id[cnt]] = {'y': l[i][1], 'x': l[i][0]}
-            G.add_edge(random_id[cnt], idx[-1], length=calculate_distance(l[i], l[i-1]), oneway=one_way)
-            if not one_way:
-                G.add_edge(idx[-1], random_id[cnt], length=calculate_distance(l[i], l[i-1]), oneway=False)
-            idx.append(random_id[cnt])
-            cnt += 1
-        G.add_edge(edge[1], idx[-1], length=calculate_distance(l[-1], l[-2]), oneway=one_way)
-        if not one_way:
-            G.add_edge(idx[-1], edge[1], length=calculate_distance(l[-1], l[-2]), oneway=False)
-
-def process_long_edge(edge):
-    global G, cnt
-    pa = get_coordinates(edge[0])
-    pb = get_coordinates(edge[1])
-    data = edge[2]
-    one_way = data.get('oneway', False)
-    length = calculate_distance(pa, pb)
-    if length <= 2 * max_length:
-        return
-    try:
-        G.remove_edge(edge[0], edge[1])
-        G.remove_edge(edge[1], edge[0])
-    except:
-        pass
-
-    increment = max_length / length
-    dy = (pb[0] - pa[0]) * increment
-    dx = (pb[1] - pa[1]) * increment
-    newnodes_id = [edge[0]]
-    newnodes_coor = [pa]
-
-    for i in range(1, int(length / max_length)):
-        coor = (pa[0] + dy * i, pa[1] + dx * i)
-        G.add_node(random_id[cnt], y=coor[0], x=coor[1])
-        nodes[random_id[cnt]] = {'y': coor[0], 'x': coor[1]}
-        G.add_edge(random_id[cnt], newnodes_id[-1], length=calculate_distance(newnodes_coor[-1], coor), oneway=one_way)
-        if not one_way:
-            G.add_edge(newnodes_id[-1], random_id[cnt], length=calculate_distance(newnodes_coor[-1], coor), oneway=False)
-        newnodes_coor.append(coor)
-        newnodes_id.append(random_id[cnt])
-        cnt += 1
-
-    G.add_edge(edge[1], newnodes_id[-1], length=calculate_distance(newnodes_coor[-1], pb), oneway=one_way)
-    if not one_way:
-        G.add_edge(newnodes_id[-1], edge[1], length=calculate_distance(newnodes_coor[-1], pb), oneway=False)
-
-# Xử lý toàn bộ edge
-from copy import deepcopy
-for edge in deepcopy(G.edges(data=True)):
-    process_edge_linestring(edge)
-for edge in deepcopy(G.edges(data=True)):
-    process_long_edge(edge)
-
-ox.save_graphml(G, "phuongmai.graphml")
-print("✅ Đã tạo lại phuongmai.graphml an toàn.")
+
+def collapse_chains(G, tolerance=COLLINEAR_TOLERANCE):
+    # Gộp các node bậc 2 của một đồ thị đã làm dày thành cạnh có hình học LineString; điểm
+    # chia thẳng hàng bị lược đi nên hai dãy node của cùng một con đường cho cùng hình học
+    # và collect_polylines() gộp chúng lại thành một
+    G.graph['simplified'] = False
+    H = ox.simplify_graph(G)
+    for _, _, data in H.edges(data=True):
+        if 'geometry' in data:
+            data['geometry'] = data['geometry'].simplify(tolerance, preserve_topology=False)
+    return H
+
+
+def collect_polylines(G):
+    # Gom các cung thành dãy tọa độ không hướng: cung (u, v) và cung ngược (v, u) có cùng
+    # hình học chỉ tạo một dãy, kèm thuộc tính của từng chiều (None nếu không có chiều đó)
+    polylines = {}
+    for u, v, data in G.edges(data=True):
+        if 'geometry' in data:
+            coords = [(y, x) for x, y in data['geometry'].coords]
+            coords[0], coords[-1] = get_coordinates(G, u), get_coordinates(G, v)
+        else:
+            coords = [get_coordinates(G, u), get_coordinates(G, v)]
+        # So khớp hai chiều theo tọa độ làm tròn ~1 cm để sai số dấu phẩy động không tách đôi cạnh
+        rounded = tuple((round(y, COORD_DIGITS), round(x, COORD_DIGITS)) for y, x in coords)
+        forward = (u, v, rounded)
+        backward = (v, u, rounded[::-1])
+        if forward <= backward:
+            key, slot = forward, 1
+        else:
+            key, slot, coords = backward, 2, coords[::-1]
+        entry = polylines.setdefault(key, [coords, None, None])
+        if entry[slot] is None:
+            entry[slot] = {k: value for k, value in data.items() if k not in DROPPED_ATTRS}
+    ends = np.array([(u, v) for u, v, _ in polylines], dtype=np.int64).reshape(-1, 2)
+    entries = list(polylines.values())
+    counts = np.array([len(entry[0]) for entry in entries], dtype=np.int64)
+    offsets = np.zeros(len(counts) + 1, dtype=np.int64)
+    np.cumsum(counts, out=offsets[1:])
+    points = np.array([p for entry in entries for p in entry[0]], dtype=np.float64).reshape(-1, 2)
+    attrs = [(entry[1], entry[2]) for entry in entries]
+    return ends, points[:, 0].copy(), points[:, 1].copy(), offsets, attrs
+
+
+def densify_chunk(lat, lon, offsets, max_length):
+    # Chia mọi đoạn dài hơn 2 * max_length thành int(L / max_length) đoạn đều nhau (đoạn cuối
+    # nhận phần dư). Trả về (lat, lon, offsets) của các dãy đã làm dày.
+    n = len(lat)
+    last = np.zeros(n, dtype=bool)
+    last[offsets[1:] - 1] = True
+    a = np.flatnonzero(~last)
+    seg_len = distances(lat[a], lon[a], lat[a + 1], lon[a + 1])
+    pieces = np.where(seg_len > 2 * max_length, np.floor(seg_len / max_length), 1).astype(np.int64)
+    extra = np.zeros(n, dtype=np.int64)
+    extra[a] = pieces - 1
+    pos = np.zeros(n + 1, dtype=np.int64)
+    np.cumsum(1 + extra, out=pos[1:])
+    out_lat = np.empty(pos[-1])
+    out_lon = np.empty(pos[-1])
+    out_lat[pos[:-1]] = lat
+    out_lon[pos[:-1]] = lon
+    new_count = pieces - 1
+    seg = np.repeat(np.arange(len(a)), new_count)
+    starts = np.zeros(len(a) + 1, dtype=np.int64)
+    np.cumsum(new_count, out=starts[1:])
+    j = np.arange(starts[-1]) - np.repeat(starts[:-1], new_count) + 1
+    t = j * max_length / seg_len[seg]
+    s = a[seg]
+    out_lat[pos[s] + j] = lat[s] + (lat[s + 1] - lat[s]) * t
+    out_lon[pos[s] + j] = lon[s] + (lon[s + 1] - lon[s]) * t
+    return out_lat, out_lon, pos[offsets]
+
+
+def _densify_task(args):
+    return densify_chunk(*args)
+
+
+def densify_points(lat, lon, offsets, max_length, workers=0):
+    # Chia các dãy tọa độ thành từng khối, mỗi khối xử lý trong một tiến trình; ghép kết
+    # quả theo đúng thứ tự khối để ID sau đó vẫn tất định
+    if workers <= 1:
+        return densify_chunk(lat, lon, offsets, max_length)
+    bounds = np.linspace(0, len(offsets) - 1, workers + 1).astype(np.int64)
+    tasks = []
+    for lo, hi in zip(bounds[:-1], bounds[1:]):
+        if hi > lo:
+            begin, end = offsets[lo], offsets[hi]
+            tasks.append((lat[begin:end], lon[begin:end], offsets[lo:hi + 1] - begin, max_length))
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        results = list(pool.map(_densify_task, tasks))
+    out_offsets = [np.zeros(1, dtype=np.int64)]
+    base = 0
+    for _, _, chunk_offsets in results:
+        out_offsets.append(chunk_offsets[1:] + base)
+        base += chunk_offsets[-1]
+    return (np.concatenate([r[0] for r in results]), np.concatenate([r[1] for r in results]),
+            np.concatenate(out_offsets))
+
+
+def densify_graph(G, max_length=MAX_LENGTH, workers=0):
+    ends, lat, lon, offsets, attrs = collect_polylines(G)
+    out_lat, out_lon, out_offsets = densify_points(lat, lon, offsets, max_length, workers)
+
+    # Điểm đầu/cuối mỗi dãy là node cũ, các điểm trong được cấp ID mới
+    total = len(out_lat)
+    first, last = out_offsets[:-1], out_offsets[1:] - 1
+    interior = np.ones(total, dtype=bool)
+    interior[first] = False
+    interior[last] = False
+    new_index = np.flatnonzero(interior)
+    start = max(max(G.nodes, default=0), NEW_ID_START - 1) + 1
+    ids = np.empty(total, dtype=np.int64)
+    ids[first] = ends[:, 0]
+    ids[last] = ends[:, 1]
+    ids[new_index] = start + np.arange(len(new_index))
+
+    end_mask = np.zeros(total, dtype=bool)
+    end_mask[last] = True
+    a = np.flatnonzero(~end_mask)
+    lengths = distances(out_lat[a], out_lon[a], out_lat[a + 1], out_lon[a + 1])
+    owner = np.repeat(np.arange(len(attrs)), np.diff(out_offsets) - 1)
+
+    edges = []
+    for u, v, p, length in zip(ids[a].tolist(), ids[a + 1].tolist(), owner.tolist(), lengths.tolist()):
+        forward, backward = attrs[p]
+        if forward is not None:
+            edges.append((u, v, dict(forward, length=length)))
+        if backward is not None:
+            edges.append((v, u, dict(backward, length=length)))
+
+    H = nx.MultiDiGraph(**G.graph)
+    H.add_nodes_from(G.nodes(data=True))
+    H.add_nodes_from((node, {'y': y, 'x': x}) for node, y, x in
+                     zip(ids[new_index].tolist(), out_lat[new_index].tolist(), out_lon[new_index].tolist()))
+    H.add_edges_from(edges)
+    return H
+
+
+class Stage:
+    # Đo thời gian và bộ nhớ đỉnh của từng bước
+    def __init__(self, name, trace_memory=False):
+        self.name = name
+        self.trace_memory = trace_memory
+
+    def __enter__(self):
+        if self.trace_memory:
+            tracemalloc.reset_peak()
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        elapsed = time.perf_counter() - self.start
+        memory = ""
+        if self.trace_memory:
+            memory = f", Python cấp phát đỉnh {tracemalloc.get_traced_memory()[1] / 2 ** 20:.1f} MB"
+        if resource is not None:
+            memory += f", RSS đỉnh {resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024:.1f} MB"
+        print(f"⏱ {self.name}: {elapsed:.2f} s{memory}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Tải và làm dày đồ thị đi bộ")
+    parser.add_argument('--place', default=DEFAULT_PLACE)
+    parser.add_argument('--network-type', default='walk')
+    parser.add_argument('--input', help="làm dày file GraphML có sẵn thay vì tải từ OSM")
+    parser.add_argument('--output', default=DEFAULT_OUTPUT)
+    parser.add_argument('--resimplify', action='store_true', help="gộp node bậc 2 của file --input đã làm dày trước khi làm dày lại")
+    parser.add_argument('--max-length', type=float, default=MAX_LENGTH)
+    parser.add_argument('--workers', type=int, default=0, help="số tiến trình chia điểm (0 = chạy tuần tự)")
+    parser.add_argument('--trace-memory', action='store_true', help="đo bộ nhớ cấp phát bằng tracemalloc (chậm hơn)")
+    args = parser.parse_args()
+
+    if args.trace_memory:
+        tracemalloc.start()
+    with Stage("Tải đồ thị", args.trace_memory):
+        if args.input:
+            G = ox.load_graphml(args.input)
+        else:
+            G = ox.graph_from_place(args.place, network_type=args.network_type)
+    if args.resimplify:
+        with Stage("Gộp node bậc 2", args.trace_memory):
+            G = collapse_chains(G)
+    print(f"Đồ thị gốc: {G.number_of_nodes()} node, {G.number_of_edges()} cung")
+    with Stage("Làm dày", args.trace_memory):
+        G = densify_graph(G, args.max_length, args.workers)
+    print(f"Đồ thị mới: {G.number_of_nodes()} node, {G.number_of_edges()} cung")
+    with Stage("Ghi GraphML", args.trace_memory):
+        ox.save_graphml(G, args.output)
+    print(f"✅ Đã tạo lại {args.output} an toàn.")
+    with Stage("Biên dịch snapshot", args.trace_memory):
+        cg = graph_store.compile_graph(G)
+        graph_store.save_compiled(cg, graph_store.default_path(args.output), args.output)
+        contraction.save(contraction.build(cg), contraction.default_path(args.output))
+    print("✅ Đã biên dịch snapshot định tuyến.")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,280 @@
+# Đồ thị định tuyến đã biên dịch (compiled routing graph)
+#
+# Node ID của OSM được đánh lại thành chỉ số nguyên liên tục 0..n-1 (theo thứ tự
+# tăng dần của ID gốc), danh sách kề lưu dạng CSR: các cạnh kề của node i nằm ở
+# targets[offsets[i]:offsets[i+1]] với độ dài tương ứng trong weights.
+# Mỗi cạnh vô hướng có một ID liên tục (edge_u < edge_v), arc_edge ánh xạ từng cung
+# CSR về ID cạnh đó; dữ liệu gắn với cạnh (độ tắc đường...) được đánh chỉ số theo ID này.
+# Hình học của cạnh (geometry của OSMnx hoặc đoạn thẳng giữa hai node) được trải phẳng
+# vào geom_lat/geom_lon, điểm của cạnh e nằm ở [geom_offsets[e], geom_offsets[e+1]) theo
+# chiều edge_u -> edge_v.
+# Tên đường của cạnh: edge_name[e] là chỉ số trong meta['names'] (-1 nếu cạnh không có tên);
+# cạnh mang nhiều tên trong OSM được nối bằng '; '.
+# Tùy chọn: landmarks/landmark_dist (khoảng cách ngắn nhất từ vài landmark tới mọi node)
+# cho chế độ tìm đường ALT của routing.RoutingEngine.
+# Mỗi mảng được ghi thành một file .npy trong thư mục snapshot và được mở bằng
+# memory-map, nên khởi động chỉ mất vài mili giây và nhiều worker cùng đọc chung
+# một bản trang nhớ (page cache) của hệ điều hành.
+import hashlib
+import json
+import os
+import shutil
+import sys
+
+import numpy as np
+
+FORMAT_VERSION = 5
+ARRAYS = ('node_ids', 'lat', 'lon', 'offsets', 'targets', 'weights', 'arc_edge', 'edge_u', 'edge_v',
+          'geom_offsets', 'geom_lat', 'geom_lon', 'edge_name')
+OPTIONAL_ARRAYS = ('landmarks', 'landmark_dist')
+META_FILE = 'meta.json'
+
+
+class CompiledGraph:
+    def __init__(self, arrays, meta=None):
+        for name in ARRAYS:
+            setattr(self, name, arrays[name])
+        for name in OPTIONAL_ARRAYS:
+            setattr(self, name, arrays.get(name))
+        self.meta = meta or {}
+
+    @property
+    def num_nodes(self):
+        return len(self.node_ids)
+
+    @property
+    def num_arcs(self):
+        return len(self.targets)
+
+    @property
+    def num_edges(self):
+        return len(self.edge_u)
+
+    def index_of(self, node_id):
+        i = int(np.searchsorted(self.node_ids, node_id))
+        if i == len(self.node_ids) or self.node_ids[i] != node_id:
+            raise KeyError(node_id)
+        return i
+
+    def indices_of(self, node_ids):
+        node_ids = np.asarray(node_ids, dtype=np.int64)
+        idx = np.searchsorted(self.node_ids, node_ids)
+        idx[idx == len(self.node_ids)] = 0
+        if not np.array_equal(self.node_ids[idx], node_ids):
+            missing = node_ids[self.node_ids[idx] != node_ids]
+            raise KeyError(int(missing[0]))
+        return idx
+
+    def neighbors(self, i):
+        start, end = self.offsets[i], self.offsets[i + 1]
+        return self.targets[start:end], self.weights[start:end]
+
+    def arc_index(self, u, v):
+        start, end = int(self.offsets[u]), int(self.offsets[u + 1])
+        for k in range(start, end):
+            if self.targets[k] == v:
+                return k
+        raise KeyError((u, v))
+
+    def path_arcs(self, path):
+        return [self.arc_index(u, v) for u, v in zip(path[:-1], path[1:])]
+
+    def edge_index(self, u, v):
+        return int(self.arc_edge[self.arc_index(u, v)])
+
+
+def compile_graph(G, landmarks=None):
+    # Giữ nguyên ngữ nghĩa của danh sách kề cũ trong map_app.py: mỗi cạnh u->v của
+    # MultiDiGraph được đi theo cả hai chiều với trọng số 'length'. Cạnh song song
+    # chỉ giữ lại cạnh ngắn nhất, bỏ vòng lặp (u == v).
+    node_ids = np.fromiter(G.nodes, dtype=np.int64, count=G.number_of_nodes())
+    order = np.argsort(node_ids, kind='stable')
+    node_ids = node_ids[order]
+    lat = np.array([G.nodes[n]['y'] for n in node_ids.tolist()], dtype=np.float64)
+    lon = np.array([G.nodes[n]['x'] for n in node_ids.tolist()], dtype=np.float64)
+
+    m = G.number_of_edges()
+    us = np.empty(m, dtype=np.int64)
+    vs = np.empty(m, dtype=np.int64)
+    lengths = np.empty(m, dtype=np.float64)
+    geometries = {}
+    names = {}
+    name_of = np.full(m, -1, dtype=np.int32)
+    for k, (u, v, data) in enumerate(G.edges(data=True)):
+        us[k], vs[k], lengths[k] = u, v, float(data['length'])
+        if 'geometry' in data:
+            geometries[k] = data['geometry']
+        name = data.get('name')
+        if name:
+            if isinstance(name, (list, tuple)):
+                name = '; '.join(name)
+            name_of[k] = names.setdefault(name, len(names))
+    u_idx = np.searchsorted(node_ids, us)
+    v_idx = np.searchsorted(node_ids, vs)
+
+    src = np.concatenate([u_idx, v_idx])
+    dst = np.concatenate([v_idx, u_idx])
+    w = np.concatenate([lengths, lengths])
+    origin = np.concatenate([np.arange(m), np.arange(m)])  # cạnh gốc của G sinh ra cung
+    keep = src != dst
+    src, dst, w, origin = src[keep], dst[keep], w[keep], origin[keep]
+
+    # Sắp theo (src, dst, w) rồi lấy phần tử đầu của mỗi cặp (src, dst)
+    order = np.lexsort((w, dst, src))
+    src, dst, w, origin = src[order], dst[order], w[order], origin[order]
+    first = np.ones(len(src), dtype=bool)
+    first[1:] = (src[1:] != src[:-1]) | (dst[1:] != dst[:-1])
+    src, dst, w, origin = src[first], dst[first], w[first], origin[first]
+
+    offsets = np.zeros(len(node_ids) + 1, dtype=np.int64)
+    np.cumsum(np.bincount(src, minlength=len(node_ids)), out=offsets[1:])
+
+    # Danh sách kề đối xứng nên mỗi cạnh vô hướng ứng với đúng hai cung
+    forward = src < dst
+    edge_u, edge_v = src[forward], dst[forward]
+    n = np.int64(len(node_ids))
+    edge_keys = edge_u * n + edge_v
+    arc_edge = np.searchsorted(edge_keys, np.minimum(src, dst) * n + np.maximum(src, dst))
+    geom_offsets, geom_lat, geom_lon = _pack_geometry(lat, lon, edge_u, edge_v, origin[forward], u_idx, geometries)
+    arrays = {
+        'node_ids': node_ids,
+        'lat': lat,
+        'lon': lon,
+        'offsets': offsets,
+        'targets': dst.astype(np.int32),
+        'weights': w,
+        'arc_edge': arc_edge.astype(np.int32),
+        'edge_u': edge_u.astype(np.int32),
+        'edge_v': edge_v.astype(np.int32),
+        'geom_offsets': geom_offsets,
+        'geom_lat': geom_lat,
+        'geom_lon': geom_lon,
+        'edge_name': name_of[origin[forward]],
+    }
+    cg = CompiledGraph(arrays, {'format_version': FORMAT_VERSION, 'edge_fingerprint': edge_fingerprint(node_ids, edge_u, edge_v),
+                                'names': list(names)})
+    add_landmarks(cg, landmarks)
+    return cg
+
+
+def add_landmarks(cg, k=None):
+    import routing
+    if k is None:
+        k = routing.NUM_LANDMARKS
+    if k > 0:
+        cg.landmarks, cg.landmark_dist = routing.compute_landmarks(cg, k)
+    return cg
+
+
+def _pack_geometry(lat, lon, edge_u, edge_v, origin, origin_u, geometries):
+    counts = np.full(len(edge_u), 2, dtype=np.int64)
+    shapes = {}
+    for e, k in enumerate(origin.tolist()):
+        geom = geometries.get(k)
+        if geom is None:
+            continue
+        coords = np.asarray(geom.coords, dtype=np.float64)
+        if origin_u[k] != edge_u[e]:
+            coords = coords[::-1]  # geometry của G đi theo chiều v -> u
+        shapes[e] = coords
+        counts[e] = len(coords)
+    geom_offsets = np.zeros(len(edge_u) + 1, dtype=np.int64)
+    np.cumsum(counts, out=geom_offsets[1:])
+    geom_lat = np.empty(geom_offsets[-1], dtype=np.float64)
+    geom_lon = np.empty(geom_offsets[-1], dtype=np.float64)
+    starts = geom_offsets[:-1]
+    geom_lat[starts], geom_lon[starts] = lat[edge_u], lon[edge_u]
+    geom_lat[starts + 1], geom_lon[starts + 1] = lat[edge_v], lon[edge_v]
+    for e, coords in shapes.items():
+        geom_lon[starts[e]:starts[e] + len(coords)] = coords[:, 0]
+        geom_lat[starts[e]:starts[e] + len(coords)] = coords[:, 1]
+    return geom_offsets, geom_lat, geom_lon
+
+
+def edge_fingerprint(node_ids, edge_u, edge_v):
+    # Dữ liệu lưu theo ID cạnh (traffic.sqlite...) chỉ còn đúng khi tập cạnh không đổi
+    h = hashlib.sha1()
+    h.update(np.ascontiguousarray(node_ids[edge_u]).tobytes())
+    h.update(np.ascontiguousarray(node_ids[edge_v]).tobytes())
+    return h.hexdigest()
+
+
+def _source_stamp(graphml_path):
+    st = os.stat(graphml_path)
+    return {'source': os.path.basename(graphml_path), 'source_size': st.st_size, 'source_mtime_ns': st.st_mtime_ns}
+
+
+def save_compiled(cg, path, graphml_path=None):
+    meta = dict(cg.meta, format_version=FORMAT_VERSION, num_nodes=cg.num_nodes, num_arcs=cg.num_arcs)
+    if graphml_path:
+        meta.update(_source_stamp(graphml_path))
+    # Ghi vào thư mục tạm rồi đổi tên để worker khác không bao giờ đọc snapshot dở dang
+    tmp = f"{path}.tmp-{os.getpid()}"
+    shutil.rmtree(tmp, ignore_errors=True)
+    os.makedirs(tmp)
+    for name in ARRAYS + OPTIONAL_ARRAYS:
+        if getattr(cg, name, None) is not None:
+            np.save(os.path.join(tmp, name + '.npy'), np.ascontiguousarray(getattr(cg, name)))
+    with open(os.path.join(tmp, META_FILE), 'w', encoding='utf-8') as f:
+        json.dump(meta, f, indent=1)
+    shutil.rmtree(path, ignore_errors=True)
+    try:
+        os.rename(tmp, path)
+    except OSError:
+        # Một tiến trình khác vừa ghi xong snapshot giống hệt
+        shutil.rmtree(tmp, ignore_errors=True)
+
+
+def read_meta(path):
+    try:
+        with open(os.path.join(path, META_FILE), encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def load_compiled(path, mmap=True):
+    meta = read_meta(path)
+    if meta is None or meta.get('format_version') != FORMAT_VERSION:
+        raise ValueError(f"{path} không phải snapshot đồ thị phiên bản {FORMAT_VERSION}")
+    mode = 'r' if mmap else None
+    arrays = {name: np.load(os.path.join(path, name + '.npy'), mmap_mode=mode) for name in ARRAYS}
+    for name in OPTIONAL_ARRAYS:
+        if os.path.exists(os.path.join(path, name + '.npy')):
+            arrays[name] = np.load(os.path.join(path, name + '.npy'), mmap_mode=mode)
+    return CompiledGraph(arrays, meta)
+
+
+def is_fresh(path, graphml_path):
+    meta = read_meta(path)
+    if meta is None or meta.get('format_version') != FORMAT_VERSION:
+        return False
+    if not os.path.exists(graphml_path):
+        return True
+    stamp = _source_stamp(graphml_path)
+    return all(meta.get(k) == v for k, v in stamp.items())
+
+
+def compile_graphml(graphml_path, path):
+    import osmnx as ox
+    cg = compile_graph(ox.load_graphml(graphml_path))
+    save_compiled(cg, path, graphml_path)
+
+
+def default_path(graphml_path):
+    return os.path.splitext(graphml_path)[0] + '.graph'
+
+
+def build_or_load(graphml_path, path=None):
+    # Chỉ parse GraphML khi snapshot chưa có hoặc đã cũ hơn file nguồn
+    path = path or default_path(graphml_path)
+    if not is_fresh(path, graphml_path):
+        compile_graphml(graphml_path, path)
+    return load_compiled(path)
+
+
+if __name__ == '__main__':
+    graphml = sys.argv[1] if len(sys.argv) > 1 else 'phuongmai.graphml'
+    out = sys.argv[2] if len(sys.argv) > 2 else default_path(graphml)
+    compile_graphml(graphml, out)
+    print(f"✅ Đã biên dịch {graphml} -> {out}")
@@ -0,0 +1,127 @@
+# Đo thời gian từng bước và bộ đếm cho một lượt chạy (rerun) của map_app.py
+#
+# Bật bằng biến môi trường PHUONGMAI_DEBUG=1 hoặc thêm ?debug=1 vào URL, không cần sửa
+# code. Khi tắt, mọi lời gọi đi vào NULL_RECORDER: stage() trả về cùng một context
+# manager rỗng, count()/tag() không làm gì, nên chi phí chỉ còn một lần gọi hàm.
+# Khi bật, mỗi lượt chạy được ghi thành một dòng JSON vào file metrics (mặc định
+# metrics.jsonl, đổi bằng PHUONGMAI_METRICS_FILE) để tổng hợp về sau.
+import json
+import os
+import threading
+import time
+
+ENV_FLAG = 'PHUONGMAI_DEBUG'
+METRICS_ENV = 'PHUONGMAI_METRICS_FILE'
+DEFAULT_METRICS_FILE = 'metrics.jsonl'
+TRUE_VALUES = ('1', 'true', 'yes', 'on')
+
+_write_lock = threading.Lock()
+
+
+def is_enabled(query_value=None):
+    # query_value là giá trị tham số ?debug= của URL (nếu có)
+    if os.environ.get(ENV_FLAG, '').lower() in TRUE_VALUES:
+        return True
+    if isinstance(query_value, (list, tuple)):
+        query_value = query_value[-1] if query_value else None
+    return str(query_value).lower() in TRUE_VALUES
+
+
+def metrics_path():
+    return os.environ.get(METRICS_ENV, DEFAULT_METRICS_FILE)
+
+
+class _Timer:
+    __slots__ = ('recorder', 'name', 'start')
+
+    def __init__(self, recorder, name):
+        self.recorder = recorder
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        elapsed = (time.perf_counter() - self.start) * 1000
+        stages = self.recorder.stages
+        stages[self.name] = stages.get(self.name, 0.0) + elapsed
+        return False
+
+
+class Recorder:
+    enabled = True
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.stages = {}    # tên bước -> tổng thời gian (ms), theo thứ tự chạy
+        self.counters = {}
+        self.tags = {}
+
+    def stage(self, name):
+        return _Timer(self, name)
+
+    def count(self, name, value=1):
+        self.counters[name] = self.counters.get(name, 0) + value
+
+    def peak(self, name, value):
+        # Bộ đếm giữ giá trị lớn nhất thay vì cộng dồn (vd. kích thước heap lớn nhất)
+        self.counters[name] = max(self.counters.get(name, value), value)
+
+    def tag(self, **tags):
+        self.tags.update(tags)
+
+    @property
+    def total_ms(self):
+        return (time.perf_counter() - self.started) * 1000
+
+    def to_dict(self):
+        return {
+            'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'total_ms': round(self.total_ms, 3),
+            'stages': {name: round(ms, 3) for name, ms in self.stages.items()},
+            'counters': dict(self.counters),
+            'tags': dict(self.tags),
+        }
+
+    def write(self, path=None):
+        line = json.dumps(self.to_dict(), ensure_ascii=False, default=str)
+        with _write_lock, open(path or metrics_path(), 'a', encoding='utf-8') as f:
+            f.write(line + '\n')
+
+
+class _NullTimer:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+class NullRecorder:
+    enabled = False
+    _timer = _NullTimer()
+
+    def stage(self, name):
+        return self._timer
+
+    def count(self, name, value=1):
+        pass
+
+    def peak(self, name, value):
+        pass
+
+    def tag(self, **tags):
+        pass
+
+    def write(self, path=None):
+        pass
+
+
+NULL_RECORDER = NullRecorder()
+
+
+def recorder(query_value=None):
+    return Recorder() if is_enabled(query_value) else NULL_RECORDER
@@ -0,0 +1,110 @@
+# Vùng đi tới được trong N phút (isochrone) từ một điểm
+#
+# Một lượt Dijkstra trên mảng CSR của đồ thị biên dịch, dừng ở MAX_MINUTES, cho thời gian
+# tới từng node theo trọng số đã tính độ tắc (traffic.TrafficWeights) và tốc độ phương
+# tiện. Từ đó mỗi cạnh có "thời gian đi hết cạnh" (nhỏ nhất theo hai chiều); kết quả được
+# nhớ theo (node xuất phát, phương tiện, phiên bản traffic), nên kéo thanh số phút chỉ lọc
+# lại mảng này bằng NumPy mà không tìm kiếm lại. Các cạnh đi tới được được gộp thành vài
+# lớp GeoJSON MultiLineString theo khoảng thời gian.
+import math
+import threading
+from collections import OrderedDict
+from heapq import heappush, heappop
+from typing import NamedTuple
+
+import numpy as np
+
+MAX_MINUTES = 30
+BANDS = 4
+MEMO_SIZE = 256
+INF = math.inf
+
+
+class Reach(NamedTuple):
+    node_times: np.ndarray  # giây tới từng node; inf nếu quá MAX_MINUTES hoặc không tới được
+    edge_times: np.ndarray  # giây để đi hết từng cạnh
+
+
+class Band(NamedTuple):
+    minutes: float     # cận trên của lớp
+    edges: np.ndarray  # ID cạnh
+    geojson: dict
+
+
+class IsochroneEngine:
+    def __init__(self, cg, maxsize=MEMO_SIZE):
+        self.cg = cg
+        self.n = cg.num_nodes
+        self.offsets = cg.offsets.tolist()
+        self.targets = cg.targets.tolist()
+        offsets = np.asarray(cg.offsets)
+        self.arc_source = np.repeat(np.arange(self.n), np.diff(offsets))
+        self.arc_edge = np.asarray(cg.arc_edge)
+        self.edge_length = np.zeros(cg.num_edges)
+        np.maximum.at(self.edge_length, self.arc_edge, np.asarray(cg.weights, dtype=np.float64))
+        self.geom_offsets = np.asarray(cg.geom_offsets)
+        self.points = np.column_stack((np.asarray(cg.geom_lon), np.asarray(cg.geom_lat))).tolist()
+        self.maxsize = maxsize
+        self._memo = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def search(self, source, weights, limit):
+        # Dijkstra từ source, không mở rộng node có chi phí vượt limit (cùng đơn vị với weights)
+        offsets, targets = self.offsets, self.targets
+        dist = [INF] * self.n
+        dist[source] = 0.0
+        heap = [(0.0, source)]
+        while heap:
+            d, v = heappop(heap)
+            if d > dist[v]:
+                continue
+            for k in range(offsets[v], offsets[v + 1]):
+                nd = d + weights[k]
+                u = targets[k]
+                if nd < dist[u] and nd <= limit:
+                    dist[u] = nd
+                    heappush(heap, (nd, u))
+        return np.array(dist)
+
+    def reach(self, source, weights, speed_mps, key=None):
+        # key nhận diện (source, phương tiện, phiên bản traffic); None thì không nhớ kết quả
+        if key is not None:
+            with self._lock:
+                cached = self._memo.get(key)
+                if cached is not None:
+                    self._memo.move_to_end(key)
+                    self.hits += 1
+                    return cached
+                self.misses += 1
+        costs = self.search(source, weights, MAX_MINUTES * 60 * speed_mps)
+        node_times = costs / speed_mps
+        arc_times = node_times[self.arc_source] + np.asarray(weights, dtype=np.float64) / speed_mps
+        edge_times = np.full(self.cg.num_edges, INF)
+        np.minimum.at(edge_times, self.arc_edge, arc_times)
+        result = Reach(node_times, edge_times)
+        if key is not None:
+            with self._lock:
+                self._memo[key] = result
+                if len(self._memo) > self.maxsize:
+                    self._memo.popitem(last=False)
+        return result
+
+    def bands(self, reach, minutes, count=BANDS):
+        # Chia [0, minutes] thành count lớp đều nhau; mỗi cạnh thuộc lớp của thời gian đi hết cạnh
+        limit = minutes * 60
+        edges = np.flatnonzero(reach.edge_times <= limit)
+        band = np.minimum((reach.edge_times[edges] / limit * count).astype(np.int64), count - 1)
+        return [Band(minutes * (i + 1) / count, edges[band == i], self.geojson(edges[band == i]))
+                for i in range(count)]
+
+    def geojson(self, edges):
+        starts, ends = self.geom_offsets[edges].tolist(), self.geom_offsets[edges + 1].tolist()
+        points = self.points
+        lines = [points[a:b] for a, b in zip(starts, ends)]
+        return {'type': 'Feature', 'properties': {}, 'geometry': {'type': 'MultiLineString', 'coordinates': lines}}
+
+    def reachable_length(self, reach, minutes):
+        # Tổng độ dài (mét) các cạnh đi hết được trong minutes phút
+        return float(self.edge_length[reach.edge_times <= minutes * 60].sum())
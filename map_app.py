@@ -1,18 +1,24 @@
+import datetime
+import os
 import streamlit as st
 import folium
 from streamlit_folium import st_folium
 import osmnx as ox
-from shapely.geometry import LineString
-from heapq import *
-from collections import defaultdict
-import math
-
-def calculate_distance(pa, pb):  # Calculate distance between two points
-    lat1, lon1 = pa
-    lat2, lon2 = pb
-    lat1, lon1 = math.radians(lat1), math.radians(lon1)
-    lat2, lon2 = math.radians(lat2), math.radians(lon2)
-    return math.acos(math.sin(lat1) * math.sin(lat2) + math.cos(lat1) * math.cos(lat2) * math.cos(lon2 - lon1)) * 6371000
+import graph_store
+import routing
+import route_cache
+import spatial_index
+import traffic
+import traffic_profiles
+import traffic_store
+import route_geometry
+import contraction
+import geocoder
+import instrumentation
+import isochrone
+import routing_client
+import routing_service
+import tour
 
 def get_traffic_color(level):
     colors = [
@@ -35,12 +41,24 @@ def get_traffic_color(level):
     
     return '#00FF00'
 
+def format_duration(time_seconds):
+    time_minutes = int(time_seconds // 60)
+    if time_minutes == 0:
+        return "< 1 phút"
+    if time_minutes < 60:
+        return f"{time_minutes} phút"
+    return f"{time_minutes // 60} giờ {time_minutes % 60} phút"
+
+def format_clock(seconds):
+    return f"{int(seconds // 3600) % 24:02d}:{int(seconds % 3600 // 60):02d}"
+
 def geocode_address(address):
-    try:
-        geocode_result = ox.geocode(address)
-        return (geocode_result[0], geocode_result[1])
-    except:
+    # Tra trong chỉ mục tên đường ngoại tuyến; chỉ hỏi Nominatim khi người dùng bật tra cứu trực tuyến
+    with metrics.stage('geocode'):
+        result = address_lookup.geocode(address, remote=online_geocoding)
+    if result is None:
         return None
+    return (result.lat, result.lon)
 
 # Configure OSMnx
 ox.settings.log_console = True
@@ -53,21 +71,94 @@ DEFAULT_LOCATION = (CENTER_LAT, CENTER_LON)  # location of Phuong Mai, Dong Da,
 DEFAULT_ZOOM = ZOOM_START
 # Define the path to the saved graph file
 GRAPHML_FILE = "phuongmai.graphml"
+COMPILED_GRAPH_DIR = graph_store.default_path(GRAPHML_FILE)
 
-# Function to load or create the graph
+# Đồ thị định tuyến được đọc từ snapshot CSR (memory-map), chỉ biên dịch lại khi GraphML thay đổi.
+# Chỉ mục không gian để bắt điểm nhấp chuột được xây cùng lúc và dùng chung cho mọi phiên.
 @st.cache_resource
 def load_graph():
-    G = ox.load_graphml(GRAPHML_FILE)
-    graph = defaultdict(list)
-    for edge in G.edges(data=True):
-        graph[edge[0]].append((edge[1], edge[2]['length']))
-        graph[edge[1]].append((edge[0], edge[2]['length']))
-    nodes = dict()
-    for node in G.nodes(data=True):
-        nodes[node[0]] = (node[1]['y'], node[1]['x'])
-    return G, graph, nodes
-
-G, graph, nodes = load_graph()
+    cg = graph_store.build_or_load(GRAPHML_FILE, COMPILED_GRAPH_DIR)
+    return cg, routing.RoutingEngine(cg), spatial_index.SpatialIndex(cg)
+
+# Contraction Hierarchies dựng sẵn ngoại tuyến (python contraction.py); nếu thiếu hoặc cũ thì dựng khi khởi động
+CONTRACTION_DIR = contraction.default_path(GRAPHML_FILE)
+
+@st.cache_resource
+def load_contraction():
+    cg, _, _ = load_graph()
+    return contraction.build_or_load(cg, CONTRACTION_DIR)
+
+# Bộ nhớ đệm tuyến đường dùng chung cho mọi phiên
+ROUTE_CACHE_SIZE = 2048
+
+@st.cache_resource
+def load_route_cache():
+    return route_cache.RouteCache(maxsize=ROUTE_CACHE_SIZE)
+
+# Độ tắc đường dùng chung cho mọi phiên, lưu bền trong SQLite
+TRAFFIC_DB_FILE = "traffic.sqlite"
+
+@st.cache_resource
+def load_traffic():
+    cg, _, _ = load_graph()
+    routes = load_route_cache()
+    store = traffic_store.TrafficStore(cg.num_edges, TRAFFIC_DB_FILE, cg.meta.get('edge_fingerprint'))
+    overlay = traffic.TrafficOverlay(cg, store)
+    # Tuyến không đi qua cạnh bị sửa vẫn dùng tiếp; nếu có cạnh nhanh lên thì bỏ mọi tuyến theo thời gian
+    store.subscribe(lambda change, snapshot: routes.advance(
+        change.old_version, change.new_version, change.edges.tolist(),
+        keep=lambda key: not (change.improved and key[2][1])))
+    return store, overlay
+
+# Chỉ mục địa chỉ dựng từ tên đường của đồ thị; kết quả tra cứu trực tuyến được lưu bền trong SQLite
+GEOCODE_DB_FILE = "geocode.sqlite"
+
+@st.cache_resource
+def load_geocoder():
+    cg, _, _ = load_graph()
+    return geocoder.Geocoder(geocoder.Gazetteer(cg), GEOCODE_DB_FILE)
+
+# Hồ sơ giao thông theo khung giờ (python traffic_profiles.py <dữ liệu GPS lịch sử>); chưa có thì None
+PROFILES_DIR = traffic_profiles.default_path(GRAPHML_FILE)
+
+@st.cache_resource
+def load_profiles():
+    cg, _, _ = load_graph()
+    return traffic_profiles.load(PROFILES_DIR, cg.meta.get('edge_fingerprint'))
+
+# Chuỗi bắt điểm -> tìm đường -> hình học (và ma trận thời gian cho nhiều điểm dừng), dùng chung với routing_service.py
+@st.cache_resource
+def load_planner():
+    cg, engine, snapper = load_graph()
+    _, overlay = load_traffic()
+    return routing_service.RoutePlanner(cg, engine, snapper, overlay, ch_loader=load_contraction, profiles=load_profiles())
+
+# Đặt ROUTING_SERVICE_URL (vd. http://127.0.0.1:8765) để tìm đường qua dịch vụ riêng (python routing_service.py)
+ROUTING_SERVICE_URL = os.environ.get('ROUTING_SERVICE_URL')
+
+@st.cache_resource
+def load_routing_client():
+    return routing_client.RoutingClient(ROUTING_SERVICE_URL) if ROUTING_SERVICE_URL else None
+
+# Vùng đi tới được trong N phút; kết quả tìm kiếm được nhớ theo (điểm, phương tiện, phiên bản traffic)
+@st.cache_resource
+def load_isochrone():
+    cg, _, _ = load_graph()
+    return isochrone.IsochroneEngine(cg)
+
+# Đo thời gian từng bước của lượt chạy này (bật bằng PHUONGMAI_DEBUG=1 hoặc ?debug=1)
+metrics = instrumentation.recorder(st.query_params.get('debug'))
+
+with metrics.stage('load'):
+    cg, engine, snapper = load_graph()
+    address_lookup = load_geocoder()
+    routes = load_route_cache()
+    traffic_db, traffic_overlay = load_traffic()
+    planner = load_planner()
+    service = load_routing_client()
+with metrics.stage('traffic_refresh'):
+    traffic_db.refresh()  # nhận thay đổi do tiến trình khác ghi
+    traffic_snapshot = traffic_db.snapshot()
 
 # Khởi tạo session state
 if 'points' not in st.session_state:
@@ -76,8 +167,6 @@ if 'zoom' not in st.session_state:
     st.session_state['zoom'] = DEFAULT_ZOOM
 if 'center' not in st.session_state:
     st.session_state['center'] = DEFAULT_LOCATION
-if 'traffic_cache' not in st.session_state:
-    st.session_state['traffic_cache'] = {}  # Khởi tạo traffic_cache
 if 'edit_traffic_mode' not in st.session_state:
     st.session_state['edit_traffic_mode'] = False
 if 'traffic_points' not in st.session_state:
@@ -99,128 +188,239 @@ vehicle_type = st.sidebar.selectbox(
     ("Đi bộ", "Xe máy", "Ô tô")
 )
 
-# Thiết lập tốc độ theo phương tiện
-if vehicle_type == "Đi bộ":
-    speed_mps = 1.2  # ~4.3 km/h
-elif vehicle_type == "Xe máy":
-    speed_mps = 6.9  # ~25 km/h
+# Thiết lập tốc độ theo phương tiện (bảng tốc độ dùng chung với dịch vụ tìm đường)
+VEHICLE_IDS = {"Đi bộ": 'walk', "Xe máy": 'motorbike', "Ô tô": 'car'}
+speed_mps = routing_service.VEHICLE_SPEEDS[VEHICLE_IDS[vehicle_type]]
+
+# Định tuyến theo thời gian: tránh đoạn tắc, bỏ qua đoạn "Cấm đường"
+traffic_aware = st.sidebar.checkbox("Tránh đường tắc (tìm đường nhanh nhất)", value=False)
+
+# Giờ khởi hành: mỗi cạnh tính theo hồ sơ tắc của khung giờ lúc đi qua nó; mức tắc hiện tại
+# chỉ áp dụng cho LIVE_HORIZON giây tới kể từ bây giờ
+depart = live_window = None
+if planner.profiles is not None and st.sidebar.checkbox("Tính theo giờ khởi hành (giờ cao điểm)", value=False):
+    if 'depart_time' not in st.session_state:
+        now = traffic_profiles.seconds_of_day()
+        st.session_state['depart_time'] = datetime.time(int(now // 3600), int(now % 3600 // 60))
+    depart_time = st.sidebar.time_input("Giờ khởi hành", key='depart_time', step=15 * 60)
+    depart = depart_time.hour * 3600 + depart_time.minute * 60
+    live_window = traffic_profiles.live_window()
+
+# Thuật toán tìm đường; các chế độ landmark dùng bảng khoảng cách tính sẵn trong snapshot đồ thị
+ROUTING_METHODS = {
+    "A* trên đồ thị nút giao": 'topology',
+    "A*": 'astar',
+    "A* + landmark (ALT)": 'alt',
+    "A* hai chiều": 'bidirectional',
+    "A* hai chiều + landmark": 'bidirectional-alt',
+    "Contraction Hierarchies": 'ch',
+}
+routing_method = ROUTING_METHODS[st.sidebar.selectbox("Thuật toán tìm đường:", tuple(ROUTING_METHODS))]
+
+# Mặc định chỉ tra địa chỉ trong tên đường của bản đồ (không cần mạng)
+online_geocoding = st.sidebar.checkbox("Tra cứu địa chỉ trực tuyến (Nominatim) nếu không tìm thấy", value=False)
+
+# Nhiều điểm dừng: điểm đầu tiên là điểm xuất phát, thứ tự ghé các điểm còn lại được tự sắp xếp
+MAX_STOPS = 30
+TOUR_ENDS = {
+    "Kết thúc ở điểm bất kỳ": 'open',
+    "Kết thúc ở điểm nhập cuối cùng": 'last',
+    "Quay về điểm xuất phát": 'return',
+}
+multi_stop = st.sidebar.checkbox(f"Nhiều điểm dừng (tối đa {MAX_STOPS} điểm, tự sắp thứ tự)", value=False)
+tour_end = TOUR_ENDS[st.sidebar.radio("Điểm kết thúc:", tuple(TOUR_ENDS))] if multi_stop else 'open'
+# Vùng đi tới được: chỉ dùng một điểm (điểm nhấp gần nhất)
+isochrone_mode = st.sidebar.checkbox("Vùng đi tới được trong N phút", value=False)
+if isochrone_mode:
+    isochrone_minutes = st.sidebar.slider("Số phút", min_value=1, max_value=isochrone.MAX_MINUTES, value=10)
+    multi_stop = False
+max_points = 1 if isochrone_mode else MAX_STOPS if multi_stop else 2
+if len(st.session_state['points']) > max_points:
+    st.session_state['points'] = st.session_state['points'][:max_points]
+
+def find_route(orig, dest, traffic_aware=False, depart=None):
+    with metrics.stage('snap'):
+        orig_idx, dest_idx = snapper.nearest_nodes([orig[0], dest[0]], [orig[1], dest[1]]).tolist()
+    timed = depart is not None and traffic_aware
+    # Tuyến theo giờ khởi hành được nhớ theo từng phút và theo khung mức tắc hiện tại
+    options = (vehicle_type, traffic_aware, routing_method) + ((int(depart // 60), live_window) if timed else ())
+    key = (orig_idx, dest_idx, options, traffic_snapshot.version)
+    cached = routes.get(key)
+    if cached is not None:
+        metrics.count('route_cache.hit')
+        return cached
+    metrics.count('route_cache.miss')
+    if service is not None:
+        try:
+            with metrics.stage('service'):
+                payload = service.route(orig, dest, VEHICLE_IDS[vehicle_type], traffic_aware, routing_method, depart)
+            return routes.put(key, routing_client.to_cached_route(payload))
+        except routing_client.RoutingServiceError as e:
+            st.sidebar.warning(f"Dịch vụ tìm đường không phản hồi, tìm đường tại chỗ: {e}")
+    if timed:
+        return routes.put(key, planner.search_at(orig_idx, dest_idx, traffic_snapshot, depart, speed_mps, live_window, metrics))
+    return routes.put(key, planner.search(orig_idx, dest_idx, traffic_snapshot, traffic_aware, routing_method, metrics))
+
+def plan_tour(points):
+    # Thứ tự ghé (chỉ số trong points) theo thời gian đi; giữ lại trong session tới khi điểm/độ tắc đổi
+    with metrics.stage('snap'):
+        nodes = snapper.nearest_nodes([p[0] for p in points], [p[1] for p in points]).tolist()
+    key = (tuple(nodes), tour_end, traffic_aware, traffic_snapshot.version)
+    planned = st.session_state.get('tour')
+    if planned is not None and planned[0] == key:
+        return planned[1]
+    times = None
+    if service is not None:
+        try:
+            with metrics.stage('service'):
+                _, times = service.matrix(points, VEHICLE_IDS[vehicle_type], traffic_aware)
+        except routing_client.RoutingServiceError as e:
+            st.sidebar.warning(f"Dịch vụ tìm đường không phản hồi, tính ma trận tại chỗ: {e}")
+    if times is None:
+        with metrics.stage('matrix'):
+            times = planner.matrix(nodes, traffic_snapshot, speed_mps, traffic_aware).time
+    end = {'open': None, 'last': len(nodes) - 1, 'return': 0}[tour_end]
+    with metrics.stage('tour'):
+        order = tour.solve(times, 0, end)
+    st.session_state['tour'] = (key, order)
+    return order
+
+def route_levels(route_info):
+    return traffic_snapshot.levels[cg.arc_edge[route_info.arcs]].tolist()
+
+def get_traffic_status(route_info):
+    for level in route_levels(route_info):
+        if level != traffic.DEFAULT_LEVEL:
+            return level
+    return 1  # Mặc định mức 1 nếu không tìm thấy
+
+# Mỗi đoạn liên tiếp cùng mức tắc là một PolyLine
+def add_traffic_route(m, route_info):
+    for traffic_status, coords in route_geometry.level_runs(route_info.coords, route_info.starts, route_levels(route_info)):
+        metrics.count('polylines')
+        color = get_traffic_color(traffic_status)
+        weight = 6 if traffic_status == 7 else 5 if traffic_status >= 6 else 4 if traffic_status >= 4 else 3
+        folium.PolyLine(
+            coords,
+            color=color,
+            weight=weight,
+            opacity=0.8,
+            tooltip=f"Mức tắc đường: {traffic_status}"
+        ).add_to(m)
+
+def estimate_time_with_traffic(route_info, levels, base_speed):
+    total_time, max_traffic = routing_service.estimate_time(cg, route_info.arcs, levels, base_speed)
+    return int(total_time // 60), int(total_time % 60), max_traffic
+
+tour_order = None
+if multi_stop and len(st.session_state['points']) >= 2:
+    tour_order = plan_tour(st.session_state['points'])
+    visit = {idx: i for i, idx in reversed(list(enumerate(tour_order)))}
+    for idx, point in enumerate(st.session_state['points']):
+        folium.Marker(location=point, tooltip=f"Point {idx+1} (thứ tự ghé: {visit[idx] + 1})",
+                      icon=folium.Icon("blue")).add_to(m)
 else:
-    speed_mps = 8.3  # ~30 km/h
-
-def Astar_algorithm(pointA, pointB):
-    global graph, nodes
-    queue = []
-    heappush(queue, (0, pointA))
-    father = defaultdict(int)
-    father[pointA] = -432
-    res = defaultdict(int)
-    res[pointA] = 0
-    while queue:
-        current_cost, current_node = heappop(queue)
-        if current_node == pointB:
-            break
-        for neighbor, cost in graph[current_node]:
-            g = res[current_node] + cost
-            h = calculate_distance(nodes[neighbor], nodes[pointB])
-            f = g + h
-            if neighbor not in father or f < res[neighbor] + h:
-                heappush(queue, (f, neighbor))
-                father[neighbor] = current_node
-                res[neighbor] = g
-    distance = res[pointB]
-    path = []
-    while father[pointB] != -432:
-        path.append(pointB)
-        pointB = father[pointB]
-    path.append(pointA)
-    path.reverse()
-    return distance, path
-
-for idx, point in enumerate(st.session_state['points']):
-    folium.Marker(location=point, tooltip=f"Point {idx+1}", icon=folium.Icon("blue")).add_to(m)
-
-if len(st.session_state['points']) == 2:
-    orig = st.session_state['points'][0]
-    dest = st.session_state['points'][1]
-    orig_node = ox.nearest_nodes(G, orig[1], orig[0])
-    dest_node = ox.nearest_nodes(G, dest[1], dest[0])
-    distance, route = Astar_algorithm(orig_node, dest_node)
+    for idx, point in enumerate(st.session_state['points']):
+        folium.Marker(location=point, tooltip=f"Point {idx+1}", icon=folium.Icon("blue")).add_to(m)
+
+# Mỗi lớp là các cạnh đi hết được trong khoảng thời gian của lớp, vẽ bằng một GeoJson
+ISOCHRONE_COLORS = ['#1a9850', '#91cf60', '#fee08b', '#fc8d59']
+
+if isochrone_mode and st.session_state['points']:
+    with metrics.stage('snap'):
+        source = int(snapper.nearest_nodes([st.session_state['points'][0][0]], [st.session_state['points'][0][1]])[0])
+    isochrones = load_isochrone()
+    with metrics.stage('isochrone'):
+        reach = isochrones.reach(source, traffic_overlay.weights(traffic_snapshot).weights, speed_mps,
+                                 key=(source, vehicle_type, traffic_snapshot.version))
+        bands = isochrones.bands(reach, isochrone_minutes, len(ISOCHRONE_COLORS))
+    with metrics.stage('draw'):
+        for band, color in zip(bands, ISOCHRONE_COLORS):
+            if not len(band.edges):
+                continue
+            folium.GeoJson(
+                band.geojson,
+                style_function=lambda _, color=color: {'color': color, 'weight': 4, 'opacity': 0.8},
+                tooltip=f"≤ {band.minutes:.0f} phút",
+            ).add_to(m)
+            metrics.count('polylines')
+    st.sidebar.markdown("### Vùng đi tới được")
+    st.sidebar.markdown(f"- **Phương tiện**: `{vehicle_type}`")
+    st.sidebar.markdown(f"- **Trong**: `{isochrone_minutes}` phút")
+    st.sidebar.markdown(f"- **Tổng chiều dài đường**: `{isochrones.reachable_length(reach, isochrone_minutes) / 1000:.2f}` km")
+
+# Mỗi chặng là một tuyến hai điểm bình thường (dùng chung cache tuyến đường)
+tour_legs = []
+if tour_order is not None:
+    points = st.session_state['points']
+    leg_rows = []
+    total_distance = total_time = 0.0
+    for a, b in zip(tour_order, tour_order[1:]):
+        # Với giờ khởi hành, mỗi chặng bắt đầu lúc tới điểm trước đó
+        leg_depart = depart + total_time if depart is not None else None
+        leg = find_route(points[a], points[b], traffic_aware, leg_depart)
+        if not leg.path:
+            leg_rows.append({"chặng": f"{a + 1} → {b + 1}", "khoảng cách (m)": "-", "thời gian": "không có đường"})
+            continue
+        with metrics.stage('estimate_time'):
+            if leg_depart is not None:
+                leg_time = planner.eta(leg.arcs, traffic_snapshot, speed_mps, leg_depart, live_window)
+            else:
+                minutes, seconds, _ = estimate_time_with_traffic(leg, traffic_snapshot.levels, speed_mps)
+                leg_time = minutes * 60 + seconds
+        total_distance += leg.distance
+        total_time += leg_time
+        tour_legs.append(leg)
+        leg_rows.append({"chặng": f"{a + 1} → {b + 1}", "khoảng cách (m)": f"{leg.distance:.1f}",
+                         "thời gian": format_duration(leg_time)})
+    st.sidebar.markdown("### Lộ trình nhiều điểm dừng")
+    st.sidebar.markdown(f"- **Phương tiện**: `{vehicle_type}`")
+    st.sidebar.markdown(f"- **Thứ tự ghé**: `{' → '.join(str(i + 1) for i in tour_order)}`")
+    st.sidebar.markdown(f"- **Tổng khoảng cách**: `{total_distance:.1f}` mét")
+    st.sidebar.markdown(f"- **Tổng thời gian ước tính**: `{format_duration(total_time)}`")
+    if depart is not None:
+        st.sidebar.markdown(f"- **Khởi hành / về đích**: `{format_clock(depart)}` → `{format_clock(depart + total_time)}`")
+    st.sidebar.table(leg_rows)
+    if len(tour_legs) < len(tour_order) - 1:
+        st.sidebar.error("Một số chặng không có đường đi: mọi lối nối hai điểm đều đang bị cấm.")
+    for leg in tour_legs:
+        if len(leg.coords) > 1:
+            folium.PolyLine(leg.coords, color='blue', weight=3).add_to(m)
+            metrics.count('polylines')
+
+route_info = None
+if not multi_stop and len(st.session_state['points']) == 2:
+    route_info = find_route(st.session_state['points'][0], st.session_state['points'][1], traffic_aware, depart)
+    if not route_info.path:
+        st.sidebar.error("Không tìm thấy đường đi: mọi lối nối hai điểm đều đang bị cấm.")
+        route_info = None
+if route_info is not None:
+    distance = route_info.distance
     distance_km = distance 
-    time_seconds = distance / speed_mps
-    time_minutes = int(time_seconds // 60)
-    if time_minutes < 60:
-        time_str = f"{time_minutes} phút"
+    if depart is not None:
+        with metrics.stage('estimate_time'):
+            time_seconds = planner.eta(route_info.arcs, traffic_snapshot, speed_mps, depart, live_window)
+    elif traffic_aware:
+        with metrics.stage('estimate_time'):
+            minutes, seconds, _ = estimate_time_with_traffic(route_info, traffic_snapshot.levels, speed_mps)
+        time_seconds = minutes * 60 + seconds
     else:
-        hours = time_minutes // 60
-        minutes = time_minutes % 60
-        time_str = f"{hours} giờ {minutes} phút"
+        time_seconds = distance / speed_mps
     st.sidebar.markdown("### Kết quả tìm đường")
     st.sidebar.markdown(f"- **Phương tiện**: `{vehicle_type}`")
     st.sidebar.markdown(f"- **Khoảng cách**: `{distance:.1f}` mét")
-    if time_minutes == 0:
-        st.sidebar.markdown(f"- **Thời gian ước tính**: `< 1 phút`")
-    else:
-        st.sidebar.markdown(f"- **Thời gian ước tính**: `{time_str}`")
-    edge_geometries = []
-    for u, v in zip(route[:-1], route[1:]):
-        data = G.get_edge_data(u, v)
-        if data:
-            edge_data = data[list(data.keys())[0]]
-            if 'geometry' in edge_data:
-                edge_geometries.append(edge_data['geometry'])
-            else:
-                point_u = (G.nodes[u]['x'], G.nodes[u]['y'])
-                point_v = (G.nodes[v]['x'], G.nodes[v]['y'])
-                edge_geometries.append(LineString([point_u, point_v]))
-    for geom in edge_geometries:
-        coords = [(lat, lon) for lon, lat in geom.coords]
-        folium.PolyLine(coords, color='blue', tooltip="Too much smoothing?", weight=3).add_to(m)
-
-def get_traffic_status(segment):
-    for u, v in zip(segment[:-1], segment[1:]):
-        edge_key = tuple(sorted([u, v]))
-        if edge_key in st.session_state['traffic_cache']:
-            return st.session_state['traffic_cache'][edge_key]
-    return 1  # Mặc định mức 1 nếu không tìm thấy
-
-def add_traffic_route(m, G, route):
-    for u, v in zip(route[:-1], route[1:]):
-        edge_key = tuple(sorted([u, v]))
-        traffic_status = st.session_state['traffic_cache'].get(edge_key, 1)
-        color = get_traffic_color(traffic_status)
-        weight = 6 if traffic_status == 7 else 5 if traffic_status >= 6 else 4 if traffic_status >= 4 else 3
-        data = G.get_edge_data(u, v)
-        if data:
-            edge_data = data[list(data.keys())[0]]
-            if 'geometry' in edge_data:
-                geom = edge_data['geometry']
-                coords = [(lat, lon) for lon, lat in geom.coords]
-            else:
-                point_u = (G.nodes[u]['x'], G.nodes[u]['y'])
-                point_v = (G.nodes[v]['x'], G.nodes[v]['y'])
-                coords = [(point_u[1], point_u[0]), (point_v[1], point_v[0])]
-            folium.PolyLine(
-                coords,
-                color=color,
-                weight=weight,
-                opacity=0.8,
-                tooltip=f"Mức tắc đường: {traffic_status}"
-            ).add_to(m)
+    st.sidebar.markdown(f"- **Thời gian ước tính**: `{format_duration(time_seconds)}`")
+    if depart is not None:
+        st.sidebar.markdown(f"- **Khởi hành / đến nơi**: `{format_clock(depart)}` → `{format_clock(depart + time_seconds)}`")
+    if len(route_info.coords) > 1:
+        folium.PolyLine(route_info.coords, color='blue', tooltip="Too much smoothing?", weight=3).add_to(m)
+        metrics.count('polylines')
+    cache_stats = routes.stats()
+    st.sidebar.caption(
+        f"Cache tuyến đường: {cache_stats['hits']} hit / {cache_stats['misses']} miss "
+        f"({cache_stats['hit_rate']:.0%}), {cache_stats['size']} tuyến"
+    )
 
-def estimate_time_with_traffic(route, G, base_speed):
-    total_time = 0
-    max_traffic = 1
-    for u, v in zip(route[:-1], route[1:]):
-        edge_key = tuple(sorted([u, v]))
-        traffic = st.session_state['traffic_cache'].get(edge_key, 1)
-        max_traffic = max(max_traffic, traffic)
-        factor = 2.0 if traffic == 7 else 1.8 if traffic == 6 else 1.5 if traffic >= 4 else 1.2 if traffic >= 2 else 1.0
-        data = G.get_edge_data(u, v)
-        if data:
-            edge = data[list(data.keys())[0]]
-            length = edge['length']
-            total_time += (length / base_speed) * factor
-    return int(total_time // 60), int(total_time % 60), max_traffic
 # css tí ae đừng qtam
 traffic_legend = """
 <div style="position: fixed; 
@@ -236,13 +436,13 @@ traffic_legend = """
 """
 m.get_root().html.add_child(folium.Element(traffic_legend))
 
-if len(st.session_state['points']) == 2:
-    orig = st.session_state['points'][0]
-    dest = st.session_state['points'][1]
-    orig_node = ox.nearest_nodes(G, orig[1], orig[0])
-    dest_node = ox.nearest_nodes(G, dest[1], dest[0])
-    route = Astar_algorithm(orig_node, dest_node)[1]
-    add_traffic_route(m, G, route)
+if route_info is not None:
+    with metrics.stage('draw'):
+        add_traffic_route(m, route_info)
+if tour_legs:
+    with metrics.stage('draw'):
+        for leg in tour_legs:
+            add_traffic_route(m, leg)
 
 st.title("Phương Mai District Map")
 
@@ -319,40 +519,32 @@ if st.session_state['edit_traffic_mode']:
     if len(st.session_state.get('traffic_points', [])) == 2:
         orig = st.session_state['traffic_points'][0]
         dest = st.session_state['traffic_points'][1]
-        orig_node = ox.nearest_nodes(G, orig[1], orig[0])
-        dest_node = ox.nearest_nodes(G, dest[1], dest[0])
-        _, route = Astar_algorithm(orig_node, dest_node)
+        traffic_route = find_route(orig, dest)
         folium.Marker(location=orig, tooltip="Điểm đầu", icon=folium.Icon("blue")).add_to(m)
         folium.Marker(location=dest, tooltip="Điểm cuối", icon=folium.Icon("blue")).add_to(m)
-        for u, v in zip(route[:-1], route[1:]):
-            data = G.get_edge_data(u, v)
-            if data:
-                edge_data = data[list(data.keys())[0]]
-                if 'geometry' in edge_data:
-                    geom = edge_data['geometry']
-                    coords = [(lat, lon) for lon, lat in geom.coords]
-                else:
-                    point_u = (G.nodes[u]['x'], G.nodes[u]['y'])
-                    point_v = (G.nodes[v]['x'], G.nodes[v]['y'])
-                    coords = [(point_u[1], point_u[0]), (point_v[1], point_v[0])]
-                display_color = get_traffic_color(traffic_level)
-                folium.PolyLine(
-                    coords,
-                    color=display_color,
-                    weight=5,
-                    opacity=0.8,
-                    tooltip=f"Mức tắc đường: {traffic_level}"
-                ).add_to(m)
+        if len(traffic_route.coords) > 1:
+            folium.PolyLine(
+                traffic_route.coords,
+                color=get_traffic_color(traffic_level),
+                weight=5,
+                opacity=0.8,
+                tooltip=f"Mức tắc đường: {traffic_level}"
+            ).add_to(m)
+            metrics.count('polylines')
         if st.sidebar.button("Update"):
-            for u, v in zip(route[:-1], route[1:]):
-                edge_key = tuple(sorted([u, v]))
-                st.session_state.traffic_cache[edge_key] = traffic_level
+            with metrics.stage('traffic_update'):
+                traffic_db.update(sorted(traffic_route.edges), traffic_level)
             st.session_state['edit_traffic_mode'] = False
             st.session_state['traffic_points'] = []
             st.session_state['traffic_click_mode'] = False
             st.rerun()
 
-output = st_folium(m, width=1000, height=500, returned_objects=['last_clicked', 'zoom', 'center'])
+if metrics.enabled:
+    # Render thêm một lần chỉ để đo kích thước HTML gửi về trình duyệt
+    with metrics.stage('html_render'):
+        metrics.count('html_bytes', len(m.get_root().render().encode()))
+with metrics.stage('st_folium'):
+    output = st_folium(m, width=1000, height=500, returned_objects=['last_clicked', 'zoom', 'center'])
 
 # nhấp chuột
 if output and output['last_clicked']:
@@ -368,7 +560,12 @@ if output and output['last_clicked']:
                 icon=folium.Icon("blue")
             ).add_to(m)
             st.rerun()
-    elif not st.session_state['edit_traffic_mode'] and len(st.session_state['points']) < 2:
+    elif not st.session_state['edit_traffic_mode'] and isochrone_mode:
+        # Nhấp điểm khác thì thay điểm xuất phát của vùng đi tới được
+        if clicked_point not in st.session_state['points']:
+            st.session_state['points'] = [clicked_point]
+            st.rerun()
+    elif not st.session_state['edit_traffic_mode'] and len(st.session_state['points']) < max_points:
         st.session_state['points'].append(clicked_point)
         st.rerun()
 
@@ -380,19 +577,50 @@ if st.button("Reset Points"):
 
 st.sidebar.title("Nhập địa chỉ: ")
 
-start_address = st.sidebar.text_input("Điểm xuất phát")
-end_address = st.sidebar.text_input("Điểm đến")
-
-if st.sidebar.button("Tìm đường"):
-    if start_address and end_address:
-        start_point = geocode_address(start_address)
-        end_point = geocode_address(end_address)
-        if start_point and end_point:
-            st.session_state['points'] = [start_point, end_point]
-            st.session_state['center'] = start_point
-            st.session_state['zoom'] = 16
-            st.rerun()
+if multi_stop:
+    stop_addresses = st.sidebar.text_area("Các điểm dừng (mỗi dòng một địa chỉ, dòng đầu là điểm xuất phát)")
+    if st.sidebar.button("Tìm lộ trình"):
+        addresses = [line.strip() for line in stop_addresses.splitlines() if line.strip()]
+        if len(addresses) < 2:
+            st.sidebar.warning("Vui lòng nhập ít nhất hai địa chỉ.")
+        elif len(addresses) > MAX_STOPS:
+            st.sidebar.warning(f"Chỉ hỗ trợ tối đa {MAX_STOPS} điểm dừng.")
         else:
-            st.sidebar.error("Không thể tìm thấy một trong các địa chỉ.")
-    else:
-        st.sidebar.warning("Vui lòng nhập cả điểm xuất phát và điểm đến.")
\ No newline at end of file
+            stop_points = [geocode_address(address) for address in addresses]
+            missing = [address for address, point in zip(addresses, stop_points) if point is None]
+            if missing:
+                st.sidebar.error(f"Không thể tìm thấy địa chỉ: {', '.join(missing)}")
+            else:
+                st.session_state['points'] = stop_points
+                st.session_state['center'] = stop_points[0]
+                st.session_state['zoom'] = 16
+                st.rerun()
+else:
+    start_address = st.sidebar.text_input("Điểm xuất phát")
+    end_address = st.sidebar.text_input("Điểm đến")
+
+    if st.sidebar.button("Tìm đường"):
+        if start_address and end_address:
+            start_point = geocode_address(start_address)
+            end_point = geocode_address(end_address)
+            if start_point and end_point:
+                st.session_state['points'] = [start_point, end_point]
+                st.session_state['center'] = start_point
+                st.session_state['zoom'] = 16
+                st.rerun()
+            else:
+                st.sidebar.error("Không thể tìm thấy một trong các địa chỉ.")
+        else:
+            st.sidebar.warning("Vui lòng nhập cả điểm xuất phát và điểm đến.")
+
+# Bảng debug và dòng log metrics; lượt chạy kết thúc bằng st.rerun() không được ghi
+if metrics.enabled:
+    metrics.tag(vehicle=vehicle_type, method=routing_method, traffic_aware=traffic_aware,
+                traffic_version=traffic_snapshot.version, points=len(st.session_state['points']),
+                multi_stop=multi_stop, isochrone=isochrone_mode, service=service is not None)
+    report = metrics.to_dict()
+    with st.sidebar.expander("Debug: hiệu năng lượt chạy", expanded=True):
+        st.markdown(f"**Tổng**: `{report['total_ms']:.1f}` ms")
+        st.table([{"bước": name, "ms": ms} for name, ms in report['stages'].items()])
+        st.table([{"bộ đếm": name, "giá trị": value} for name, value in report['counters'].items()])
+    metrics.write()
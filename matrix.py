@@ -0,0 +1,143 @@
+# Ma trận khoảng cách / thời gian giữa nhiều điểm dừng
+#
+# Mỗi điểm nguồn chạy một lượt Dijkstra trên đồ thị CSR và dừng ngay khi mọi điểm đích
+# đã được chốt, thay vì N * N lượt A* cho từng cặp. Khi tránh đường tắc, đường được chọn
+# theo trọng số của traffic.TrafficWeights (độ dài * hệ số tắc) nên thời gian = trọng số /
+# tốc độ; khoảng cách là độ dài thật của chính đường đó.
+# MatrixPool chia các điểm nguồn cho nhiều tiến trình; mỗi tiến trình mở snapshot đồ thị
+# bằng memory-map một lần trong initializer nên các tiến trình dùng chung page cache.
+import math
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from heapq import heappush, heappop
+from typing import NamedTuple
+
+import numpy as np
+
+import graph_store
+import traffic
+
+INF = math.inf
+
+
+class DistanceMatrix(NamedTuple):
+    distance: np.ndarray  # mét, [nguồn, đích]; inf nếu không tới được
+    time: np.ndarray      # giây
+
+
+class _Workspace:
+    def __init__(self, n):
+        self.dist = [INF] * n
+        self.length = [0.0] * n
+        self.settled = bytearray(n)
+        self.touched = []
+
+    def reset(self):
+        dist, settled = self.dist, self.settled
+        for i in self.touched:
+            dist[i] = INF
+            settled[i] = 0
+        self.touched.clear()
+
+
+class MatrixEngine:
+    def __init__(self, cg):
+        self.cg = cg
+        self.n = cg.num_nodes
+        self.offsets = cg.offsets.tolist()
+        self.targets = cg.targets.tolist()
+        self.weights = cg.weights.tolist()
+        self._local = threading.local()
+
+    def _workspace(self):
+        ws = getattr(self._local, 'ws', None)
+        if ws is None:
+            ws = self._local.ws = _Workspace(self.n)
+        return ws
+
+    def one_to_many(self, source, goals, weights=None):
+        # Trả về (chi phí, độ dài) tới từng node trong goals theo đúng thứ tự
+        offsets, targets, lengths = self.offsets, self.targets, self.weights
+        if weights is None:
+            weights = lengths
+        remaining = set(goals)
+        ws = self._workspace()
+        dist, length, settled, touched = ws.dist, ws.length, ws.settled, ws.touched
+        try:
+            dist[source] = 0.0
+            length[source] = 0.0
+            touched.append(source)
+            heap = [(0.0, source)]
+            while heap and remaining:
+                d, v = heappop(heap)
+                if settled[v]:
+                    continue
+                settled[v] = 1
+                remaining.discard(v)
+                lv = length[v]
+                for k in range(offsets[v], offsets[v + 1]):
+                    u = targets[k]
+                    nd = d + weights[k]
+                    if nd < dist[u]:
+                        if dist[u] == INF:
+                            touched.append(u)
+                        dist[u] = nd
+                        length[u] = lv + lengths[k]
+                        heappush(heap, (nd, u))
+            return [dist[g] if settled[g] else INF for g in goals], [length[g] if settled[g] else INF for g in goals]
+        finally:
+            ws.reset()
+
+    def rows(self, sources, goals, weights=None):
+        costs = np.empty((len(sources), len(goals)))
+        distances = np.empty((len(sources), len(goals)))
+        for i, source in enumerate(sources):
+            costs[i], distances[i] = self.one_to_many(source, goals, weights)
+        return costs, distances
+
+    def matrix(self, sources, targets, speed_mps, weights=None):
+        sources, targets = [int(s) for s in sources], [int(t) for t in targets]
+        costs, distances = self.rows(sources, targets, weights)
+        return DistanceMatrix(distances, costs / speed_mps)
+
+
+_worker = {}
+
+
+def _init_worker(snapshot_path):
+    _worker['engine'] = MatrixEngine(graph_store.load_compiled(snapshot_path))
+    _worker['weights'] = (None, None)
+
+
+def _worker_rows(sources, goals, levels, version):
+    engine = _worker['engine']
+    weights = None
+    if levels is not None:
+        cached_version, weights = _worker['weights']
+        if cached_version != version or weights is None:
+            weights = traffic.TrafficWeights(engine.cg, levels, version).weights
+            _worker['weights'] = (version, weights)
+    return engine.rows(sources, goals, weights)
+
+
+class MatrixPool:
+    # Tính ma trận bằng nhiều tiến trình; snapshot là TrafficSnapshot khi cần tránh đường tắc
+    def __init__(self, snapshot_path, workers=None):
+        self.workers = workers or os.cpu_count() or 1
+        self.executor = ProcessPoolExecutor(max_workers=self.workers, initializer=_init_worker, initargs=(snapshot_path,))
+
+    def matrix(self, sources, targets, speed_mps, snapshot=None):
+        sources, targets = [int(s) for s in sources], [int(t) for t in targets]
+        levels = version = None
+        if snapshot is not None:
+            levels, version = np.asarray(snapshot.levels), snapshot.version
+        chunks = [c.tolist() for c in np.array_split(np.asarray(sources, dtype=np.int64), self.workers) if len(c)]
+        futures = [self.executor.submit(_worker_rows, chunk, targets, levels, version) for chunk in chunks]
+        parts = [f.result() for f in futures]
+        costs = np.concatenate([p[0] for p in parts]) if parts else np.empty((0, len(targets)))
+        distances = np.concatenate([p[1] for p in parts]) if parts else np.empty((0, len(targets)))
+        return DistanceMatrix(distances, costs / speed_mps)
+
+    def close(self):
+        self.executor.shutdown()
@@ -0,0 +1,101 @@
+# Bộ nhớ đệm tuyến đường dùng chung giữa các phiên (LRU có giới hạn)
+#
+# Khóa: (node đầu, node cuối, phương tiện, phiên bản traffic). Khi một lần cập nhật
+# độ tắc đường đưa phiên bản cũ sang phiên bản mới, chỉ các tuyến đi qua cạnh bị sửa
+# mất hiệu lực, các tuyến còn lại được dùng tiếp ở phiên bản mới.
+import threading
+from collections import OrderedDict
+from typing import NamedTuple
+
+
+class CachedRoute(NamedTuple):
+    path: list       # chỉ số node theo thứ tự đi
+    arcs: list       # chỉ số cung CSR giữa hai node liên tiếp
+    distance: float  # mét
+    coords: list     # tọa độ [lat, lon] của cả tuyến, dùng để vẽ PolyLine
+    starts: list     # coords[starts[i]:starts[i + 1] + 1] là hình học của cung thứ i
+    edges: frozenset # ID cạnh, dùng để hủy đúng các tuyến bị ảnh hưởng khi độ tắc thay đổi
+
+
+class RouteCache:
+    def __init__(self, maxsize=1024):
+        self.maxsize = maxsize
+        self._entries = OrderedDict()
+        self._by_edge = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def get(self, key):
+        with self._lock:
+            route = self._entries.get(key)
+            if route is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return route
+
+    def put(self, key, route):
+        with self._lock:
+            if key in self._entries:
+                self._unindex(key, self._entries[key])
+            self._entries[key] = route
+            self._entries.move_to_end(key)
+            self._index(key, route)
+            self._evict()
+        return route
+
+    def advance(self, old_version, new_version, changed_edges, keep=None):
+        # Mục của phiên bản cũ được giữ lại (lượt chạy đang dở có thể vẫn đọc phiên bản đó)
+        # và sẽ tự bị đẩy ra theo LRU; chỉ các tuyến không chạm cạnh bị sửa (và được
+        # keep(key) chấp nhận, nếu có) được chép sang.
+        with self._lock:
+            stale = set()
+            for edge in changed_edges:
+                stale.update(k for k in self._by_edge.get(edge, ()) if k[3] == old_version)
+            self.invalidations += len(stale)
+            carried = [(k, r) for k, r in self._entries.items()
+                       if k[3] == old_version and k not in stale and (keep is None or keep(k))]
+            for key, route in carried:
+                new_key = key[:3] + (new_version,)
+                self._entries[new_key] = route
+                self._index(new_key, route)
+            self._evict()
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._by_edge.clear()
+
+    def stats(self):
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                'size': len(self._entries),
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / total if total else 0.0,
+                'evictions': self.evictions,
+                'invalidations': self.invalidations,
+            }
+
+    def _evict(self):
+        while len(self._entries) > self.maxsize:
+            key, route = self._entries.popitem(last=False)
+            self._unindex(key, route)
+            self.evictions += 1
+
+    def _index(self, key, route):
+        for edge in route.edges:
+            self._by_edge.setdefault(edge, set()).add(key)
+
+    def _unindex(self, key, route):
+        for edge in route.edges:
+            keys = self._by_edge.get(edge)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self._by_edge[edge]
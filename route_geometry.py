@@ -0,0 +1,45 @@
+# Dựng tọa độ vẽ tuyến đường từ hình học đã trải phẳng trong đồ thị biên dịch
+#
+# Cả tuyến được ghép thành một dãy tọa độ liền (bỏ điểm nối trùng giữa hai cạnh), kèm
+# vị trí bắt đầu của từng cung, nên vẽ tuyến chỉ cần vài PolyLine: một cho mỗi đoạn
+# liên tiếp có cùng mức tắc đường, thay vì một PolyLine cho mỗi cạnh.
+import numpy as np
+
+
+def path_polyline(cg, path, arcs):
+    # Trả về (coords, starts): coords là danh sách [lat, lon]; điểm của cung thứ i nằm
+    # ở coords[starts[i]:starts[i + 1] + 1]
+    if not len(arcs):
+        if len(path):
+            return [[float(cg.lat[path[0]]), float(cg.lon[path[0]])]], [0]
+        return [], [0]
+    arcs = np.asarray(arcs, dtype=np.int64)
+    edges = np.asarray(cg.arc_edge)[arcs]
+    forward = np.asarray(cg.edge_u)[edges] == np.asarray(path[:-1])
+    begin = np.asarray(cg.geom_offsets)[edges]
+    end = np.asarray(cg.geom_offsets)[edges + 1]
+    counts = end - begin - 1  # mỗi cung góp các điểm trừ điểm cuối (là điểm đầu của cung sau)
+    first = np.where(forward, begin, end - 1)
+    step = np.where(forward, 1, -1)
+    starts = np.zeros(len(arcs) + 1, dtype=np.int64)
+    np.cumsum(counts, out=starts[1:])
+    k = np.arange(starts[-1]) - np.repeat(starts[:-1], counts)
+    idx = np.repeat(first, counts) + np.repeat(step, counts) * k
+    last = end[-1] - 1 if forward[-1] else begin[-1]
+    idx = np.append(idx, last)
+    coords = np.column_stack((np.asarray(cg.geom_lat)[idx], np.asarray(cg.geom_lon)[idx]))
+    return coords.tolist(), starts.tolist()
+
+
+def level_runs(coords, starts, levels):
+    # Gộp các cung liên tiếp cùng mức tắc: [(mức, tọa độ), ...]
+    runs = []
+    i = 0
+    n = len(levels)
+    while i < n:
+        j = i + 1
+        while j < n and levels[j] == levels[i]:
+            j += 1
+        runs.append((levels[i], coords[starts[i]:starts[j] + 1]))
+        i = j
+    return runs
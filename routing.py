@@ -0,0 +1,351 @@
+# Bộ tìm đường A* trên đồ thị CSR đã biên dịch (graph_store.CompiledGraph)
+#
+# Mọi thứ làm việc trên chỉ số node nguyên. Heuristic là khoảng cách phẳng trong
+# phép chiếu equirectangular tính sẵn một lần cho cả đồ thị; hệ số cos(vĩ độ) lấy ở
+# vĩ độ lớn nhất nên khoảng cách phẳng không vượt quá khoảng cách đường tròn lớn.
+# Đồ thị do graph_modifier.py cũ sinh ra có cạnh 'length' ngắn hơn khoảng cách thẳng
+# giữa hai đầu mút, nên tọa độ phẳng còn được co lại theo tỉ lệ length / khoảng cách nhỏ
+# nhất trên toàn đồ thị (với phuongmai.graphml hiện tại tỉ lệ này >= 1, hệ số chỉ còn
+# HEURISTIC_SLACK). Khi đó heuristic consistent với trọng số thật và A* có thể dùng tập
+# đóng (visited) cùng xóa lười phần tử cũ trong heap mà vẫn tối ưu.
+#
+# Với đồ thị lớn có thêm chế độ ALT (A*, landmarks, bất đẳng thức tam giác): khoảng
+# cách ngắn nhất từ vài landmark tới mọi node được tính trước và lưu trong đồ thị biên
+# dịch; |d(L, t) - d(L, v)| là cận dưới của d(v, t). Chế độ hai chiều chạy A* từ cả hai
+# đầu với thế năng trung bình pf = (h_t - h_s) / 2 để hai phía dùng chung chi phí rút gọn.
+import math
+import threading
+from heapq import heappush, heappop
+from typing import NamedTuple
+
+import numpy as np
+
+EARTH_RADIUS = 6371000
+# Bù sai số làm tròn và độ cong trái đất, giữ heuristic luôn <= độ dài thật
+HEURISTIC_SLACK = 0.999
+INF = math.inf
+NUM_LANDMARKS = 8
+ACTIVE_LANDMARKS = 4  # số landmark cho cận tốt nhất tại điểm xuất phát, dùng trong một truy vấn
+METHODS = ('astar', 'alt', 'bidirectional', 'bidirectional-alt')
+
+
+class Route(NamedTuple):
+    distance: float
+    path: list
+    expanded: int
+    pushes: int
+    max_heap: int = 0  # số phần tử lớn nhất trong hàng đợi ưu tiên (cả hai phía nếu tìm hai chiều)
+
+
+class _Workspace:
+    def __init__(self, n):
+        self.dist = [INF] * n
+        self.parent = [-1] * n
+        self.visited = bytearray(n)
+        self.touched = []
+
+    def reset(self):
+        dist, parent, visited = self.dist, self.parent, self.visited
+        for i in self.touched:
+            dist[i] = INF
+            parent[i] = -1
+            visited[i] = 0
+        self.touched.clear()
+
+
+def _min_length_ratio(cg, xs, ys):
+    src = np.repeat(np.arange(cg.num_nodes), np.diff(cg.offsets))
+    dst = np.asarray(cg.targets)
+    straight = np.hypot(xs[src] - xs[dst], ys[src] - ys[dst])
+    mask = straight > 0
+    if not mask.any():
+        return 1.0
+    return float((np.asarray(cg.weights)[mask] / straight[mask]).min())
+
+
+class RoutingEngine:
+    def __init__(self, cg):
+        self.cg = cg
+        self.n = cg.num_nodes
+        self.offsets = cg.offsets.tolist()
+        self.targets = cg.targets.tolist()
+        self.weights = cg.weights.tolist()
+        lat = np.radians(np.asarray(cg.lat, dtype=np.float64))
+        lon = np.radians(np.asarray(cg.lon, dtype=np.float64))
+        cos_lat = math.cos(float(np.abs(lat).max())) if self.n else 1.0
+        xs = lon * cos_lat * EARTH_RADIUS
+        ys = lat * EARTH_RADIUS
+        scale = min(1.0, _min_length_ratio(cg, xs, ys)) * HEURISTIC_SLACK
+        self.heuristic_scale = scale
+        self.xs = (xs * scale).tolist()
+        self.ys = (ys * scale).tolist()
+        # Mảng dist/parent/visited cấp phát sẵn, mỗi luồng (phiên Streamlit) một bộ riêng
+        self._local = threading.local()
+
+    def _workspace(self, name='ws'):
+        ws = getattr(self._local, name, None)
+        if ws is None:
+            ws = _Workspace(self.n)
+            setattr(self._local, name, ws)
+        return ws
+
+    @property
+    def has_landmarks(self):
+        return getattr(self.cg, 'landmark_dist', None) is not None
+
+    @property
+    def landmark_rows(self):
+        rows = getattr(self, '_landmark_rows', None)
+        if rows is None:
+            rows = self._landmark_rows = [row.tolist() for row in np.asarray(self.cg.landmark_dist)]
+        return rows
+
+    def _euclid_to(self, target):
+        xs, ys, hypot = self.xs, self.ys, math.hypot
+        xt, yt = xs[target], ys[target]
+        return lambda v: hypot(xs[v] - xt, ys[v] - yt)
+
+    def _alt_to(self, target, source):
+        # Chỉ giữ vài landmark cho cận lớn nhất tại source; mỗi cận vẫn admissible
+        rows = self.landmark_rows
+        scored = sorted(rows, key=lambda row: -abs(row[target] - row[source]))[:ACTIVE_LANDMARKS]
+        active = [(row, row[target]) for row in scored]
+
+        def h(v):
+            best = 0.0
+            for row, dt in active:
+                x = dt - row[v]
+                if x < 0:
+                    x = -x
+                if x > best:
+                    best = x
+            return best
+        return h
+
+    def potential(self, target, source, landmarks=False):
+        if landmarks and self.has_landmarks:
+            return self._alt_to(target, source)
+        return self._euclid_to(target)
+
+    def route(self, source, target, weights=None, method='astar'):
+        if method == 'astar':
+            return self.shortest_path(source, target, weights)
+        if method == 'alt':
+            return self.shortest_path_with(source, target, self.potential(target, source, True), weights)
+        if method in ('bidirectional', 'bidirectional-alt'):
+            return self.bidirectional(source, target, weights, landmarks=method == 'bidirectional-alt')
+        raise ValueError(f"Không có thuật toán {method!r}, chọn một trong {METHODS}")
+
+    def heuristic(self, u, v):
+        return math.hypot(self.xs[u] - self.xs[v], self.ys[u] - self.ys[v])
+
+    def shortest_path(self, source, target, weights=None):
+        if weights is None:
+            weights = self.weights
+        offsets, targets = self.offsets, self.targets
+        xs, ys = self.xs, self.ys
+        xt, yt = xs[target], ys[target]
+        hypot = math.hypot
+        ws = self._workspace()
+        dist, parent, visited, touched = ws.dist, ws.parent, ws.visited, ws.touched
+
+        dist[source] = 0.0
+        parent[source] = source
+        touched.append(source)
+        heap = [(hypot(xs[source] - xt, ys[source] - yt), source)]
+        expanded = 0
+        pushes = max_heap = 1
+        try:
+            while heap:
+                u = heappop(heap)[1]
+                if visited[u]:
+                    continue
+                visited[u] = 1
+                expanded += 1
+                if u == target:
+                    break
+                du = dist[u]
+                for k in range(offsets[u], offsets[u + 1]):
+                    v = targets[k]
+                    if visited[v]:
+                        continue
+                    nd = du + weights[k]
+                    if nd < dist[v]:
+                        if parent[v] == -1:
+                            touched.append(v)
+                        dist[v] = nd
+                        parent[v] = u
+                        heappush(heap, (nd + hypot(xs[v] - xt, ys[v] - yt), v))
+                        pushes += 1
+                if len(heap) > max_heap:
+                    max_heap = len(heap)
+            else:
+                return Route(INF, [], expanded, pushes, max_heap)
+            path = [target]
+            while path[-1] != source:
+                path.append(parent[path[-1]])
+            path.reverse()
+            return Route(dist[target], path, expanded, pushes, max_heap)
+        finally:
+            ws.reset()
+
+    def shortest_path_with(self, source, target, h, weights=None):
+        # A* giống shortest_path nhưng với heuristic h(v) tùy ý (phải consistent)
+        if weights is None:
+            weights = self.weights
+        offsets, targets = self.offsets, self.targets
+        ws = self._workspace()
+        dist, parent, visited, touched = ws.dist, ws.parent, ws.visited, ws.touched
+
+        dist[source] = 0.0
+        parent[source] = source
+        touched.append(source)
+        heap = [(h(source), source)]
+        expanded = 0
+        pushes = max_heap = 1
+        try:
+            while heap:
+                u = heappop(heap)[1]
+                if visited[u]:
+                    continue
+                visited[u] = 1
+                expanded += 1
+                if u == target:
+                    break
+                du = dist[u]
+                for k in range(offsets[u], offsets[u + 1]):
+                    v = targets[k]
+                    if visited[v]:
+                        continue
+                    nd = du + weights[k]
+                    if nd < dist[v]:
+                        if parent[v] == -1:
+                            touched.append(v)
+                        dist[v] = nd
+                        parent[v] = u
+                        heappush(heap, (nd + h(v), v))
+                        pushes += 1
+                if len(heap) > max_heap:
+                    max_heap = len(heap)
+            else:
+                return Route(INF, [], expanded, pushes, max_heap)
+            path = [target]
+            while path[-1] != source:
+                path.append(parent[path[-1]])
+            path.reverse()
+            return Route(dist[target], path, expanded, pushes, max_heap)
+        finally:
+            ws.reset()
+
+    def bidirectional(self, source, target, weights=None, landmarks=False):
+        # Danh sách kề đối xứng (mỗi cạnh có hai cung cùng trọng số, kể cả khi có traffic)
+        # nên phía ngược dùng luôn CSR của phía xuôi.
+        if weights is None:
+            weights = self.weights
+        if source == target:
+            return Route(0.0, [source], 0, 0)
+        offsets, targets = self.offsets, self.targets
+        h_t = self.potential(target, source, landmarks)
+        h_s = self.potential(source, target, landmarks)
+
+        def pf(v):
+            return (h_t(v) - h_s(v)) * 0.5
+
+        wf, wr = self._workspace(), self._workspace('ws_reverse')
+        sides = ((wf, 1.0), (wr, -1.0))
+        for ws, node in ((wf, source), (wr, target)):
+            ws.dist[node] = 0.0
+            ws.parent[node] = node
+            ws.touched.append(node)
+        heaps = ([(pf(source), source)], [(-pf(target), target)])
+        best, meet = INF, -1
+        expanded = 0
+        pushes = max_heap = 2
+        try:
+            while heaps[0] and heaps[1]:
+                if heaps[0][0][0] + heaps[1][0][0] >= best:
+                    break
+                side = 0 if heaps[0][0][0] <= heaps[1][0][0] else 1
+                ws, sign = sides[side]
+                other = sides[1 - side][0]
+                dist, parent, visited, touched = ws.dist, ws.parent, ws.visited, ws.touched
+                heap = heaps[side]
+                u = heappop(heap)[1]
+                if visited[u]:
+                    continue
+                visited[u] = 1
+                expanded += 1
+                du = dist[u]
+                for k in range(offsets[u], offsets[u + 1]):
+                    v = targets[k]
+                    if visited[v]:
+                        continue
+                    nd = du + weights[k]
+                    if nd < dist[v]:
+                        if parent[v] == -1:
+                            touched.append(v)
+                        dist[v] = nd
+                        parent[v] = u
+                        heappush(heap, (nd + sign * pf(v), v))
+                        pushes += 1
+                        through = nd + other.dist[v]
+                        if through < best:
+                            best, meet = through, v
+                if len(heaps[0]) + len(heaps[1]) > max_heap:
+                    max_heap = len(heaps[0]) + len(heaps[1])
+            if meet < 0:
+                return Route(INF, [], expanded, pushes, max_heap)
+            path = [meet]
+            while path[-1] != source:
+                path.append(wf.parent[path[-1]])
+            path.reverse()
+            while path[-1] != target:
+                path.append(wr.parent[path[-1]])
+            return Route(best, path, expanded, pushes, max_heap)
+        finally:
+            wf.reset()
+            wr.reset()
+
+
+def _dijkstra_all(offsets, targets, weights, source):
+    n = len(offsets) - 1
+    dist = [INF] * n
+    dist[source] = 0.0
+    heap = [(0.0, source)]
+    while heap:
+        du, u = heappop(heap)
+        if du > dist[u]:
+            continue
+        for k in range(offsets[u], offsets[u + 1]):
+            v = targets[k]
+            nd = du + weights[k]
+            if nd < dist[v]:
+                dist[v] = nd
+                heappush(heap, (nd, v))
+    return dist
+
+
+def compute_landmarks(cg, k=NUM_LANDMARKS):
+    # Chọn landmark theo kiểu "xa nhất": mỗi landmark mới là node xa nhất tới các
+    # landmark đã chọn. Node không tới được ghi khoảng cách 0 (cận vẫn admissible vì
+    # khi đó v và t không cùng thành phần liên thông hoặc landmark không cho thông tin).
+    n = cg.num_nodes
+    if n == 0 or k <= 0:
+        return np.zeros(0, dtype=np.int32), np.zeros((0, n), dtype=np.float64)
+    offsets, targets, weights = cg.offsets.tolist(), cg.targets.tolist(), cg.weights.tolist()
+    start = np.asarray(_dijkstra_all(offsets, targets, weights, 0))
+    start[np.isinf(start)] = -1.0
+    chosen = [int(np.argmax(start))]
+    rows = []
+    nearest = np.full(n, INF)
+    while True:
+        row = np.asarray(_dijkstra_all(offsets, targets, weights, chosen[-1]))
+        reachable = np.isfinite(row)
+        nearest = np.minimum(nearest, np.where(reachable, row, INF))
+        rows.append(np.where(reachable, row, 0.0))
+        if len(chosen) == min(k, n):
+            break
+        candidates = np.where(np.isfinite(nearest), nearest, -1.0)
+        candidates[chosen] = -1.0
+        chosen.append(int(np.argmax(candidates)))
+    return np.asarray(chosen, dtype=np.int32), np.vstack(rows)
@@ -0,0 +1,162 @@
+# Client cho dịch vụ tìm đường (routing_service.py), kèm công cụ thử tải
+#
+# Mỗi luồng giữ một kết nối HTTP keep-alive riêng. to_cached_route() đổi kết quả JSON về
+# route_cache.CachedRoute để map_app.py dùng như tuyến tự tính.
+#
+#   python routing_client.py load --requests 500 --concurrency 8
+#   python routing_client.py load --batch 20 --method ch --traffic-aware
+#   python routing_client.py load --traffic-aware --depart 17:30
+import argparse
+import http.client
+import json
+import math
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlsplit
+
+import numpy as np
+
+import route_cache
+
+DEFAULT_URL = 'http://127.0.0.1:8765'
+TIMEOUT = 30
+
+
+class RoutingServiceError(RuntimeError):
+    pass
+
+
+class RoutingClient:
+    def __init__(self, base_url=DEFAULT_URL, timeout=TIMEOUT):
+        parts = urlsplit(base_url)
+        self.host = parts.hostname
+        self.port = parts.port or 80
+        self.timeout = timeout
+        self._local = threading.local()
+
+    def _connection(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = self._local.conn = http.client.HTTPConnection(self.host, self.port, timeout=self.timeout)
+        return conn
+
+    def _request(self, method, path, payload=None):
+        body = json.dumps(payload).encode() if payload is not None else None
+        headers = {'Content-Type': 'application/json'} if body else {}
+        for attempt in range(2):
+            conn = self._connection()
+            try:
+                conn.request(method, path, body, headers)
+                response = conn.getresponse()
+                raw = response.read()
+                break
+            except (http.client.HTTPException, OSError) as e:
+                # Máy chủ đã đóng kết nối keep-alive: mở lại một lần
+                conn.close()
+                self._local.conn = None
+                if attempt:
+                    raise RoutingServiceError(f"không kết nối được tới {self.host}:{self.port}: {e!r}") from e
+        try:
+            data = json.loads(raw or b'{}')
+        except ValueError as e:
+            # Proxy hoặc máy chủ lỗi trả về HTML/văn bản thay vì JSON
+            raise RoutingServiceError(f"{response.status}: phản hồi không phải JSON") from e
+        if response.status != 200:
+            raise RoutingServiceError(f"{response.status}: {data.get('error')}")
+        return data
+
+    def route(self, origin, destination, vehicle='walk', traffic_aware=False, method='topology', depart=None):
+        # depart: giờ khởi hành ("HH:MM" hoặc số giây kể từ 0 giờ), cần hồ sơ khung giờ ở máy chủ
+        return self._request('POST', '/route', _with_depart({'origin': list(origin), 'destination': list(destination),
+                                                             'vehicle': vehicle, 'traffic_aware': traffic_aware,
+                                                             'method': method}, depart))
+
+    def routes(self, pairs, vehicle='walk', traffic_aware=False, method='topology', depart=None):
+        pairs = [[list(origin), list(destination)] for origin, destination in pairs]
+        return self._request('POST', '/routes', _with_depart({'pairs': pairs, 'vehicle': vehicle, 'traffic_aware': traffic_aware,
+                                                              'method': method}, depart))['routes']
+
+    def matrix(self, points, vehicle='walk', traffic_aware=False):
+        data = self._request('POST', '/matrix', {'points': [list(p) for p in points], 'vehicle': vehicle,
+                                                 'traffic_aware': traffic_aware})
+        return _array(data['distance']), _array(data['time'])
+
+    def health(self):
+        return self._request('GET', '/health')
+
+
+def _with_depart(body, depart):
+    if depart is not None:
+        body['depart'] = depart
+    return body
+
+
+def _array(rows):
+    # null trong JSON là cặp điểm không tới được
+    return np.array([[math.inf if v is None else v for v in row] for row in rows], dtype=np.float64)
+
+
+def to_cached_route(payload):
+    distance = payload['distance']
+    return route_cache.CachedRoute(payload['path'], np.asarray(payload['arcs'], dtype=np.int64),
+                                   math.inf if distance is None else distance,
+                                   payload['coords'], payload['starts'], frozenset(payload['edges']))
+
+
+def load_test(client, requests, concurrency, batch, vehicle, traffic_aware, method, seed, depart=None):
+    south, west, north, east = client.health()['bounds']
+    rng = random.Random(seed)
+
+    def point():
+        return rng.uniform(south, north), rng.uniform(west, east)
+
+    jobs = [[(point(), point()) for _ in range(batch)] for _ in range(requests)]
+
+    def run(pairs):
+        start = time.perf_counter()
+        if batch == 1:
+            client.route(*pairs[0], vehicle=vehicle, traffic_aware=traffic_aware, method=method, depart=depart)
+        else:
+            client.routes(pairs, vehicle=vehicle, traffic_aware=traffic_aware, method=method, depart=depart)
+        return (time.perf_counter() - start) * 1000
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        latencies = np.array(list(pool.map(run, jobs)))
+    elapsed = time.perf_counter() - start
+    p50, p95, p99 = np.percentile(latencies, [50, 95, 99])
+    print(f"{requests} yêu cầu x {batch} tuyến, {concurrency} luồng: {elapsed:.2f} s, "
+          f"{requests * batch / elapsed:.0f} tuyến/s")
+    print(f"Độ trễ: p50 {p50:.1f} ms, p95 {p95:.1f} ms, p99 {p99:.1f} ms, max {latencies.max():.1f} ms")
+    health = client.health()
+    print(f"Cache: {health['cache']['hits']} hit / {health['cache']['misses']} miss, gộp {health['coalesced']} yêu cầu trùng")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Client / thử tải cho routing_service.py")
+    sub = parser.add_subparsers(dest='command', required=True)
+    load = sub.add_parser('load', help="gửi nhiều yêu cầu tìm đường ngẫu nhiên song song")
+    load.add_argument('--url', default=DEFAULT_URL)
+    load.add_argument('--requests', type=int, default=200)
+    load.add_argument('--concurrency', type=int, default=8)
+    load.add_argument('--batch', type=int, default=1, help="số tuyến mỗi yêu cầu (>1 dùng /routes)")
+    load.add_argument('--vehicle', default='walk')
+    load.add_argument('--method', default='topology')
+    load.add_argument('--traffic-aware', action='store_true')
+    load.add_argument('--depart', default=None, help="giờ khởi hành HH:MM (theo hồ sơ khung giờ)")
+    load.add_argument('--seed', type=int, default=0)
+    health = sub.add_parser('health')
+    health.add_argument('--url', default=DEFAULT_URL)
+    args = parser.parse_args()
+    client = RoutingClient(args.url)
+    if args.command == 'health':
+        print(json.dumps(client.health(), ensure_ascii=False, indent=2))
+    else:
+        load_test(client, args.requests, args.concurrency, args.batch, args.vehicle, args.traffic_aware, args.method,
+                  args.seed, args.depart)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,423 @@
+# Dịch vụ tìm đường chạy riêng, tách khỏi vòng rerun của Streamlit
+#
+# RoutePlanner gói cả chuỗi bắt điểm -> tìm đường -> dựng hình học -> ước tính thời gian
+# trên đồ thị biên dịch, không dùng biến toàn cục nên map_app.py, dịch vụ HTTP và các
+# tiến trình con đều dùng chung được. RoutingService là máy chủ HTTP/JSON nhỏ viết bằng
+# asyncio (không cần thư viện ngoài):
+#   POST /route   {"origin": [lat, lon], "destination": [lat, lon], "vehicle": "walk",
+#                  "traffic_aware": false, "method": "astar", "depart": "17:30"}
+#   POST /routes  {"pairs": [[[lat, lon], [lat, lon]], ...], ...}  (nhiều tuyến một lần)
+#   POST /matrix  {"points": [[lat, lon], ...], "vehicle": ..., "traffic_aware": ...}
+#   GET  /health
+# Lượt tìm kiếm (tốn CPU) chạy trong pool tiến trình; mỗi tiến trình mở snapshot đồ thị
+# bằng memory-map. Các yêu cầu giống hệt nhau đang chạy dở được gộp lại (chờ chung một
+# future), kết quả được giữ trong route_cache.RouteCache. Độ tắc đường đọc từ cùng file
+# SQLite với map_app.py và được refresh() ở mỗi yêu cầu. Có "depart" (giờ khởi hành, cần hồ sơ
+# traffic_profiles.py) thì thời gian tính theo khung giờ đi qua từng cạnh, và tuyến tránh tắc
+# được tìm bằng A* phụ thuộc thời gian.
+#
+#   python routing_service.py --port 8765 --workers 4
+import argparse
+import asyncio
+import json
+import math
+import multiprocessing
+import os
+import signal
+import threading
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+import numpy as np
+
+import contraction
+import graph_store
+import instrumentation
+import matrix
+import route_cache
+import route_geometry
+import routing
+import spatial_index
+import topology
+import traffic
+import traffic_profiles
+import traffic_store
+
+DEFAULT_HOST = '127.0.0.1'
+DEFAULT_PORT = 8765
+GRAPHML_FILE = 'phuongmai.graphml'
+TRAFFIC_DB_FILE = 'traffic.sqlite'
+ROUTE_CACHE_SIZE = 2048
+MAX_BODY = 1 << 20
+MAX_BATCH = 256
+MAX_MATRIX_POINTS = 100
+
+VEHICLE_SPEEDS = {
+    'walk': 1.2,       # ~4.3 km/h
+    'motorbike': 6.9,  # ~25 km/h
+    'car': 8.3,        # ~30 km/h
+}
+METHODS = ('topology', 'astar', 'alt', 'bidirectional', 'bidirectional-alt', 'ch')
+REASONS = {200: 'OK', 400: 'Bad Request', 404: 'Not Found', 413: 'Payload Too Large', 500: 'Internal Server Error'}
+
+
+def estimate_time(cg, arcs, levels, speed_mps):
+    # Thời gian (giây) theo hệ số tắc của từng cung, cùng mức tắc cao nhất trên tuyến
+    levels_on_route = levels[cg.arc_edge[arcs]]
+    max_level = int(levels_on_route.max()) if len(levels_on_route) else 1
+    lengths = cg.weights[arcs]
+    return float((lengths / speed_mps * traffic.CONGESTION_FACTORS[levels_on_route]).sum()), max_level
+
+
+class RoutePlanner:
+    def __init__(self, cg, engine=None, snapper=None, overlay=None, ch_loader=None, profiles=None):
+        # overlay (traffic.TrafficOverlay) giữ trọng số của phiên bản mới nhất; không có thì
+        # trọng số được dựng từ snapshot và nhớ theo phiên bản. profiles (hồ sơ theo khung giờ)
+        # bật tìm đường và ước tính thời gian theo giờ khởi hành
+        self.cg = cg
+        self.engine = engine or routing.RoutingEngine(cg)
+        self.snapper = snapper or spatial_index.SpatialIndex(cg)
+        self.overlay = overlay
+        self.matrix_engine = matrix.MatrixEngine(cg)
+        self.topology = topology.Topology(cg, self.engine)
+        self.profiles = profiles
+        self.profile_router = traffic_profiles.TimeDependentRouter(self.topology, profiles) if profiles is not None else None
+        self._ch_loader = ch_loader
+        self._ch = None
+        self._weights = None
+        self._lock = threading.Lock()
+
+    def contraction(self):
+        with self._lock:
+            if self._ch is None:
+                self._ch = self._ch_loader() if self._ch_loader else contraction.build(self.cg)
+            return self._ch
+
+    def weights(self, snapshot):
+        if self.overlay is not None:
+            return self.overlay.weights(snapshot)
+        current = self._weights
+        if current is None or current.version != snapshot.version:
+            current = self._weights = traffic.TrafficWeights(self.cg, snapshot.levels, snapshot.version)
+        return current
+
+    def snap(self, points):
+        points = np.asarray(points, dtype=np.float64).reshape(-1, 2)
+        return self.snapper.nearest_nodes(points[:, 0], points[:, 1]).tolist()
+
+    def search(self, orig_idx, dest_idx, snapshot, traffic_aware=False, method='topology', metrics=instrumentation.NULL_RECORDER):
+        with metrics.stage('search'):
+            if method == 'ch':
+                # Trọng số theo độ tắc chỉ cần customization lại (một lần cho mỗi phiên bản traffic)
+                ch = self.contraction()
+                metric = ch.metric_for(snapshot.version, self.weights(snapshot).weights) if traffic_aware else None
+                result = ch.route(orig_idx, dest_idx, metric)
+            elif method == 'topology':
+                # A* trên đồ thị nút giao, đường đi được bung lại về các node làm dày
+                metric = self.topology.metric_for(snapshot.version, self.weights(snapshot).weights) if traffic_aware else None
+                result = self.topology.route(orig_idx, dest_idx, metric)
+            elif traffic_aware:
+                result = self.engine.route(orig_idx, dest_idx, self.weights(snapshot).weights, method=method)
+            else:
+                result = self.engine.route(orig_idx, dest_idx, method=method)
+        return self._cached_route(result, metrics)
+
+    def search_at(self, orig_idx, dest_idx, snapshot, depart, speed_mps, live_window=None, metrics=instrumentation.NULL_RECORDER):
+        # Tuyến tới sớm nhất khi khởi hành lúc depart (giây kể từ 0 giờ) theo hồ sơ khung giờ;
+        # mức tắc hiện tại áp dụng cho các cạnh đi vào trong khung live_window (traffic_profiles.live_window)
+        router = self.profile_router
+        with metrics.stage('search'):
+            result = router.route(orig_idx, dest_idx, depart, speed_mps, router.live_for(snapshot), live_window)
+        return self._cached_route(result, metrics)
+
+    def eta(self, arcs, snapshot, speed_mps, depart, live_window=None):
+        # Thời gian (giây) đi hết tuyến khi khởi hành lúc depart; không có hồ sơ thì theo mức tắc hiện tại
+        router = self.profile_router
+        if router is None:
+            return estimate_time(self.cg, arcs, snapshot.levels, speed_mps)[0]
+        return router.travel_time(arcs, depart, speed_mps, router.live_for(snapshot), live_window)
+
+    def _cached_route(self, result, metrics):
+        metrics.count('search.expanded', result.expanded)
+        metrics.count('search.heap_pushes', result.pushes)
+        metrics.peak('search.max_heap', result.max_heap)
+        with metrics.stage('geometry'):
+            arcs = self.cg.path_arcs(result.path)
+            distance = traffic.path_length(self.cg, arcs) if result.path else result.distance
+            coords, starts = route_geometry.path_polyline(self.cg, result.path, arcs)
+            edges = frozenset(self.cg.arc_edge[arcs].tolist())
+        metrics.count('route.points', len(coords))
+        return route_cache.CachedRoute(result.path, arcs, distance, coords, starts, edges)
+
+    def matrix(self, nodes, snapshot, speed_mps, traffic_aware=False):
+        weights = self.weights(snapshot).weights if traffic_aware else None
+        return self.matrix_engine.matrix(nodes, nodes, speed_mps, weights)
+
+
+# Trạng thái của từng tiến trình trong pool (hoặc planner của chính tiến trình khi không dùng pool)
+_worker = {}
+
+
+def _init_worker(graph_dir, contraction_dir, profiles_dir):
+    cg = graph_store.load_compiled(graph_dir)
+    _worker['planner'] = RoutePlanner(cg, ch_loader=lambda: contraction.build_or_load(cg, contraction_dir),
+                                      profiles=traffic_profiles.load(profiles_dir, cg.meta.get('edge_fingerprint')))
+
+
+def _search_task(orig_idx, dest_idx, snapshot, traffic_aware, method):
+    return _worker['planner'].search(orig_idx, dest_idx, snapshot, traffic_aware, method)
+
+
+def _search_at_task(orig_idx, dest_idx, snapshot, depart, speed_mps, live_window):
+    return _worker['planner'].search_at(orig_idx, dest_idx, snapshot, depart, speed_mps, live_window)
+
+
+def _matrix_task(nodes, snapshot, speed_mps, traffic_aware):
+    return _worker['planner'].matrix(nodes, snapshot, speed_mps, traffic_aware)
+
+
+def _finite(value):
+    return value if math.isfinite(value) else None
+
+
+def _rows(array):
+    return [[_finite(v) for v in row] for row in array.tolist()]
+
+
+def _point(value):
+    lat, lon = (float(v) for v in value)
+    return lat, lon
+
+
+class RoutingService:
+    def __init__(self, graphml=GRAPHML_FILE, traffic_path=TRAFFIC_DB_FILE, workers=None, cache_size=ROUTE_CACHE_SIZE):
+        self.graph_dir = graph_store.default_path(graphml)
+        self.contraction_dir = contraction.default_path(graphml)
+        self.profiles_dir = traffic_profiles.default_path(graphml)
+        cg = graph_store.build_or_load(graphml, self.graph_dir)
+        self.store = traffic_store.TrafficStore(cg.num_edges, traffic_path, cg.meta.get('edge_fingerprint'))
+        self.routes = route_cache.RouteCache(maxsize=cache_size)
+        self.planner = RoutePlanner(cg, overlay=traffic.TrafficOverlay(cg, self.store),
+                                    ch_loader=lambda: contraction.build_or_load(cg, self.contraction_dir),
+                                    profiles=traffic_profiles.load(self.profiles_dir, cg.meta.get('edge_fingerprint')))
+        # Giống map_app.py: chỉ tuyến đi qua cạnh bị sửa mất hiệu lực khi độ tắc thay đổi
+        self.store.subscribe(lambda change, snapshot: self.routes.advance(
+            change.old_version, change.new_version, change.edges.tolist(),
+            keep=lambda key: not (change.improved and key[2][1])))
+        self.workers = (os.cpu_count() or 1) if workers is None else workers
+        if self.workers > 0:
+            # spawn: tiến trình con không thừa hưởng socket đang lắng nghe của máy chủ
+            self.executor = ProcessPoolExecutor(max_workers=self.workers, mp_context=multiprocessing.get_context('spawn'),
+                                                initializer=_init_worker, initargs=(self.graph_dir, self.contraction_dir, self.profiles_dir))
+        else:
+            # Không dùng pool: tìm đường trong một luồng riêng của chính tiến trình này
+            _worker['planner'] = self.planner
+            self.executor = ThreadPoolExecutor(max_workers=1)
+        self._inflight = {}
+        self.coalesced = 0
+
+    def close(self):
+        self.executor.shutdown()
+        self.store.close()
+
+    def snapshot(self):
+        self.store.refresh()  # nhận thay đổi do tiến trình khác (map_app.py) ghi
+        return self.store.snapshot()
+
+    async def _coalesced(self, key, fn, *args):
+        # Yêu cầu trùng key với một lượt đang chạy chờ chung kết quả thay vì tìm lại
+        future = self._inflight.get(key)
+        if future is not None:
+            self.coalesced += 1
+            return await asyncio.shield(future)
+        future = asyncio.get_running_loop().run_in_executor(self.executor, fn, *args)
+        self._inflight[key] = future
+        try:
+            return await asyncio.shield(future)
+        finally:
+            if self._inflight.get(key) is future:
+                del self._inflight[key]
+
+    async def route(self, orig_idx, dest_idx, snapshot, vehicle, traffic_aware, method, depart=None):
+        if depart is not None and traffic_aware:
+            # Tuyến theo giờ khởi hành, nhớ theo từng phút và theo khung mức tắc hiện tại
+            live_window = traffic_profiles.live_window()
+            key = (orig_idx, dest_idx, (vehicle, traffic_aware, method, int(depart // 60), live_window), snapshot.version)
+            task = (_search_at_task, orig_idx, dest_idx, snapshot, depart, VEHICLE_SPEEDS[vehicle], live_window)
+        else:
+            key = (orig_idx, dest_idx, (vehicle, traffic_aware, method), snapshot.version)
+            task = (_search_task, orig_idx, dest_idx, snapshot, traffic_aware, method)
+        cached = self.routes.get(key)
+        if cached is None:
+            cached = await self._coalesced(key, *task)
+            self.routes.put(key, cached)
+        return cached
+
+    def route_payload(self, route, snapshot, speed_mps, depart=None):
+        seconds, max_level = estimate_time(self.planner.cg, route.arcs, snapshot.levels, speed_mps)
+        if depart is not None:
+            seconds = self.planner.eta(route.arcs, snapshot, speed_mps, depart, traffic_profiles.live_window())
+        return {
+            'found': bool(route.path),
+            'path': route.path,
+            'arcs': np.asarray(route.arcs).tolist(),
+            'distance': _finite(route.distance),
+            'time': seconds if route.path else None,
+            'depart': depart,
+            'max_level': max_level,
+            'coords': route.coords,
+            'starts': route.starts,
+            'edges': sorted(route.edges),
+            'traffic_version': snapshot.version,
+        }
+
+    def _options(self, body):
+        vehicle = body.get('vehicle', 'walk')
+        method = body.get('method', 'topology')
+        if vehicle not in VEHICLE_SPEEDS:
+            raise ValueError(f"vehicle phải là một trong {sorted(VEHICLE_SPEEDS)}")
+        if method not in METHODS:
+            raise ValueError(f"method phải là một trong {list(METHODS)}")
+        depart = body.get('depart')
+        if depart is not None:
+            if self.planner.profiles is None:
+                raise ValueError("chưa có hồ sơ giao thông theo khung giờ (python traffic_profiles.py ...)")
+            depart = traffic_profiles.parse_depart(depart)
+        return vehicle, bool(body.get('traffic_aware', False)), method, depart
+
+    async def handle_route(self, body):
+        vehicle, traffic_aware, method, depart = self._options(body)
+        snapshot = self.snapshot()
+        orig_idx, dest_idx = self.planner.snap([_point(body['origin']), _point(body['destination'])])
+        route = await self.route(orig_idx, dest_idx, snapshot, vehicle, traffic_aware, method, depart)
+        return self.route_payload(route, snapshot, VEHICLE_SPEEDS[vehicle], depart)
+
+    async def handle_routes(self, body):
+        vehicle, traffic_aware, method, depart = self._options(body)
+        pairs = body['pairs']
+        if len(pairs) > MAX_BATCH:
+            raise ValueError(f"tối đa {MAX_BATCH} cặp điểm mỗi yêu cầu")
+        snapshot = self.snapshot()
+        nodes = self.planner.snap([_point(p) for pair in pairs for p in pair]) if pairs else []
+        routes = await asyncio.gather(*(self.route(nodes[2 * i], nodes[2 * i + 1], snapshot, vehicle, traffic_aware, method, depart)
+                                        for i in range(len(pairs))))
+        return {'routes': [self.route_payload(r, snapshot, VEHICLE_SPEEDS[vehicle], depart) for r in routes]}
+
+    async def handle_matrix(self, body):
+        vehicle, traffic_aware, _, _ = self._options(body)
+        points = [_point(p) for p in body['points']]
+        if len(points) > MAX_MATRIX_POINTS:
+            raise ValueError(f"tối đa {MAX_MATRIX_POINTS} điểm mỗi ma trận")
+        snapshot = self.snapshot()
+        nodes = self.planner.snap(points) if points else []
+        key = ('matrix', tuple(nodes), vehicle, traffic_aware, snapshot.version)
+        result = await self._coalesced(key, _matrix_task, nodes, snapshot, VEHICLE_SPEEDS[vehicle], traffic_aware)
+        return {'distance': _rows(result.distance), 'time': _rows(result.time), 'traffic_version': snapshot.version}
+
+    async def handle_health(self, body):
+        cg = self.planner.cg
+        return {
+            'status': 'ok',
+            'nodes': cg.num_nodes,
+            'bounds': [float(np.min(cg.lat)), float(np.min(cg.lon)), float(np.max(cg.lat)), float(np.max(cg.lon))],
+            'workers': self.workers,
+            'traffic_version': self.store.version,
+            'profiles': self.planner.profiles is not None,
+            'inflight': len(self._inflight),
+            'coalesced': self.coalesced,
+            'cache': self.routes.stats(),
+        }
+
+    async def dispatch(self, method, path, body):
+        handlers = {
+            ('POST', '/route'): self.handle_route,
+            ('POST', '/routes'): self.handle_routes,
+            ('POST', '/matrix'): self.handle_matrix,
+            ('GET', '/health'): self.handle_health,
+        }
+        handler = handlers.get((method, path.split('?', 1)[0]))
+        if handler is None:
+            return 404, {'error': f"không có {method} {path}"}
+        try:
+            return 200, await handler(json.loads(body) if body else {})
+        except (ValueError, KeyError, TypeError) as e:
+            return 400, {'error': f"yêu cầu không hợp lệ: {e!r}"}
+
+    async def handle_connection(self, reader, writer):
+        # HTTP/1.1 tối giản, giữ kết nối (keep-alive) cho tới khi client đóng
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line.strip():
+                    break
+                method, path, _ = request_line.decode('latin-1').split(' ', 2)
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b'\r\n', b'\n', b''):
+                        break
+                    name, _, value = line.decode('latin-1').partition(':')
+                    headers[name.strip().lower()] = value.strip()
+                try:
+                    length = int(headers.get('content-length', 0))
+                except ValueError:
+                    length = -1
+                if length < 0:
+                    # Không biết thân yêu cầu dài bao nhiêu nên không đọc tiếp được trên kết nối này
+                    status, payload = 400, {'error': 'Content-Length không hợp lệ'}
+                    close = True
+                elif length > MAX_BODY:
+                    status, payload = 413, {'error': 'yêu cầu quá lớn'}
+                    close = True
+                else:
+                    body = await reader.readexactly(length) if length else b''
+                    try:
+                        status, payload = await self.dispatch(method, path, body)
+                    except Exception as e:
+                        print(f"⚠️ Lỗi khi xử lý {method} {path}: {e!r}")
+                        status, payload = 500, {'error': 'lỗi máy chủ'}
+                    close = headers.get('connection', '').lower() == 'close'
+                data = json.dumps(payload, ensure_ascii=False).encode()
+                writer.write(f"HTTP/1.1 {status} {REASONS[status]}\r\n"
+                             f"Content-Type: application/json; charset=utf-8\r\n"
+                             f"Content-Length: {len(data)}\r\n"
+                             f"Connection: {'close' if close else 'keep-alive'}\r\n\r\n".encode() + data)
+                await writer.drain()
+                if close:
+                    break
+        except (asyncio.IncompleteReadError, ConnectionError, ValueError):
+            pass
+        finally:
+            writer.close()
+
+    async def serve(self, host=DEFAULT_HOST, port=DEFAULT_PORT):
+        server = await asyncio.start_server(self.handle_connection, host, port)
+        print(f"✅ Dịch vụ tìm đường tại http://{host}:{port} ({self.workers} tiến trình tìm đường)")
+        async with server:
+            await server.serve_forever()
+
+
+def _terminate(signum, frame):
+    # SIGTERM đi cùng đường với Ctrl+C để pool tiến trình được đóng lại
+    raise KeyboardInterrupt
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Dịch vụ tìm đường HTTP/JSON cho phuongmai.graphml")
+    parser.add_argument('--graphml', default=GRAPHML_FILE)
+    parser.add_argument('--traffic-db', default=TRAFFIC_DB_FILE)
+    parser.add_argument('--host', default=DEFAULT_HOST)
+    parser.add_argument('--port', type=int, default=DEFAULT_PORT)
+    parser.add_argument('--workers', type=int, default=None, help="số tiến trình tìm đường (0 = tìm trong tiến trình chính)")
+    args = parser.parse_args()
+    service = RoutingService(args.graphml, args.traffic_db, args.workers)
+    signal.signal(signal.SIGTERM, _terminate)
+    try:
+        asyncio.run(service.serve(args.host, args.port))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        service.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,192 @@
+# Chỉ mục không gian dạng lưới đều cho việc bắt điểm (snapping) vào đồ thị
+#
+# Tọa độ được chiếu phẳng (equirectangular quanh tâm đồ thị, đơn vị mét) rồi chia
+# vào các ô vuông CELL_SIZE mét. Node và đoạn thẳng của cạnh được sắp theo ô và lưu
+# dạng CSR giống graph_store, nên xây một lần khi nạp đồ thị rồi dùng lại cho mọi lần
+# nhấp chuột. Truy vấn duyệt các vòng ô quanh điểm cần tìm cho tới khi chắc chắn
+# không còn ứng viên gần hơn.
+import math
+from typing import NamedTuple
+
+import numpy as np
+
+CELL_SIZE = 25.0  # mét
+METERS_PER_DEGREE = 6371000 * math.pi / 180
+
+
+class EdgeSnap(NamedTuple):
+    edge: int        # ID cạnh trong đồ thị đã biên dịch
+    u: int           # chỉ số node đầu cạnh
+    v: int           # chỉ số node cuối cạnh
+    lat: float       # điểm chiếu lên cạnh
+    lon: float
+    fraction: float  # vị trí điểm chiếu tính từ u (0) tới v (1)
+    distance: float  # khoảng cách từ điểm truy vấn tới cạnh, mét
+
+
+class EdgeCandidates(NamedTuple):
+    # Các cạnh trong bán kính quanh từng điểm của một lô, dạng CSR theo điểm
+    offsets: np.ndarray   # cạnh của điểm i nằm ở [offsets[i], offsets[i + 1])
+    edges: np.ndarray
+    fraction: np.ndarray
+    distance: np.ndarray  # mét
+
+
+def _bucket(cells, num_cells):
+    order = np.argsort(cells, kind='stable')
+    starts = np.zeros(num_cells + 1, dtype=np.int64)
+    np.cumsum(np.bincount(cells, minlength=num_cells), out=starts[1:])
+    return order, starts
+
+
+class SpatialIndex:
+    def __init__(self, cg, cell_size=CELL_SIZE):
+        self.cg = cg
+        self.cell_size = cell_size
+        lat = np.asarray(cg.lat, dtype=np.float64)
+        lon = np.asarray(cg.lon, dtype=np.float64)
+        self.lat0 = float(lat.mean()) if len(lat) else 0.0
+        self.lon0 = float(lon.mean()) if len(lon) else 0.0
+        self.kx = METERS_PER_DEGREE * math.cos(math.radians(self.lat0))
+        self.ky = METERS_PER_DEGREE
+        self.xs, self.ys = self.project(lat, lon)
+        pad = cell_size
+        self.x_min = float(self.xs.min()) - pad if len(lat) else 0.0
+        self.y_min = float(self.ys.min()) - pad if len(lat) else 0.0
+        self.nx = int((float(self.xs.max()) + pad - self.x_min) // cell_size) + 1 if len(lat) else 1
+        self.ny = int((float(self.ys.max()) + pad - self.y_min) // cell_size) + 1 if len(lat) else 1
+
+        ix, iy = self._cell_xy(self.xs, self.ys)
+        self.node_order, self.node_starts = _bucket(iy * self.nx + ix, self.nx * self.ny)
+
+        # Mỗi cạnh vô hướng (theo ID cạnh của đồ thị) được ghi vào mọi ô mà hộp bao của nó chạm tới
+        self.edge_u = np.asarray(cg.edge_u, dtype=np.int64)
+        self.edge_v = np.asarray(cg.edge_v, dtype=np.int64)
+        ax, ay = self.xs[self.edge_u], self.ys[self.edge_u]
+        bx, by = self.xs[self.edge_v], self.ys[self.edge_v]
+        ix0, iy0 = self._cell_xy(np.minimum(ax, bx), np.minimum(ay, by))
+        ix1, iy1 = self._cell_xy(np.maximum(ax, bx), np.maximum(ay, by))
+        w = ix1 - ix0 + 1
+        counts = w * (iy1 - iy0 + 1)
+        seg = np.repeat(np.arange(len(counts)), counts)
+        k = np.arange(len(seg)) - np.repeat(np.cumsum(counts) - counts, counts)
+        cells = (iy0[seg] + k // w[seg]) * self.nx + ix0[seg] + k % w[seg]
+        order, self.edge_starts = _bucket(cells, self.nx * self.ny)
+        self.edge_cells = seg[order]
+
+    def project(self, lat, lon):
+        lat = np.asarray(lat, dtype=np.float64)
+        lon = np.asarray(lon, dtype=np.float64)
+        return (lon - self.lon0) * self.kx, (lat - self.lat0) * self.ky
+
+    def unproject(self, x, y):
+        return y / self.ky + self.lat0, x / self.kx + self.lon0
+
+    def _cell_xy(self, x, y):
+        ix = np.clip(((x - self.x_min) // self.cell_size).astype(np.int64), 0, self.nx - 1)
+        iy = np.clip(((y - self.y_min) // self.cell_size).astype(np.int64), 0, self.ny - 1)
+        return ix, iy
+
+    def _ring(self, cx, cy, r, starts, items):
+        # Các phần tử nằm trong vòng ô thứ r quanh ô (cx, cy)
+        found = []
+        x0, x1 = max(cx - r, 0), min(cx + r, self.nx - 1)
+        y0, y1 = max(cy - r, 0), min(cy + r, self.ny - 1)
+        for iy in range(y0, y1 + 1):
+            if iy == cy - r or iy == cy + r:
+                xs = range(x0, x1 + 1)
+            else:
+                xs = [x for x in (cx - r, cx + r) if x0 <= x <= x1]
+            row = iy * self.nx
+            for ix in xs:
+                start, end = starts[row + ix], starts[row + ix + 1]
+                if start != end:
+                    found.append(items[start:end])
+        exhausted = x0 == 0 and y0 == 0 and x1 == self.nx - 1 and y1 == self.ny - 1
+        return found, exhausted
+
+    def _search(self, x, y, starts, items, distances):
+        cx, cy = (int(v) for v in self._cell_xy(np.float64(x), np.float64(y)))
+        # Khoảng cách từ điểm tới mép ô chứa nó, để biết vòng r đã phủ hết bán kính nào
+        margin = min(x - (self.x_min + cx * self.cell_size), self.x_min + (cx + 1) * self.cell_size - x,
+                     y - (self.y_min + cy * self.cell_size), self.y_min + (cy + 1) * self.cell_size - y)
+        margin = max(margin, 0.0)
+        best, best_d = -1, math.inf
+        r = 0
+        while True:
+            found, exhausted = self._ring(cx, cy, r, starts, items)
+            if found:
+                cand = np.concatenate(found)
+                d = distances(cand)
+                k = int(np.argmin(d))
+                if d[k] < best_d:
+                    best, best_d = int(cand[k]), float(d[k])
+            if exhausted or best_d <= r * self.cell_size + margin:
+                return best, best_d
+            r += 1
+
+    def nearest_node(self, lat, lon):
+        x, y = self.project(lat, lon)
+        xs, ys = self.xs, self.ys
+        best, _ = self._search(float(x), float(y), self.node_starts, self.node_order,
+                               lambda c: np.hypot(xs[c] - x, ys[c] - y))
+        return best
+
+    def nearest_nodes(self, lats, lons):
+        lats = np.atleast_1d(np.asarray(lats, dtype=np.float64))
+        lons = np.atleast_1d(np.asarray(lons, dtype=np.float64))
+        return np.array([self.nearest_node(a, b) for a, b in zip(lats.tolist(), lons.tolist())], dtype=np.int64)
+
+    def _project_on_edges(self, edges, x, y):
+        ax, ay = self.xs[self.edge_u[edges]], self.ys[self.edge_u[edges]]
+        dx, dy = self.xs[self.edge_v[edges]] - ax, self.ys[self.edge_v[edges]] - ay
+        length2 = dx * dx + dy * dy
+        t = np.where(length2 > 0, ((x - ax) * dx + (y - ay) * dy) / np.where(length2 > 0, length2, 1.0), 0.0)
+        t = np.clip(t, 0.0, 1.0)
+        px, py = ax + t * dx, ay + t * dy
+        return t, px, py, np.hypot(px - x, py - y)
+
+    def nearest_edge(self, lat, lon):
+        x, y = self.project(lat, lon)
+        x, y = float(x), float(y)
+        best, _ = self._search(x, y, self.edge_starts, self.edge_cells,
+                               lambda c: self._project_on_edges(c, x, y)[3])
+        if best < 0:
+            return None
+        t, px, py, d = (float(a[0]) for a in self._project_on_edges(np.array([best]), x, y))
+        plat, plon = self.unproject(px, py)
+        return EdgeSnap(best, int(self.edge_u[best]), int(self.edge_v[best]), plat, plon, t, d)
+
+    def nearest_edges(self, lats, lons):
+        return [self.nearest_edge(a, b) for a, b in zip(np.atleast_1d(lats).tolist(), np.atleast_1d(lons).tolist())]
+
+    def edges_within(self, lats, lons, radius):
+        # Mọi cạnh cách điểm không quá radius mét, tính cho cả lô điểm bằng NumPy: gom các ô
+        # chạm hình vuông bao quanh đường tròn bán kính radius rồi chiếu điểm lên từng cạnh
+        x, y = self.project(np.atleast_1d(lats), np.atleast_1d(lons))
+        n = len(x)
+        x0, y0 = self._cell_xy(x - radius, y - radius)
+        x1, y1 = self._cell_xy(x + radius, y + radius)
+        w = int(math.ceil(2 * radius / self.cell_size)) + 1
+        dx, dy = np.meshgrid(np.arange(w), np.arange(w))
+        ix, iy = x0[:, None] + dx.ravel(), y0[:, None] + dy.ravel()
+        valid = (ix <= x1[:, None]) & (iy <= y1[:, None])
+        cells = np.where(valid, iy * self.nx + ix, 0).ravel()
+        starts = self.edge_starts[cells]
+        counts = np.where(valid.ravel(), self.edge_starts[cells + 1] - starts, 0)
+        total = int(counts.sum())
+        k = np.arange(total) - np.repeat(np.cumsum(counts) - counts, counts) + np.repeat(starts, counts)
+        point = np.repeat(np.arange(n * dx.size) // dx.size, counts)
+        edges = self.edge_cells[k]
+        t, _, _, d = self._project_on_edges(edges, x[point], y[point])
+        keep = d <= radius
+        # Cạnh dài có mặt ở nhiều ô: bỏ trùng theo (điểm, cạnh)
+        key = point[keep] * self.cg.num_edges + edges[keep]
+        order = np.argsort(key, kind='stable')
+        key = key[order]
+        first = np.ones(len(key), dtype=bool)
+        first[1:] = key[1:] != key[:-1]
+        order = order[first]
+        point, edges, t, d = point[keep][order], edges[keep][order], t[keep][order], d[keep][order]
+        offsets = np.searchsorted(point, np.arange(n + 1))
+        return EdgeCandidates(offsets, edges, t, d)
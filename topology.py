@@ -0,0 +1,263 @@
+# Đồ thị nút giao (topology) để tìm đường, đồ thị làm dày chỉ dùng để bắt điểm và vẽ
+#
+# graph_modifier.py chia mỗi con đường thành các đoạn ngắn nên phần lớn node có bậc 2.
+# Mỗi chuỗi node bậc 2 giữa hai node "lõi" (ngã ba/ngã tư, đầu cụt) được gộp thành một
+# cạnh của đồ thị nút giao, giữ tham chiếu tới dãy node và cung gốc của chuỗi. A* chạy
+# trên các node lõi, nên số node phải duyệt tỉ lệ với số nút giao thay vì số điểm làm
+# dày; điểm đầu/cuối nằm giữa chuỗi được nối vào hai node lõi ở hai đầu chuỗi. Đường
+# tìm được bung ngược về dãy node gốc nên cung, hình học và mức tắc vẫn như cũ.
+# Trọng số theo độ tắc chỉ cần tính lại tổng dồn dọc các chuỗi (Metric, vài mili giây).
+import math
+import threading
+from heapq import heappush, heappop
+from typing import NamedTuple
+
+import numpy as np
+
+import routing
+
+INF = routing.INF
+
+
+class Metric(NamedTuple):
+    version: object
+    prefix: list      # tổng dồn trọng số các cung dọc các chuỗi (cung bị cấm tính là 0)
+    blocked: list     # số cung bị cấm dồn dọc các chuỗi
+    chain_cost: list  # trọng số cả chuỗi, inf nếu có cung bị cấm
+
+
+class Topology:
+    def __init__(self, cg, engine=None):
+        self.cg = cg
+        engine = engine or routing.RoutingEngine(cg)
+        offsets, targets = cg.offsets.tolist(), cg.targets.tolist()
+        arc_edge = np.asarray(cg.arc_edge).tolist()
+        n = cg.num_nodes
+        core = bytearray((np.diff(np.asarray(cg.offsets)) != 2).astype(np.uint8).tobytes())
+        node_chain = [-1] * n
+        node_pos = [-1] * n
+        seen_edge = bytearray(cg.num_edges)
+        chain_nodes, chain_arcs = [], []
+        chain_start, arc_start = [0], [0]
+
+        def walk(c, k):
+            # Đi từ node lõi c theo cung k tới node lõi kế tiếp
+            chain = len(chain_start) - 1
+            nodes, arcs = [c], []
+            prev = c
+            while True:
+                seen_edge[arc_edge[k]] = 1
+                cur = targets[k]
+                nodes.append(cur)
+                arcs.append(k)
+                if core[cur]:
+                    break
+                node_chain[cur] = chain
+                node_pos[cur] = len(nodes) - 1
+                k = offsets[cur] if targets[offsets[cur]] != prev else offsets[cur] + 1
+                prev = cur
+            chain_nodes.extend(nodes)
+            chain_arcs.extend(arcs)
+            chain_start.append(len(chain_nodes))
+            arc_start.append(len(chain_arcs))
+
+        def walk_from(c):
+            for k in range(offsets[c], offsets[c + 1]):
+                if not seen_edge[arc_edge[k]]:
+                    walk(c, k)
+
+        for c in range(n):
+            if core[c]:
+                walk_from(c)
+        # Vòng khép kín toàn node bậc 2: lấy một node làm lõi
+        for v in range(n):
+            if not core[v] and node_chain[v] < 0:
+                core[v] = 1
+                walk_from(v)
+
+        self.node_chain, self.node_pos = node_chain, node_pos
+        self.chain_nodes, self.chain_start = chain_nodes, chain_start
+        self.chain_arcs = np.asarray(chain_arcs, dtype=np.int64)
+        self.arc_start = arc_start
+        self.arc_start_array = np.asarray(arc_start, dtype=np.int64)
+
+        # Đồ thị nút giao dạng CSR trên chỉ số node lõi; mỗi chuỗi (trừ chuỗi vòng về chính nó)
+        # cho hai cung ngược chiều
+        core_nodes = [v for v in range(n) if core[v]]
+        core_id = [-1] * n
+        for i, v in enumerate(core_nodes):
+            core_id[v] = i
+        first = np.asarray([chain_nodes[s] for s in chain_start[:-1]], dtype=np.int64)
+        last = np.asarray([chain_nodes[e - 1] for e in chain_start[1:]], dtype=np.int64)
+        ids = np.asarray(core_id, dtype=np.int64)
+        chains = np.flatnonzero(first != last)
+        src = np.concatenate((ids[first[chains]], ids[last[chains]]))
+        dst = np.concatenate((ids[last[chains]], ids[first[chains]]))
+        order = np.argsort(src, kind='stable')
+        self.core_nodes, self.core_id = core_nodes, core_id
+        self.t_offsets = np.searchsorted(src[order], np.arange(len(core_nodes) + 1)).tolist()
+        self.t_targets = dst[order].tolist()
+        self.t_chain = np.concatenate((chains, chains))[order].tolist()
+        self.t_forward = np.concatenate((np.ones(len(chains), bool), np.zeros(len(chains), bool)))[order].tolist()
+
+        self.xs = [engine.xs[v] for v in core_nodes]
+        self.ys = [engine.ys[v] for v in core_nodes]
+        self.node_xs, self.node_ys = engine.xs, engine.ys
+        self.base_metric = self.customize(cg.weights, 'base')
+        self._latest = None
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+    @property
+    def num_nodes(self):
+        return len(self.core_nodes)
+
+    @property
+    def num_arcs(self):
+        return len(self.t_targets)
+
+    def customize(self, arc_weights, version=None):
+        w = np.asarray(arc_weights, dtype=np.float64)[self.chain_arcs]
+        blocked = np.isinf(w)
+        prefix = np.zeros(len(w) + 1)
+        np.cumsum(np.where(blocked, 0.0, w), out=prefix[1:])
+        counts = np.zeros(len(w) + 1, dtype=np.int64)
+        np.cumsum(blocked, out=counts[1:])
+        starts, ends = self.arc_start_array[:-1], self.arc_start_array[1:]
+        chain_cost = np.where(counts[ends] != counts[starts], INF, prefix[ends] - prefix[starts])
+        return Metric(version, prefix.tolist(), counts.tolist(), chain_cost.tolist())
+
+    def metric_for(self, version, arc_weights):
+        # Giữ lại bản trọng số mới nhất theo phiên bản traffic
+        latest = self._latest
+        if latest is not None and latest.version == version:
+            return latest
+        with self._lock:
+            latest = self._latest
+            if latest is None or latest.version != version:
+                latest = self._latest = self.customize(arc_weights, version)
+        return latest
+
+    def _workspace(self):
+        ws = getattr(self._local, 'ws', None)
+        if ws is None:
+            ws = self._local.ws = routing._Workspace(self.num_nodes)
+        return ws
+
+    def _segment(self, metric, chain, i, j):
+        # Trọng số đoạn chuỗi giữa vị trí i và j (i <= j), hai chiều như nhau
+        a, b = self.arc_start[chain] + i, self.arc_start[chain] + j
+        if metric.blocked[a] != metric.blocked[b]:
+            return INF
+        return metric.prefix[b] - metric.prefix[a]
+
+    def _ends(self, v, metric):
+        # Các node lõi nối với v: {chỉ số lõi: (chi phí, True nếu đi về đầu chuỗi)}
+        if self.core_id[v] >= 0:
+            return {self.core_id[v]: (0.0, True)}
+        chain, i = self.node_chain[v], self.node_pos[v]
+        length = self.chain_start[chain + 1] - self.chain_start[chain] - 1
+        ends = {}
+        for core, cost, to_first in ((self.chain_nodes[self.chain_start[chain]], self._segment(metric, chain, 0, i), True),
+                                     (self.chain_nodes[self.chain_start[chain + 1] - 1], self._segment(metric, chain, i, length), False)):
+            core = self.core_id[core]
+            if cost < INF and (core not in ends or cost < ends[core][0]):
+                ends[core] = (cost, to_first)
+        return ends
+
+    def _along(self, v, to_first):
+        # Dãy node từ v (giữa chuỗi) tới node lõi ở một đầu chuỗi
+        chain, i = self.node_chain[v], self.node_pos[v]
+        start = self.chain_start[chain]
+        if to_first:
+            return self.chain_nodes[start:start + i + 1][::-1]
+        return self.chain_nodes[start + i:self.chain_start[chain + 1]]
+
+    def route(self, source, target, metric=None):
+        metric = metric or self.base_metric
+        if source == target:
+            return routing.Route(0.0, [source], 0, 0)
+        starts = self._ends(source, metric)
+        goals = self._ends(target, metric)
+        best, exit_core = INF, -1
+        chain = self.node_chain[source]
+        if chain >= 0 and chain == self.node_chain[target]:
+            # Cùng một chuỗi: đi thẳng dọc chuỗi
+            i, j = sorted((self.node_pos[source], self.node_pos[target]))
+            best = self._segment(metric, chain, i, j)
+
+        t_offsets, t_targets, t_chain = self.t_offsets, self.t_targets, self.t_chain
+        cost = metric.chain_cost
+        xs, ys = self.xs, self.ys
+        xt, yt = self.node_xs[target], self.node_ys[target]
+        hypot = math.hypot
+        ws = self._workspace()
+        dist, parent, visited, touched = ws.dist, ws.parent, ws.visited, ws.touched
+        heap = []
+        for u, (d, _) in starts.items():
+            dist[u] = d
+            parent[u] = -2  # nối thẳng từ source
+            touched.append(u)
+            heappush(heap, (d + hypot(xs[u] - xt, ys[u] - yt), u))
+        expanded = 0
+        pushes = max_heap = len(heap)
+        try:
+            while heap:
+                f, u = heappop(heap)
+                if f >= best:
+                    break
+                if visited[u]:
+                    continue
+                visited[u] = 1
+                expanded += 1
+                du = dist[u]
+                goal = goals.get(u)
+                if goal is not None and du + goal[0] < best:
+                    best, exit_core = du + goal[0], u
+                for k in range(t_offsets[u], t_offsets[u + 1]):
+                    v = t_targets[k]
+                    if visited[v]:
+                        continue
+                    nd = du + cost[t_chain[k]]
+                    if nd < dist[v]:
+                        if parent[v] == -1:
+                            touched.append(v)
+                        dist[v] = nd
+                        parent[v] = k
+                        heappush(heap, (nd + hypot(xs[v] - xt, ys[v] - yt), v))
+                        pushes += 1
+                if len(heap) > max_heap:
+                    max_heap = len(heap)
+            if best == INF:
+                return routing.Route(INF, [], expanded, pushes, max_heap)
+            if exit_core < 0:
+                return routing.Route(best, self._direct(source, target), expanded, pushes, max_heap)
+            path = self._expand(parent, source, target, exit_core, starts, goals[exit_core][1])
+            return routing.Route(best, path, expanded, pushes, max_heap)
+        finally:
+            ws.reset()
+
+    def _direct(self, source, target):
+        # Dãy node giữa hai node cùng một chuỗi
+        i, j = self.node_pos[source], self.node_pos[target]
+        start = self.chain_start[self.node_chain[source]]
+        return self.chain_nodes[start + i:start + j + 1] if i < j else self.chain_nodes[start + j:start + i + 1][::-1]
+
+    def _expand(self, parent, source, target, exit_core, starts, exit_first):
+        # Bung đường đi trên đồ thị nút giao (theo parent, kết thúc ở exit_core) về dãy node gốc
+        t_chain = self.t_chain
+        arcs = []
+        u = exit_core
+        while parent[u] != -2:
+            k = parent[u]
+            arcs.append(k)
+            u = self.core_id[self.chain_nodes[self.chain_start[t_chain[k]] if self.t_forward[k]
+                                              else self.chain_start[t_chain[k] + 1] - 1]]
+        path = [source] if self.core_id[source] >= 0 else self._along(source, starts[u][1])
+        for k in reversed(arcs):
+            c = t_chain[k]
+            nodes = self.chain_nodes[self.chain_start[c]:self.chain_start[c + 1]]
+            path.extend(nodes[1:] if self.t_forward[k] else nodes[-2::-1])
+        if self.core_id[target] < 0:
+            path.extend(self._along(target, exit_first)[::-1][1:])
+        return path
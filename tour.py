@@ -0,0 +1,135 @@
+# Sắp xếp thứ tự ghé các điểm dừng từ ma trận chi phí (matrix.DistanceMatrix)
+#
+# Dựng lộ trình bằng láng giềng gần nhất rồi cải thiện bằng 2-opt và Or-opt (dời đoạn 1-3
+# điểm) tới khi không còn bước nào tốt hơn hoặc hết thời gian cho phép. Ma trận có thể
+# bất đối xứng (đường một chiều) nên khi đảo một đoạn, chi phí bên trong đoạn được tính
+# lại theo chiều ngược. Điểm đầu và/hoặc điểm cuối có thể được giữ cố định; end == start
+# là lộ trình khép kín quay về điểm xuất phát.
+import math
+import time
+
+TIME_BUDGET = 0.2  # giây
+UNREACHABLE = 1e12  # thay cho inf để lộ trình vẫn sắp được khi có cặp điểm không tới được
+MAX_SEGMENT = 3
+
+
+def _costs(matrix):
+    return [[c if math.isfinite(c) else UNREACHABLE for c in row] for row in matrix.tolist()]
+
+
+def route_cost(costs, order):
+    return sum(costs[a][b] for a, b in zip(order, order[1:]))
+
+
+def _nearest_neighbor(costs, seed, middle, end):
+    order = list(seed)
+    left = set(middle)
+    while left:
+        row = costs[order[-1]]
+        nxt = min(left, key=row.__getitem__)
+        order.append(nxt)
+        left.remove(nxt)
+    if end is not None:
+        order.append(end)
+    return order
+
+
+def _two_opt(costs, order, lo, hi, deadline):
+    # Đảo order[i..j] với lo <= i < j <= hi
+    n = len(order)
+    for i in range(lo, hi):
+        if time.perf_counter() > deadline:
+            return False
+        a = order[i - 1] if i > 0 else None
+        forward = backward = 0.0
+        for j in range(i + 1, hi + 1):
+            forward += costs[order[j - 1]][order[j]]
+            backward += costs[order[j]][order[j - 1]]
+            b = order[j + 1] if j + 1 < n else None
+            old = forward
+            new = backward
+            if a is not None:
+                old += costs[a][order[i]]
+                new += costs[a][order[j]]
+            if b is not None:
+                old += costs[order[j]][b]
+                new += costs[order[i]][b]
+            if new < old - 1e-9:
+                order[i:j + 1] = order[i:j + 1][::-1]
+                return True
+    return False
+
+
+def _or_opt(costs, order, lo, hi, deadline):
+    # Dời đoạn order[i:i + size] sang vị trí khác trong phần không cố định
+    n = len(order)
+    for size in range(1, MAX_SEGMENT + 1):
+        for i in range(lo, hi - size + 2):
+            if time.perf_counter() > deadline:
+                return False
+            first, last = order[i], order[i + size - 1]
+            prev = order[i - 1] if i > 0 else None
+            nxt = order[i + size] if i + size < n else None
+            removed = 0.0
+            if prev is not None:
+                removed += costs[prev][first]
+            if nxt is not None:
+                removed += costs[last][nxt]
+                if prev is not None:
+                    removed -= costs[prev][nxt]
+            rest = order[:i] + order[i + size:]
+            # Vị trí chèn q trong rest: đoạn đứng trước rest[q]
+            for q in range(lo, hi - size + 2):
+                if q == i:
+                    continue
+                x = rest[q - 1] if q > 0 else None
+                y = rest[q] if q < len(rest) else None
+                added = 0.0
+                if x is not None:
+                    added += costs[x][first]
+                if y is not None:
+                    added += costs[last][y]
+                    if x is not None:
+                        added -= costs[x][y]
+                if added < removed - 1e-9:
+                    order[:] = rest[:q] + order[i:i + size] + rest[q:]
+                    return True
+    return False
+
+
+def _improve(costs, order, lo, hi, deadline):
+    while time.perf_counter() < deadline:
+        if not (_two_opt(costs, order, lo, hi, deadline) or _or_opt(costs, order, lo, hi, deadline)):
+            break
+    return order
+
+
+def solve(matrix, start=None, end=None, time_budget=TIME_BUDGET):
+    # Trả về thứ tự các chỉ số hàng của matrix; với end == start, chỉ số đó có ở cả hai đầu
+    deadline = time.perf_counter() + time_budget
+    costs = _costs(matrix)
+    n = len(costs)
+    if n == 0:
+        return []
+    fixed = {start, end} - {None}
+    middle = [i for i in range(n) if i not in fixed]
+    if start is None and not middle:
+        return [end]
+    # Mỗi điểm khởi đầu khác nhau của láng giềng gần nhất cho một lời giải ban đầu, cải thiện
+    # từng lời giải trong thời gian còn lại và giữ cái tốt nhất
+    if start is None:
+        seeds = [[first] for first in middle]
+    else:
+        seeds = [[start, first] for first in middle] or [[start]]
+    lo = 1 if start is not None else 0
+    best = None
+    for seed in seeds:
+        if best is not None and time.perf_counter() > deadline:
+            break
+        order = _nearest_neighbor(costs, seed, [i for i in middle if i not in seed], end)
+        # Các vị trí lo..hi được phép thay đổi
+        order = _improve(costs, order, lo, len(order) - (2 if end is not None else 1), deadline)
+        cost = route_cost(costs, order)
+        if best is None or cost < best[0]:
+            best = (cost, order)
+    return best[1]
@@ -0,0 +1,84 @@
+# Trọng số định tuyến theo độ tắc đường
+#
+# Mức tắc 1..7 được đổi thành hệ số nhân thời gian đi qua cạnh (cùng bảng hệ số với
+# estimate_time_with_traffic trong map_app.py); mức 7 "Cấm đường" làm cạnh không đi
+# được. Trọng số = độ dài cạnh * hệ số, tức là "độ dài quy đổi" tính bằng mét; chia
+# cho tốc độ phương tiện sẽ ra thời gian. Vì hệ số luôn >= 1 nên heuristic khoảng
+# cách thẳng của RoutingEngine vẫn admissible.
+import math
+
+import numpy as np
+
+BLOCKED_LEVEL = 7
+DEFAULT_LEVEL = 1
+
+
+def congestion_factor(level):
+    return 2.0 if level == 7 else 1.8 if level == 6 else 1.5 if level >= 4 else 1.2 if level >= 2 else 1.0
+
+
+def routing_factor(level):
+    return math.inf if level >= BLOCKED_LEVEL else congestion_factor(level)
+
+
+# Bảng tra theo mức (chỉ số 0 không dùng), để đổi cả mảng mức tắc một lần bằng NumPy
+CONGESTION_FACTORS = np.array([1.0] + [congestion_factor(level) for level in range(1, 8)])
+ROUTING_FACTORS = np.array([1.0] + [routing_factor(level) for level in range(1, 8)])
+
+
+class TrafficWeights:
+    # Trọng số cung ứng với một phiên bản của TrafficStore. Đối tượng không bị sửa sau
+    # khi tạo; patched() sao chép danh sách trọng số rồi chỉ tính lại các cung của cạnh
+    # bị đổi, nên các lượt tìm đường đang chạy không bao giờ thấy trọng số lẫn lộn.
+    def __init__(self, cg, levels=None, version=0, weights=None):
+        self.cg = cg
+        self.version = version
+        if weights is None:
+            base = np.asarray(cg.weights, dtype=np.float64)
+            if levels is None:
+                weights = base.tolist()
+            else:
+                factors = ROUTING_FACTORS[np.asarray(levels)[np.asarray(cg.arc_edge)]]
+                weights = np.where(np.isinf(factors), math.inf, base * factors).tolist()
+        self.weights = weights
+
+    def patched(self, edges, levels, version):
+        weights = list(self.weights)
+        base = self.cg.weights
+        offsets, targets = self.cg.offsets, self.cg.targets
+        for edge, level in zip(np.asarray(edges).tolist(), np.asarray(levels).tolist()):
+            factor = routing_factor(level)
+            u, v = int(self.cg.edge_u[edge]), int(self.cg.edge_v[edge])
+            for a, b in ((u, v), (v, u)):
+                for k in range(int(offsets[a]), int(offsets[a + 1])):
+                    if targets[k] == b:
+                        weights[k] = math.inf if math.isinf(factor) else float(base[k]) * factor
+        return TrafficWeights(self.cg, version=version, weights=weights)
+
+
+class TrafficOverlay:
+    # Giữ trọng số của phiên bản mới nhất trong TrafficStore, cập nhật theo từng thay
+    # đổi (O(số cạnh đổi)) thay vì dựng lại từ toàn bộ mảng mức tắc.
+    def __init__(self, cg, store):
+        self.cg = cg
+        snapshot = store.snapshot()
+        self._current = TrafficWeights(cg, snapshot.levels, snapshot.version)
+        store.subscribe(self._on_change)
+
+    def _on_change(self, change, snapshot):
+        current = self._current
+        if current.version == change.old_version:
+            self._current = current.patched(change.edges, snapshot.levels[change.edges], change.new_version)
+        else:
+            self._current = TrafficWeights(self.cg, snapshot.levels, snapshot.version)
+
+    def weights(self, snapshot):
+        current = self._current
+        if current.version == snapshot.version:
+            return current
+        return TrafficWeights(self.cg, snapshot.levels, snapshot.version)
+
+
+def path_length(cg, arcs):
+    # Độ dài thật (mét) của một đường đi cho bởi danh sách cung
+    return float(np.asarray(cg.weights)[arcs].sum()) if len(arcs) else 0.0
@@ -0,0 +1,687 @@
+# Nạp dữ liệu GPS (probe) theo luồng để cập nhật độ tắc đường
+#
+# read_fixes() đọc từng dòng file CSV/JSONL (hoặc stdin) nên file lớn không phải nạp hết
+# vào bộ nhớ; các điểm được xử lý theo lô. Mỗi lô được khớp vào đồ thị (map matching)
+# bằng HMM/Viterbi kiểu Newson & Krumm: trạng thái là các cạnh trong bán kính
+# SEARCH_RADIUS quanh điểm GPS (SpatialIndex.edges_within cho cả lô một lần; mỗi đoạn
+# đường giữa hai nút giao của topology.Topology chỉ giữ cạnh gần nhất), xác suất phát xạ
+# theo khoảng cách tới cạnh, xác suất chuyển theo độ lệch giữa quãng đường trên đồ thị và
+# khoảng cách thẳng. Hai ứng viên khác đoạn đường thì đường đi phải ra ở một đầu đoạn này
+# và vào ở một đầu đoạn kia, nên quãng đường chỉ cần khoảng cách giữa các node lõi (nút
+# giao), tính sẵn một lần cho mọi cặp cách nhau không quá MAX_ROUTE mét. Viterbi chạy cho
+# mọi xe của lô cùng lúc, mỗi bước là vài phép numpy trên mảng (số xe, ứng viên, ứng viên).
+# Mỗi bước đã khớp cho một quan sát tốc độ trên các cạnh đi qua. Quan sát được cộng dồn
+# theo ô thời gian BUCKET_SECONDS trong cửa sổ trượt WINDOW_SECONDS (tính theo giờ của dữ
+# liệu, nên phát lại file cũ cũng đúng), đổi ra mức tắc 1..6 theo tỉ lệ với tốc độ thông
+# thoáng rồi ghi vào TrafficStore một lần mỗi lô: mỗi lô chỉ tạo một phiên bản mới, nên
+# TrafficOverlay và cache tuyến của map_app.py / routing_service.py cập nhật theo lô.
+# Mức 7 "Cấm đường" chỉ đặt bằng tay và không bị dữ liệu GPS ghi đè.
+#
+#   python traffic_ingest.py probes.csv --traffic-db traffic.sqlite
+#   python traffic_ingest.py day1.jsonl day2.jsonl --batch 20000 --free-flow-kmh 25
+#   tail -f probes.jsonl | python traffic_ingest.py - --batch 2000
+import argparse
+import csv
+import json
+import math
+import sys
+import time
+from datetime import datetime
+from heapq import heappush, heappop
+from itertools import islice
+from typing import NamedTuple
+
+import numpy as np
+
+import spatial_index
+import topology
+import traffic
+import traffic_store
+
+GRAPHML_FILE = 'phuongmai.graphml'
+TRAFFIC_DB_FILE = 'traffic.sqlite'
+BATCH_SIZE = 10000
+SEARCH_RADIUS = 25.0   # mét
+GPS_SIGMA = 5.0        # độ lệch chuẩn sai số GPS, mét
+BETA = 5.0             # thang độ lệch quãng đường / khoảng cách thẳng, mét
+MAX_CANDIDATES = 4
+MAX_ROUTE = 300.0      # quãng đường tối đa giữa hai điểm liên tiếp, mét
+MAX_GAP = 60.0         # mất tín hiệu lâu hơn thì bắt đầu đoạn khớp mới, giây
+MAX_SPEED = 40.0       # m/s
+MIN_MOVE = 2 * GPS_SIGMA  # bỏ các điểm chưa rời điểm trước quá sai số GPS (xe đứng yên)
+ROUTE_SLACK = 2 * SEARCH_RADIUS  # quãng đường trên đồ thị dài hơn khoảng cách thẳng quá mức này thì bỏ, mét
+WINDOW_SECONDS = 900
+BUCKET_SECONDS = 60
+MIN_SAMPLES = 3        # số lượt xe tối thiểu trên cạnh trong cửa sổ
+FREE_FLOW_SPEED = 30 / 3.6  # m/s
+# Cận trên của hệ số thời gian (tốc độ thông thoáng / tốc độ đo được) cho mức 1..5, vượt
+# quá là mức 6; bám theo bảng traffic.congestion_factor
+TIME_FACTOR_LIMITS = (1.1, 1.3, 1.45, 1.6, 1.75)
+INF = math.inf
+
+FIELDS = {
+    'vehicle': ('vehicle', 'vehicle_id', 'id'),
+    'time': ('time', 'timestamp', 'ts'),
+    'lat': ('lat', 'latitude'),
+    'lon': ('lon', 'lng', 'longitude'),
+}
+
+
+class Fix(NamedTuple):
+    vehicle: str
+    time: float  # giây (epoch)
+    lat: float
+    lon: float
+
+
+class BatchStats(NamedTuple):
+    fixes: int
+    matched: int       # số bước đã khớp (cặp điểm liên tiếp)
+    observations: int  # số lượt (cạnh, quan sát tốc độ)
+    updated: int       # số cạnh đổi mức tắc
+    version: int
+
+
+def _timestamp(value):
+    try:
+        return float(value)
+    except ValueError:
+        return datetime.fromisoformat(value).timestamp()
+
+
+def _fix(record):
+    values = {}
+    for field, names in FIELDS.items():
+        value = next((record[name] for name in names if record.get(name) not in (None, '')), None)
+        if value is None:
+            return None
+        values[field] = value
+    return Fix(str(values['vehicle']), _timestamp(values['time']), float(values['lat']), float(values['lon']))
+
+
+def read_fixes(path):
+    # Generator các điểm GPS; dòng hỏng bị bỏ qua. '-' là stdin dạng JSONL
+    f = sys.stdin if path == '-' else open(path, encoding='utf-8', newline='')
+    try:
+        if path.endswith('.csv'):
+            records = csv.DictReader(f)
+        else:
+            records = (json.loads(line) for line in f if line.strip())
+        while True:
+            try:
+                record = next(records)
+            except StopIteration:
+                return
+            except ValueError:
+                continue
+            try:
+                fix = _fix(record)
+            except (ValueError, TypeError, AttributeError):
+                continue
+            if fix is not None:
+                yield fix
+    finally:
+        if f is not sys.stdin:
+            f.close()
+
+
+def batched(fixes, size=BATCH_SIZE):
+    fixes = iter(fixes)
+    while True:
+        batch = list(islice(fixes, size))
+        if not batch:
+            return
+        yield batch
+
+
+def speed_level(speeds, free_flow_speed=FREE_FLOW_SPEED):
+    factors = free_flow_speed / np.maximum(np.asarray(speeds, dtype=np.float64), 1e-6)
+    return np.searchsorted(TIME_FACTOR_LIMITS, factors, side='right') + 1
+
+
+def _geometry_groups(cg, rank):
+    # Cạnh đại diện (rank nhỏ nhất, rồi ID nhỏ nhất) của nhóm cạnh trùng hình học với mỗi cạnh
+    lat = np.round(np.asarray(cg.lat, dtype=np.float64), 7)
+    lon = np.round(np.asarray(cg.lon, dtype=np.float64), 7)
+    u, v = np.asarray(cg.edge_u), np.asarray(cg.edge_v)
+    swap = (lat[u] > lat[v]) | ((lat[u] == lat[v]) & (lon[u] > lon[v]))
+    a, b = np.where(swap, v, u), np.where(swap, u, v)
+    _, group = np.unique(np.column_stack((lat[a], lon[a], lat[b], lon[b])), axis=0, return_inverse=True)
+    group = group.ravel()
+    order = np.lexsort((np.arange(len(group)), rank, group))
+    head = np.ones(len(order), dtype=bool)
+    head[1:] = group[order][1:] != group[order][:-1]
+    first = np.empty(group.max() + 1 if len(group) else 0, dtype=np.int64)
+    first[group[order][head]] = order[head]
+    return first[group]
+
+
+class Candidates(NamedTuple):
+    # Ứng viên của từng điểm, mỗi trường là mảng (số điểm, MAX_CANDIDATES); ô trống lấy giá trị
+    # trong PAD (cạnh -1, phát xạ -inf, quãng đường tới hai đầu inf)
+    edge: np.ndarray
+    emission: np.ndarray  # log xác suất phát xạ
+    first: np.ndarray     # node lõi ở đầu đoạn đường chứa cạnh
+    to_first: np.ndarray  # mét từ điểm chiếu tới node lõi đầu
+    last: np.ndarray      # node lõi ở cuối đoạn đường
+    to_last: np.ndarray
+    chain: np.ndarray     # đoạn đường (chuỗi giữa hai nút giao của topology.Topology)
+    along: np.ndarray     # vị trí trên đoạn đường, mét từ đầu
+
+
+PAD = (-1, -INF, 0, INF, 0, INF, -1, 0.0)
+
+
+def _grid(rows, slots, values, fill, shape):
+    out = np.full(shape, fill, dtype=np.asarray(values).dtype if len(values) else np.float64)
+    out[rows, slots] = values
+    return out
+
+
+def _with_rows(cands, extra):
+    # Thêm mỗi ứng viên trong extra (dạng tuple như Candidates) thành một hàng riêng, ở ô 0
+    if not extra:
+        return cands
+    width = cands.edge.shape[1]
+    rows, slots = np.arange(len(extra)), np.zeros(len(extra), dtype=np.int64)
+    return Candidates(*(np.concatenate((a, _grid(rows, slots, np.asarray(values, dtype=a.dtype), fill,
+                                                  (len(extra), width))))
+                        for a, values, fill in zip(cands, zip(*extra), PAD)))
+
+
+def _expand(starts, ends):
+    # Nối các khoảng [starts[i], ends[i]): (i, chỉ số) của từng phần tử
+    lengths = np.maximum(ends - starts, 0)
+    owner = np.repeat(np.arange(len(starts)), lengths)
+    index = np.arange(int(lengths.sum())) + np.repeat(starts - (np.cumsum(lengths) - lengths), lengths)
+    return owner, index
+
+
+def _sum_by_edge(edges, distance, seconds, count):
+    keys, inverse = np.unique(edges, return_inverse=True)
+    return (keys, np.bincount(inverse, distance, len(keys)), np.bincount(inverse, seconds, len(keys)),
+            np.bincount(inverse, count, len(keys)).astype(np.int64))
+
+
+class _Track:
+    # Trạng thái của một xe giữa các lô: điểm cuối đã khớp và lần cuối nhận tín hiệu
+    __slots__ = ('seen', 'x', 'y', 'candidate')
+
+    def __init__(self):
+        self.seen = -INF
+        self.x = self.y = 0.0
+        self.candidate = None
+
+
+class MapMatcher:
+    def __init__(self, cg, index=None, topo=None, radius=SEARCH_RADIUS, sigma=GPS_SIGMA, beta=BETA,
+                 max_candidates=MAX_CANDIDATES, max_route=MAX_ROUTE):
+        self.cg = cg
+        self.index = index or spatial_index.SpatialIndex(cg)
+        topo = topo or topology.Topology(cg)
+        self.radius, self.sigma, self.beta = radius, sigma, beta
+        self.max_candidates, self.max_route = max_candidates, max_route
+        # Đoạn đường (chuỗi giữa hai nút giao) chứa mỗi cạnh
+        # và vị trí (mét từ đầu chuỗi) của node u của cạnh
+        arc_edge = np.asarray(cg.arc_edge)
+        chain_edges = arc_edge[topo.chain_arcs]
+        lengths = np.asarray(cg.weights, dtype=np.float64)[topo.chain_arcs]
+        arc_start = np.asarray(topo.arc_start)
+        self.edge_chain = np.empty(cg.num_edges, dtype=np.int64)
+        self.edge_chain[chain_edges] = np.repeat(np.arange(len(arc_start) - 1), np.diff(arc_start))
+        before = np.cumsum(lengths) - lengths
+        before -= np.repeat(before[arc_start[:-1]] if len(lengths) else before[:0], np.diff(arc_start))
+        arc_source = np.repeat(np.arange(cg.num_nodes), np.diff(np.asarray(cg.offsets)))[topo.chain_arcs]
+        forward = np.asarray(cg.edge_u)[chain_edges] == arc_source
+        self.edge_offset = np.empty(cg.num_edges)
+        self.edge_offset[chain_edges] = np.where(forward, before, before + lengths)
+        self.edge_forward = np.empty(cg.num_edges, dtype=bool)
+        self.edge_forward[chain_edges] = forward
+        edge_before = np.empty(cg.num_edges)
+        edge_before[chain_edges] = before
+        edge_rank = np.empty(cg.num_edges, dtype=np.int64)
+        edge_rank[chain_edges] = np.arange(len(chain_edges)) - np.repeat(arc_start[:-1], np.diff(arc_start))
+        self.edge_before, self.edge_rank = edge_before, edge_rank
+        self.chain_arcs, self.arc_start = topo.chain_arcs, arc_start
+        # Node lõi ở hai đầu và độ dài của mỗi đoạn đường
+        core_id = np.asarray(topo.core_id, dtype=np.int64)
+        chain_nodes, chain_start = np.asarray(topo.chain_nodes, dtype=np.int64), np.asarray(topo.chain_start, dtype=np.int64)
+        self.chain_first = core_id[chain_nodes[chain_start[:-1]]]
+        self.chain_last = core_id[chain_nodes[chain_start[1:] - 1]]
+        self.chain_length = np.add.reduceat(lengths, arc_start[:-1]) if len(lengths) else np.zeros(0)
+        # Cạnh trùng hình học (đồ thị cũ làm dày riêng từng chiều của đường hai chiều nên
+        # mỗi đoạn có hai bản với node khác nhau): quy về bản thuộc đoạn đường có chỉ số nhỏ
+        # nhất, để cả một đoạn đường được quy về cùng một bản
+        self.edge_group = _geometry_groups(cg, self.edge_chain)
+        self.edge_length = np.zeros(cg.num_edges)
+        np.maximum.at(self.edge_length, arc_edge, np.asarray(cg.weights, dtype=np.float64))
+        self.arc_edge, self.weights = arc_edge, np.asarray(cg.weights, dtype=np.float64)
+        # Đường ngắn nhất giữa các node lõi cách nhau không quá max_route, tính một lần trên đồ thị
+        # nút giao: khóa (nguồn * số node lõi + đích) tăng dần để tra cả lô bằng searchsorted,
+        # cùng quãng đường và dãy đoạn đường đi qua (dạng CSR) của từng khóa
+        self.num_core = topo.num_nodes
+        keys, dists, paths = [], [], []
+        first, last = self.chain_first.tolist(), self.chain_last.tolist()
+        for source in range(self.num_core):
+            dist, parent = self._core_reach(topo, source)
+            for v, d in dist.items():
+                keys.append(source * self.num_core + v)
+                dists.append(d)
+                path = []
+                while v != source:
+                    k = parent[v]
+                    c = topo.t_chain[k]
+                    path.append(c)
+                    v = first[c] if topo.t_forward[k] else last[c]
+                paths.append(path)
+        order = np.argsort(np.asarray(keys, dtype=np.int64), kind='stable')
+        self.core_keys = np.asarray(keys, dtype=np.int64)[order]
+        self.core_dist = np.asarray(dists, dtype=np.float64)[order]
+        self.core_path_offsets = np.zeros(len(order) + 1, dtype=np.int64)
+        np.cumsum([len(paths[i]) for i in order.tolist()], out=self.core_path_offsets[1:])
+        self.core_path_chains = np.fromiter((c for i in order.tolist() for c in paths[i]), dtype=np.int64,
+                                            count=int(self.core_path_offsets[-1]))
+
+    def _core_reach(self, topo, source):
+        # Dijkstra giới hạn max_route mét từ node lõi source: (khoảng cách, cung cha) theo node lõi
+        t_offsets, t_targets, t_chain = topo.t_offsets, topo.t_targets, topo.t_chain
+        chain_length = self.chain_length
+        dist, parent = {source: 0.0}, {source: -1}
+        heap = [(0.0, source)]
+        while heap:
+            d, v = heappop(heap)
+            if d > dist[v]:
+                continue
+            for k in range(t_offsets[v], t_offsets[v + 1]):
+                nd = d + chain_length[t_chain[k]]
+                u = t_targets[k]
+                if nd <= self.max_route and nd < dist.get(u, INF):
+                    dist[u] = nd
+                    parent[u] = k
+                    heappush(heap, (nd, u))
+        return dist, parent
+
+    def candidates(self, lats, lons):
+        # Ứng viên của từng điểm (Candidates): mỗi đoạn đường chỉ giữ cạnh gần nhất, tối đa
+        # max_candidates đoạn gần nhất
+        c = self.index.edges_within(lats, lons, self.radius)
+        point = np.repeat(np.arange(len(c.offsets) - 1), np.diff(c.offsets))
+        canonical = self.edge_group[c.edges] == c.edges
+        c = spatial_index.EdgeCandidates(c.offsets, c.edges[canonical], c.fraction[canonical], c.distance[canonical])
+        point = point[canonical]
+        # Sắp theo (điểm, đoạn đường, khoảng cách) rồi theo (điểm, khoảng cách) bằng một khóa số thực
+        # mỗi lần (khoảng cách <= radius < span) thay cho lexsort nhiều khóa
+        span = 2.0 ** math.ceil(math.log2(self.radius + 1))
+        group = point * len(self.chain_length) + self.edge_chain[c.edges]
+        order = np.argsort(group * span + c.distance, kind='stable')
+        first = np.ones(len(order), dtype=bool)
+        first[1:] = group[order][1:] != group[order][:-1]
+        order = order[first]
+        order = order[np.argsort(point[order] * span + c.distance[order], kind='stable')]
+        point = point[order]
+        slot = np.arange(len(order)) - np.searchsorted(point, np.arange(len(c.offsets)))[point]
+        keep = slot < self.max_candidates
+        order, point, slot = order[keep], point[keep], slot[keep]
+        edges = c.edges[order]
+        chain = self.edge_chain[edges]
+        to_u = c.fraction[order] * self.edge_length[edges]
+        # edge_offset là vị trí node u; cạnh ngược chiều chuỗi thì vị trí giảm dần từ u
+        along = self.edge_offset[edges] + np.where(self.edge_forward[edges], to_u, -to_u)
+        shape = (len(c.offsets) - 1, self.max_candidates)
+        values = (edges, -0.5 * (c.distance[order] / self.sigma) ** 2, self.chain_first[chain], along,
+                  self.chain_last[chain], self.chain_length[chain] - along, chain, along)
+        return Candidates(*(_grid(point, slot, v, fill, shape) for v, fill in zip(values, PAD)))
+
+    def limit(self, gc, dt):
+        # Quãng đường lớn nhất cần xét giữa hai điểm cách nhau gc mét, dt giây: xa hơn
+        # gc + ROUTE_SLACK thì xác suất chuyển đã quá nhỏ
+        return np.minimum(np.minimum(self.max_route, MAX_SPEED * np.maximum(dt, 1.0)), gc + ROUTE_SLACK)
+
+    def core_lookup(self, a, b):
+        # Vị trí của các cặp node lõi (mảng) trong core_keys, và cặp nào có (cách nhau <= max_route)
+        keys = a * self.num_core + b
+        i = np.minimum(np.searchsorted(self.core_keys, keys), len(self.core_keys) - 1)
+        return i, self.core_keys[i] == keys
+
+    def transitions(self, cands, before, after):
+        # Quãng đường trên đồ thị từ mọi ứng viên của hàng before[i] tới mọi ứng viên của hàng
+        # after[i]: mảng (i, ứng viên trước, ứng viên sau). Khác đoạn đường thì phải ra ở một đầu
+        # đoạn đường này và vào ở một đầu đoạn đường kia; cùng đoạn đường thì còn đi thẳng dọc đoạn.
+        a = [f[before][:, :, None] for f in cands]
+        b = [f[after][:, None, :] for f in cands]
+        d = np.where(a[6] == b[6], np.abs(b[7] - a[7]), INF)
+        for x, to_x in ((a[2], a[3]), (a[4], a[5])):
+            for y, to_y in ((b[2], b[3]), (b[4], b[5])):
+                i, found = self.core_lookup(x, y)
+                d = np.minimum(d, np.where(found, to_x + self.core_dist[i] + to_y, INF))
+        return d
+
+    def covered(self, cands, before, before_slot, after, after_slot):
+        # Đường đi của từng bước đã khớp (ứng viên before/before_slot -> after/after_slot): trả về
+        # quãng đường của mỗi bước và các quan sát (chỉ số bước, cạnh, số mét đi trên cạnh). Đường
+        # đi gồm phần cạnh của hai ứng viên và các dãy cung liền nhau trong topology.chain_arcs.
+        a = [f[before, before_slot] for f in cands]
+        b = [f[after, after_slot] for f in cands]
+        n = len(before)
+        options, found = [np.where(a[6] == b[6], np.abs(b[7] - a[7]), INF)], []
+        for x, to_x in ((a[2], a[3]), (a[4], a[5])):
+            for y, to_y in ((b[2], b[3]), (b[4], b[5])):
+                i, ok = self.core_lookup(x, y)
+                options.append(np.where(ok, to_x + self.core_dist[i] + to_y, INF))
+                found.append(i)
+        choice = np.argmin(np.stack(options, axis=1), axis=1)
+        total = np.choose(choice, options)
+        steps = np.arange(n)
+        pieces, ranges = [], []  # (bước, cạnh, mét) và (bước, cung đầu, cung cuối) trong chain_arcs
+
+        # Cùng đoạn đường: phần còn lại của cạnh thấp hơn, các cạnh ở giữa, phần đầu của cạnh cao hơn
+        direct = choice == 0
+        same = direct & (a[0] == b[0])
+        pieces.append((steps[same], a[0][same], total[same]))
+        m = direct & ~same
+        swap = a[7][m] > b[7][m]
+        lo_edge, hi_edge = np.where(swap, b[0][m], a[0][m]), np.where(swap, a[0][m], b[0][m])
+        lo_along, hi_along = np.where(swap, b[7][m], a[7][m]), np.where(swap, a[7][m], b[7][m])
+        pieces.append((steps[m], lo_edge, self.edge_before[lo_edge] + self.edge_length[lo_edge] - lo_along))
+        pieces.append((steps[m], hi_edge, hi_along - self.edge_before[hi_edge]))
+        start = self.arc_start[a[6][m]]
+        ranges.append((steps[m], start + self.edge_rank[lo_edge] + 1, start + self.edge_rank[hi_edge]))
+
+        # Qua node lõi: ra khỏi đoạn của a ở một đầu, đi theo đường giữa hai node lõi, vào đoạn của b
+        via = ~direct
+        to_last_a, to_last_b = ((choice - 1) // 2 == 1)[via], ((choice - 1) % 2 == 1)[via]
+        for c, to_last in ((a, to_last_a), (b, to_last_b)):
+            edge, along, chain = c[0][via], c[7][via], c[6][via]
+            before = self.edge_before[edge]
+            pieces.append((steps[via], edge, np.where(to_last, before + self.edge_length[edge] - along, along - before)))
+            rank = self.arc_start[chain] + self.edge_rank[edge]
+            ranges.append((steps[via], np.where(to_last, rank + 1, self.arc_start[chain]),
+                           np.where(to_last, self.arc_start[chain + 1], rank)))
+        key = np.choose(np.maximum(choice - 1, 0), found)[via]
+        owner, index = _expand(self.core_path_offsets[key], self.core_path_offsets[key + 1])
+        chains = self.core_path_chains[index]
+        ranges.append((steps[via][owner], self.arc_start[chains], self.arc_start[chains + 1]))
+
+        owner, index = _expand(np.concatenate([r[1] for r in ranges]), np.concatenate([r[2] for r in ranges]))
+        arcs = self.chain_arcs[index]
+        step = np.concatenate([p[0] for p in pieces] + [np.concatenate([r[0] for r in ranges])[owner]])
+        edges = np.concatenate([p[1] for p in pieces] + [self.arc_edge[arcs]])
+        meters = np.concatenate([p[2] for p in pieces] + [self.weights[arcs]])
+        return total, step, edges, meters
+
+    def viterbi(self, cands, sequences, times, xs, ys):
+        # sequences: các dãy hàng của cands (điểm liên tiếp của từng xe, có thể mở đầu bằng bước
+        # đã chốt ở lô trước); times, xs, ys theo hàng. Mọi dãy được xử lý cùng lúc theo cột (bước
+        # thứ l của các dãy còn điểm, dãy xếp theo độ dài giảm dần), mỗi cột vài phép numpy trên
+        # mảng (số dãy, K, K). Trả về theo từng dãy các đoạn khớp liền mạch, mỗi đoạn là danh sách
+        # (hàng, ô ứng viên).
+        order = sorted(range(len(sequences)), key=lambda s: -len(sequences[s]))
+        lengths = np.asarray([len(sequences[s]) for s in order], dtype=np.int64)
+        width = int(lengths[0]) if len(lengths) else 0
+        counts = np.searchsorted(-lengths, -np.arange(width), side='left')
+        col = np.zeros(width + 1, dtype=np.int64)
+        np.cumsum(counts, out=col[1:])
+        flat = np.empty(col[-1], dtype=np.int64)
+        for i, s in enumerate(order):
+            flat[col[:len(sequences[s])] + i] = sequences[s]
+
+        emission = cands.emission[flat]
+        scores = emission.copy()
+        back = np.zeros(emission.shape, dtype=np.int64)
+        fresh = np.ones(len(flat), dtype=bool)  # bước bắt đầu một đoạn khớp mới
+        for l in range(1, width):
+            n = counts[l]
+            cur, prev = slice(col[l], col[l] + n), slice(col[l - 1], col[l - 1] + n)
+            after, before = flat[cur], flat[prev]
+            gc = np.hypot(xs[after] - xs[before], ys[after] - ys[before])[:, None, None]
+            limit = self.limit(gc, (times[after] - times[before])[:, None, None])
+            d = self.transitions(cands, before, after)
+            total = scores[prev][:, :, None] + np.where(d <= limit, -np.abs(d - gc) / self.beta, -INF)
+            arg = total.argmax(axis=1)
+            best = np.take_along_axis(total, arg[:, None, :], axis=1)[:, 0, :] + emission[cur]
+            # Không nối được với bước trước: bắt đầu đoạn khớp mới
+            linked = best.max(axis=1) > -INF
+            scores[cur] = np.where(linked[:, None], best, emission[cur])
+            back[cur] = arg
+            fresh[cur] = ~linked
+
+        alive = (scores.max(axis=1) > -INF).tolist()  # bước không có ứng viên bị bỏ qua
+        last_slot = scores.argmax(axis=1).tolist()
+        back, fresh, flat, col = back.tolist(), fresh.tolist(), flat.tolist(), col.tolist()
+        result = [None] * len(sequences)
+        for i, s in enumerate(order):
+            segments = []
+            l = len(sequences[s]) - 1
+            while l >= 0:
+                f = col[l] + i
+                if alive[f]:
+                    k, path = last_slot[f], []
+                    while True:
+                        path.append((flat[f], k))
+                        if fresh[f]:
+                            break
+                        k = back[f][k]
+                        l -= 1
+                        f = col[l] + i
+                    segments.append(path[::-1])
+                l -= 1
+            result[s] = segments[::-1]
+        return result
+
+
+class SpeedWindow:
+    # Tổng quãng đường và thời gian theo cạnh trong các ô thời gian của cửa sổ trượt; mỗi ô chỉ
+    # giữ các cạnh có quan sát: (cạnh tăng dần, quãng đường, thời gian, số lượt)
+    def __init__(self, num_edges, window=WINDOW_SECONDS, bucket=BUCKET_SECONDS):
+        self.num_edges = num_edges
+        self.bucket = bucket
+        self.slots = max(1, int(math.ceil(window / bucket)))
+        self.slot_bucket = np.full(self.slots, -1, dtype=np.int64)
+        self.cells = [None] * self.slots
+        self.latest = -1
+
+    def add(self, times, edges, distances, seconds):
+        buckets = (np.asarray(times, dtype=np.float64) // self.bucket).astype(np.int64)
+        edges = np.asarray(edges, dtype=np.int64)
+        distances = np.asarray(distances, dtype=np.float64)
+        seconds = np.asarray(seconds, dtype=np.float64)
+        if len(buckets):
+            self.latest = max(self.latest, int(buckets.max()))
+        for b in np.unique(buckets).tolist():
+            if b <= self.latest - self.slots:
+                continue  # đã ra khỏi cửa sổ
+            slot = b % self.slots
+            mask = buckets == b
+            parts = [(edges[mask], distances[mask], seconds[mask], np.ones(int(mask.sum())))]
+            if self.slot_bucket[slot] == b:
+                parts.append(self.cells[slot])
+            self.slot_bucket[slot] = b
+            self.cells[slot] = _sum_by_edge(*(np.concatenate(x) for x in zip(*parts)))
+
+    def speeds(self):
+        # (cạnh, tốc độ trung bình m/s, số lượt) của các cạnh có quan sát trong cửa sổ
+        live = [self.cells[s] for s in np.flatnonzero((self.slot_bucket >= 0)
+                                                       & (self.slot_bucket > self.latest - self.slots)).tolist()]
+        if not live:
+            return np.zeros(0, dtype=np.int64), np.zeros(0), np.zeros(0, dtype=np.int64)
+        edges, distance, seconds, count = _sum_by_edge(*(np.concatenate(x) for x in zip(*live)))
+        with np.errstate(divide='ignore', invalid='ignore'):
+            speed = np.where(seconds > 0, distance / seconds, np.nan)
+        return edges, speed, count
+
+
+class TrafficIngester:
+    def __init__(self, cg, store, matcher=None, window=WINDOW_SECONDS, bucket=BUCKET_SECONDS,
+                 free_flow_speed=FREE_FLOW_SPEED, min_samples=MIN_SAMPLES):
+        self.cg = cg
+        self.store = store
+        self.matcher = matcher or MapMatcher(cg)
+        self.window = SpeedWindow(cg.num_edges, window, bucket)
+        self.free_flow_speed = free_flow_speed
+        self.min_samples = min_samples
+        self.tracks = {}
+        self.published = np.zeros(0, dtype=np.int64)
+
+    def ingest(self, fixes):
+        # Khớp một lô điểm và cộng quan sát tốc độ vào cửa sổ; trả về (số bước đã khớp, số quan sát)
+        matched, times, edges, distances, seconds = self.match(fixes)
+        self.window.add(times, edges, distances, seconds)
+        self._expire()
+        return matched, len(edges)
+
+    def match(self, fixes):
+        # Khớp một lô điểm vào đồ thị; trả về số bước đã khớp và các quan sát
+        # (thời điểm, cạnh đại diện, quãng đường, số giây) theo từng cạnh đi qua
+        matcher = self.matcher
+        by_vehicle = {}
+        for i, fix in enumerate(fixes):
+            by_vehicle.setdefault(fix.vehicle, []).append(i)
+        lats = np.fromiter((f.lat for f in fixes), dtype=np.float64, count=len(fixes))
+        lons = np.fromiter((f.lon for f in fixes), dtype=np.float64, count=len(fixes))
+        xs, ys = (a.tolist() for a in matcher.index.project(lats, lons))
+
+        # Bỏ điểm đến trễ và điểm gần như đứng yên; mất tín hiệu lâu thì cắt đoạn
+        runs = {}
+        for vehicle, indices in by_vehicle.items():
+            indices.sort(key=lambda i: fixes[i].time)
+            track = self.tracks.get(vehicle)
+            if track is None:
+                track = self.tracks[vehicle] = _Track()
+            parts = runs[vehicle] = [(track.candidate, [])]
+            for i in indices:
+                t = fixes[i].time
+                if t <= track.seen:
+                    continue
+                if t - track.seen > MAX_GAP:
+                    if parts[-1][1]:
+                        parts.append((None, []))
+                    else:
+                        parts[-1] = (None, [])
+                elif math.hypot(xs[i] - track.x, ys[i] - track.y) < MIN_MOVE:
+                    track.seen = t
+                    continue
+                track.seen = t
+                track.x, track.y = xs[i], ys[i]
+                parts[-1][1].append(i)
+
+        points = [i for parts in runs.values() for _, indices in parts for i in indices]
+        if not points:
+            return 0, [], np.zeros(0, dtype=np.int64), [], []
+        # Mỗi điểm là một hàng của cands; bước đã chốt ở lô trước được thêm thành hàng riêng
+        # (một ứng viên, điểm xuất phát 0) ở đầu dãy của nó
+        row = dict(zip(points, range(len(points))))
+        sequences, owners, starts = [], [], []
+        for vehicle, parts in runs.items():
+            for start, indices in parts:
+                if not indices:
+                    continue
+                sequence = [row[i] for i in indices]
+                if start is not None:
+                    sequence.insert(0, len(points) + len(starts))
+                    starts.append(start)
+                sequences.append(sequence)
+                owners.append(vehicle)
+        cands = _with_rows(matcher.candidates(lats[points], lons[points]),
+                           [(c[0], 0.0) + tuple(c[2:]) for _, _, _, c in starts])
+        row_time = np.asarray([fixes[i].time for i in points] + [start[0] for start in starts])
+        row_x = [xs[i] for i in points] + [start[1] for start in starts]
+        row_y = [ys[i] for i in points] + [start[2] for start in starts]
+        pairs = [[], [], [], []]  # hàng và ô ứng viên ở hai đầu của từng bước đã khớp
+        for vehicle, sequence, segments in zip(owners, sequences, matcher.viterbi(
+                cands, sequences, row_time, np.asarray(row_x), np.asarray(row_y))):
+            for segment in segments:
+                for (r0, k0), (r1, k1) in zip(segment, segment[1:]):
+                    for column, value in zip(pairs, (r0, k0, r1, k1)):
+                        column.append(value)
+            # Bước cuối đã chốt là điểm nối sang lô sau
+            r = sequence[-1]
+            last = segments[-1][-1] if segments else None
+            self.tracks[vehicle].candidate = ((row_time[r].item(), row_x[r], row_y[r], tuple(f[last].item() for f in cands))
+                                              if last is not None and last[0] == r else None)
+        before, before_slot, after, after_slot = (np.asarray(column, dtype=np.int64) for column in pairs)
+        total, step, edges, distances = matcher.covered(cands, before, before_slot, after, after_slot)
+        # Bước quá ngắn (xe gần như đứng yên) không cho tốc độ đáng tin
+        moved = total >= 1.0
+        speed = total / (row_time[after] - row_time[before])
+        keep = moved[step] & (distances > 0)
+        step, edges, distances = step[keep], edges[keep], distances[keep]
+        return (int(moved.sum()), row_time[after][step], matcher.edge_group[edges], distances,
+                distances / speed[step])
+
+    def forget(self, before):
+        # Bỏ trạng thái của xe không có tín hiệu từ trước thời điểm before
+        stale = [v for v, track in self.tracks.items() if track.seen < before]
+        for v in stale:
+            del self.tracks[v]
+
+    def _expire(self):
+        # Bỏ trạng thái của xe đã im lặng lâu hơn cửa sổ
+        self.forget((self.window.latest - self.window.slots) * self.window.bucket)
+
+    def levels(self):
+        # (ID cạnh, mức tắc) của các cạnh đủ dữ liệu trong cửa sổ
+        observed, speed, count = self.window.speeds()
+        if not len(observed):
+            return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64)
+        # Cạnh trùng hình học dùng số liệu của cạnh đại diện
+        group = self.matcher.edge_group
+        i = np.minimum(np.searchsorted(observed, group), len(observed) - 1)
+        edges = np.flatnonzero((observed[i] == group) & (count[i] >= self.min_samples))
+        return edges, speed_level(speed[i[edges]], self.free_flow_speed)
+
+    def publish(self):
+        # Ghi mức tắc vào kho theo một lần cập nhật; cạnh hết dữ liệu trở về mức mặc định
+        edges, levels = self.levels()
+        stale = np.setdiff1d(self.published, edges)
+        edges = np.concatenate((edges, stale))
+        levels = np.concatenate((levels, np.full(len(stale), traffic.DEFAULT_LEVEL)))
+        current = self.store.snapshot().levels
+        keep = current[edges] != traffic.BLOCKED_LEVEL
+        edges, levels = edges[keep], levels[keep]
+        self.published = edges[levels != traffic.DEFAULT_LEVEL]
+        changed = int((current[edges] != levels).sum())
+        self.store.update(edges, levels)
+        return changed
+
+
+def run(ingester, fixes, batch_size=BATCH_SIZE, verbose=True):
+    total = []
+    for n, batch in enumerate(batched(fixes, batch_size), 1):
+        start = time.perf_counter()
+        matched, observations = ingester.ingest(batch)
+        updated = ingester.publish()
+        elapsed = time.perf_counter() - start
+        stats = BatchStats(len(batch), matched, observations, updated, ingester.store.version)
+        total.append(stats)
+        if verbose:
+            print(f"Lô {n}: {stats.fixes} điểm, {stats.fixes / elapsed:,.0f} điểm/s, khớp {stats.matched} bước, "
+                  f"{stats.updated} cạnh đổi mức, phiên bản {stats.version}")
+    return total
+
+
+def main():
+    import graph_store
+    parser = argparse.ArgumentParser(description="Nạp dữ liệu GPS (CSV/JSONL) để cập nhật độ tắc đường")
+    parser.add_argument('paths', nargs='+', help="file .csv hoặc .jsonl; '-' là stdin (JSONL)")
+    parser.add_argument('--graphml', default=GRAPHML_FILE)
+    parser.add_argument('--traffic-db', default=TRAFFIC_DB_FILE)
+    parser.add_argument('--batch', type=int, default=BATCH_SIZE)
+    parser.add_argument('--free-flow-kmh', type=float, default=FREE_FLOW_SPEED * 3.6)
+    parser.add_argument('--window', type=float, default=WINDOW_SECONDS, help="độ dài cửa sổ trượt, giây")
+    args = parser.parse_args()
+    cg = graph_store.build_or_load(args.graphml)
+    store = traffic_store.TrafficStore(cg.num_edges, args.traffic_db, cg.meta.get('edge_fingerprint'))
+    ingester = TrafficIngester(cg, store, window=args.window, free_flow_speed=args.free_flow_kmh / 3.6)
+    fixes = (fix for path in args.paths for fix in read_fixes(path))
+    start = time.perf_counter()
+    try:
+        stats = run(ingester, fixes, args.batch)
+    finally:
+        store.close()
+    count = sum(s.fixes for s in stats)
+    elapsed = time.perf_counter() - start
+    print(f"✅ {count} điểm trong {elapsed:.1f} s ({count / max(elapsed, 1e-9):,.0f} điểm/s)")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,411 @@
+# Hồ sơ giao thông theo khung giờ và tìm đường phụ thuộc giờ khởi hành
+#
+# Mỗi cạnh có một hồ sơ gồm NUM_BUCKETS mức tắc uint8 (96 ô 15 phút trong ngày, giờ Hà Nội).
+# Các cạnh có hồ sơ giống hệt nhau dùng chung một hàng: profiles[p] là các mức của hồ sơ p,
+# edge_profile[e] là hồ sơ của cạnh e; hồ sơ 0 luôn là "thông thoáng cả ngày". Hai mảng được
+# ghi thành .npy và mở bằng memory-map như snapshot đồ thị (vài chục KB cho cả phường).
+# Hồ sơ dựng từ dữ liệu GPS lịch sử: traffic_ingest.TrafficIngester khớp điểm vào cạnh, quan
+# sát tốc độ được cộng dồn theo ô giờ trong ngày (gộp mọi ngày) rồi đổi ra mức 1..6.
+#
+# TimeDependentRouter chạy A* trên đồ thị nút giao (topology.Topology) theo thời điểm tới
+# từng node: cạnh được đi qua lúc nào thì dùng hệ số tắc của ô giờ lúc đó, đang đi mà sang ô
+# mới thì phần còn lại đi theo tốc độ của ô mới. Nhờ vậy đi sớm hơn không bao giờ tới muộn
+# hơn (FIFO) và A* với heuristic khoảng cách thẳng / tốc độ vẫn cho tuyến nhanh nhất. Trọng
+# số cả chuỗi theo từng ô giờ được tính sẵn, chỉ chuỗi vắt qua ranh giới ô mới đi từng cung.
+# Mức tắc hiện tại trong TrafficStore thay cho hồ sơ trong khung live_window() (từ bây giờ tới
+# LIVE_HORIZON giây sau, lặp lại mỗi ngày nên đi qua nửa đêm vẫn đúng); cạnh "Cấm đường" thì
+# luôn bị tránh.
+#
+#   python traffic_profiles.py history/*.csv
+#   python traffic_profiles.py march.jsonl april.jsonl --min-samples 10 --free-flow-kmh 25
+import argparse
+import json
+import math
+import os
+import shutil
+import threading
+import time
+from heapq import heappush, heappop
+from typing import NamedTuple
+
+import numpy as np
+
+import routing
+import traffic
+import traffic_ingest
+
+GRAPHML_FILE = 'phuongmai.graphml'
+FORMAT_VERSION = 1
+ARRAYS = ('profiles', 'edge_profile')
+META_FILE = 'meta.json'
+DAY_SECONDS = 24 * 3600
+BUCKET_MINUTES = 15
+NUM_BUCKETS = DAY_SECONDS // (BUCKET_MINUTES * 60)
+UTC_OFFSET = 7 * 3600  # giờ Hà Nội
+MIN_SAMPLES = 5        # số lượt xe tối thiểu trên cạnh trong một ô giờ (cộng mọi ngày)
+LIVE_HORIZON = 1800    # mức tắc hiện tại còn đúng trong khoảng này, giây
+LIVE_STEP = 60         # đầu khung mức tắc hiện tại làm tròn xuống theo bước này (để nhớ tuyến theo khung)
+INF = math.inf
+
+
+class LiveLevels(NamedTuple):
+    version: object
+    factor: list          # hệ số theo mức hiện tại của từng cung, 0 nếu mức mặc định (dùng hồ sơ)
+    chain_live: bytearray  # chuỗi có cung mang mức hiện tại khác mặc định (kể cả bị cấm)
+
+
+class TrafficProfiles:
+    def __init__(self, profiles, edge_profile, meta=None):
+        self.profiles = profiles          # (số hồ sơ, số ô giờ) uint8
+        self.edge_profile = edge_profile  # chỉ số hồ sơ của từng cạnh
+        self.meta = meta or {}
+
+    @property
+    def num_buckets(self):
+        return self.profiles.shape[1]
+
+    @property
+    def bucket_seconds(self):
+        return DAY_SECONDS // self.num_buckets
+
+    @property
+    def nbytes(self):
+        return self.profiles.nbytes + self.edge_profile.nbytes
+
+    def bucket_of(self, seconds):
+        return int(seconds // self.bucket_seconds) % self.num_buckets
+
+    def levels_at(self, seconds):
+        # Mức tắc của mọi cạnh theo hồ sơ tại thời điểm seconds (giây kể từ 0 giờ)
+        return np.asarray(self.profiles)[:, self.bucket_of(seconds)][np.asarray(self.edge_profile)]
+
+
+def from_levels(levels, meta=None):
+    # levels: (số cạnh, số ô giờ) -> bảng hồ sơ không trùng lặp
+    levels = np.asarray(levels, dtype=np.uint8)
+    default = np.full((1, levels.shape[1]), traffic.DEFAULT_LEVEL, dtype=np.uint8)
+    # Mức nhỏ nhất là 1 nên hàng "thông thoáng cả ngày" luôn đứng đầu sau khi sắp xếp
+    profiles, inverse = np.unique(np.vstack((default, levels)), axis=0, return_inverse=True)
+    dtype = np.uint16 if len(profiles) <= np.iinfo(np.uint16).max else np.int32
+    return TrafficProfiles(profiles, inverse.reshape(-1)[1:].astype(dtype), meta)
+
+
+def seconds_of_day(timestamp=None, utc_offset=UTC_OFFSET):
+    return ((time.time() if timestamp is None else timestamp) + utc_offset) % DAY_SECONDS
+
+
+def live_window(timestamp=None, horizon=LIVE_HORIZON):
+    # Khung [đầu, cuối) theo giờ trong ngày mà mức tắc hiện tại còn đúng; cuối có thể quá 24 giờ
+    start = int(seconds_of_day(timestamp)) // LIVE_STEP * LIVE_STEP
+    return start, start + horizon
+
+
+def parse_depart(value):
+    # Giờ khởi hành: số giây kể từ 0 giờ hoặc chuỗi "HH:MM[:SS]"
+    if isinstance(value, str):
+        parts = [float(p) for p in value.split(':')]
+        if not 2 <= len(parts) <= 3:
+            raise ValueError(f"giờ khởi hành không hợp lệ: {value!r}")
+        return parts[0] * 3600 + parts[1] * 60 + (parts[2] if len(parts) == 3 else 0.0)
+    return float(value)
+
+
+def save(profiles, path):
+    meta = dict(profiles.meta, format_version=FORMAT_VERSION, num_buckets=profiles.num_buckets,
+                num_profiles=len(profiles.profiles))
+    tmp = f"{path}.tmp-{os.getpid()}"
+    shutil.rmtree(tmp, ignore_errors=True)
+    os.makedirs(tmp)
+    for name in ARRAYS:
+        np.save(os.path.join(tmp, name + '.npy'), np.ascontiguousarray(getattr(profiles, name)))
+    with open(os.path.join(tmp, META_FILE), 'w', encoding='utf-8') as f:
+        json.dump(meta, f, indent=1)
+    shutil.rmtree(path, ignore_errors=True)
+    os.rename(tmp, path)
+
+
+def load(path, fingerprint=None, mmap=True):
+    # None nếu chưa có hồ sơ hoặc hồ sơ dựng cho một đồ thị khác
+    try:
+        with open(os.path.join(path, META_FILE), encoding='utf-8') as f:
+            meta = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if meta.get('format_version') != FORMAT_VERSION:
+        return None
+    if fingerprint is not None and meta.get('edge_fingerprint') != fingerprint:
+        return None
+    mode = 'r' if mmap else None
+    arrays = [np.load(os.path.join(path, name + '.npy'), mmap_mode=mode) for name in ARRAYS]
+    return TrafficProfiles(*arrays, meta)
+
+
+def default_path(graphml_path):
+    return os.path.splitext(graphml_path)[0] + '.profiles'
+
+
+class ProfileBuilder:
+    # Cộng dồn quan sát tốc độ từ dữ liệu GPS lịch sử theo (cạnh, ô giờ trong ngày)
+    def __init__(self, cg, matcher=None, num_buckets=NUM_BUCKETS, utc_offset=UTC_OFFSET,
+                 free_flow_speed=traffic_ingest.FREE_FLOW_SPEED, min_samples=MIN_SAMPLES):
+        self.cg = cg
+        self.ingester = traffic_ingest.TrafficIngester(cg, None, matcher)
+        self.bucket_seconds = DAY_SECONDS // num_buckets
+        self.utc_offset = utc_offset
+        self.free_flow_speed = free_flow_speed
+        self.min_samples = min_samples
+        self.distance = np.zeros((cg.num_edges, num_buckets))
+        self.time = np.zeros((cg.num_edges, num_buckets))
+        self.count = np.zeros((cg.num_edges, num_buckets), dtype=np.int64)
+        self.fixes = 0
+
+    def add(self, fixes):
+        matched, times, edges, distances, seconds = self.ingester.match(fixes)
+        if len(edges):
+            times = np.asarray(times, dtype=np.float64)
+            buckets = ((times + self.utc_offset) % DAY_SECONDS // self.bucket_seconds).astype(np.int64)
+            np.add.at(self.distance, (edges, buckets), distances)
+            np.add.at(self.time, (edges, buckets), seconds)
+            np.add.at(self.count, (edges, buckets), 1)
+            self.ingester.forget(times.max() - traffic_ingest.MAX_GAP)
+        self.fixes += len(fixes)
+        return matched, len(edges)
+
+    def levels(self):
+        levels = np.full(self.count.shape, traffic.DEFAULT_LEVEL, dtype=np.uint8)
+        enough = self.count >= self.min_samples
+        levels[enough] = traffic_ingest.speed_level(self.distance[enough] / self.time[enough], self.free_flow_speed)
+        # Cạnh trùng hình học dùng chung số liệu của cạnh đại diện
+        return levels[self.ingester.matcher.edge_group]
+
+    def profiles(self):
+        return from_levels(self.levels(), {'edge_fingerprint': self.cg.meta.get('edge_fingerprint'),
+                                           'utc_offset': self.utc_offset, 'fixes': self.fixes,
+                                           'observations': int(self.count.sum())})
+
+
+class TimeDependentRouter:
+    def __init__(self, topo, profiles):
+        self.topo = topo
+        self.profiles = profiles
+        cg = topo.cg
+        self.bucket_seconds = profiles.bucket_seconds
+        self.num_buckets = profiles.num_buckets
+        factors = traffic.ROUTING_FACTORS[np.asarray(profiles.profiles)]
+        arc_profile = np.asarray(profiles.edge_profile, dtype=np.int64)[np.asarray(cg.arc_edge)]
+        lengths = np.asarray(cg.weights, dtype=np.float64)
+        self.arc_edge = np.asarray(cg.arc_edge)
+        self.arc_profile = arc_profile.tolist()
+        self.factors = factors.T.tolist()  # factors[ô giờ][hồ sơ]
+        self.lengths = lengths.tolist()
+        self.chain_arcs = topo.chain_arcs.tolist()
+        # Trọng số (mét quy đổi) của cả chuỗi theo từng ô giờ, inf nếu có cung bị cấm
+        f = factors[arc_profile[topo.chain_arcs]]
+        w = np.where(np.isinf(f), INF, lengths[topo.chain_arcs][:, None] * f)
+        self.chain_cost = np.add.reduceat(w, topo.arc_start_array[:-1], axis=0).T.tolist()
+        self._live = None
+        self._lock = threading.Lock()
+
+    def live_for(self, snapshot):
+        # Mức tắc hiện tại theo phiên bản của TrafficStore
+        live = self._live
+        if live is not None and live.version == snapshot.version:
+            return live
+        with self._lock:
+            live = self._live
+            if live is None or live.version != snapshot.version:
+                levels = np.asarray(snapshot.levels)[self.arc_edge]
+                factor = np.where(levels == traffic.DEFAULT_LEVEL, 0.0, traffic.ROUTING_FACTORS[levels])
+                marked = (levels != traffic.DEFAULT_LEVEL)[self.topo.chain_arcs].astype(np.int64)
+                chain_live = np.add.reduceat(marked, self.topo.arc_start_array[:-1]) > 0
+                live = self._live = LiveLevels(snapshot.version, factor.tolist(),
+                                               bytearray(chain_live.astype(np.uint8).tobytes()))
+        return live
+
+    def traverse(self, t, arcs, speed, live=None, window=None, blocked=INF):
+        # Thời điểm đi hết dãy cung khi bắt đầu lúc t (giây kể từ 0 giờ, có thể quá 24 giờ);
+        # mức tắc hiện tại dùng khi t nằm trong khung window (so theo giờ trong ngày); blocked là
+        # hệ số cho cung bị cấm (inf: không đi được)
+        bs, nb = self.bucket_seconds, self.num_buckets
+        lengths, arc_profile, factors = self.lengths, self.arc_profile, self.factors
+        live_factor = live.factor if live is not None else None
+        live_from, span = (window[0], window[1] - window[0]) if window is not None else (0.0, 0.0)
+        for k in arcs:
+            rest = lengths[k]
+            while True:
+                b = int(t // bs)
+                end = (b + 1) * bs
+                f = live_factor[k] if live_factor is not None else 0.0
+                if f == INF:
+                    if blocked == INF:
+                        return INF
+                    f = blocked
+                if f:
+                    # khung lặp lại mỗi ngày: start là đầu khung gần nhất không sau t
+                    start = live_from + (t - live_from) // DAY_SECONDS * DAY_SECONDS
+                    if start + DAY_SECONDS <= t:  # sai số làm tròn ngay đầu khung hôm sau
+                        start += DAY_SECONDS
+                    if t < start + span:
+                        end = min(end, start + span)
+                    else:
+                        # chưa tới khung: phần đi sau đầu khung dùng mức hiện tại
+                        end = min(end, start + DAY_SECONDS)
+                        f = 0.0
+                if not f:
+                    f = factors[b % nb][arc_profile[k]]
+                    if f == INF:
+                        if blocked == INF:
+                            return INF
+                        f = blocked
+                need = rest * f / speed
+                if t + need <= end:
+                    t += need
+                    break
+                rest -= (end - t) * speed / f
+                t = end
+        return t
+
+    def travel_time(self, arcs, depart, speed, live=None, window=None):
+        # Số giây đi hết tuyến (danh sách cung) khi khởi hành lúc depart; đoạn "Cấm đường" tính
+        # theo hệ số của traffic.congestion_factor như estimate_time
+        return self.traverse(depart, np.asarray(arcs).tolist(), speed, live, window,
+                             traffic.congestion_factor(traffic.BLOCKED_LEVEL)) - depart
+
+    def _chain_arcs(self, c, i, j, forward):
+        # Cung giữa vị trí i và j (i <= j) của chuỗi c theo chiều đi
+        a = self.topo.arc_start[c]
+        arcs = self.chain_arcs[a + i:a + j]
+        return arcs if forward else arcs[::-1]
+
+    def _chain(self, t, c, forward, speed, live, window):
+        b = int(t // self.bucket_seconds)
+        arrive = t + self.chain_cost[b % self.num_buckets][c] / speed
+        if arrive <= (b + 1) * self.bucket_seconds and not (live is not None and live.chain_live[c]):
+            return arrive
+        length = self.topo.arc_start[c + 1] - self.topo.arc_start[c]
+        return self.traverse(t, self._chain_arcs(c, 0, length, forward), speed, live, window)
+
+    def _ends(self, v, t, speed, live, window, leaving):
+        # Các node lõi nối với v: {chỉ số lõi: (thời điểm, True nếu là đầu chuỗi)}; leaving=False
+        # thì trả về dãy cung từ node lõi tới v thay cho thời điểm
+        topo = self.topo
+        if topo.core_id[v] >= 0:
+            return {topo.core_id[v]: (t, True) if leaving else [([], True)]}
+        chain, i = topo.node_chain[v], topo.node_pos[v]
+        length = topo.arc_start[chain + 1] - topo.arc_start[chain]
+        first = topo.core_id[topo.chain_nodes[topo.chain_start[chain]]]
+        last = topo.core_id[topo.chain_nodes[topo.chain_start[chain + 1] - 1]]
+        if not leaving:
+            ends = {first: [(self._chain_arcs(chain, 0, i, True), True)]}
+            ends.setdefault(last, []).append((self._chain_arcs(chain, i, length, False), False))
+            return ends
+        ends = {}
+        for core, arcs, to_first in ((first, self._chain_arcs(chain, 0, i, False), True),
+                                     (last, self._chain_arcs(chain, i, length, True), False)):
+            arrive = self.traverse(t, arcs, speed, live, window)
+            if arrive < INF and (core not in ends or arrive < ends[core][0]):
+                ends[core] = (arrive, to_first)
+        return ends
+
+    def route(self, source, target, depart, speed, live=None, window=None):
+        # Tuyến tới sớm nhất khi khởi hành lúc depart; Route.distance là số giây đi đường
+        topo = self.topo
+        if source == target:
+            return routing.Route(0.0, [source], 0, 0)
+        starts = self._ends(source, depart, speed, live, window, True)
+        goals = self._ends(target, None, speed, live, window, False)
+        best, exit_core, exit_first = INF, -1, True
+        chain = topo.node_chain[source]
+        if chain >= 0 and chain == topo.node_chain[target]:
+            i, j = topo.node_pos[source], topo.node_pos[target]
+            best = self.traverse(depart, self._chain_arcs(chain, min(i, j), max(i, j), i < j), speed, live, window)
+
+        t_offsets, t_targets, t_chain, t_forward = topo.t_offsets, topo.t_targets, topo.t_chain, topo.t_forward
+        chain_cost, bs, nb = self.chain_cost, self.bucket_seconds, self.num_buckets
+        chain_live = live.chain_live if live is not None else None
+        xs, ys = topo.xs, topo.ys
+        xt, yt = topo.node_xs[target], topo.node_ys[target]
+        hypot = math.hypot
+        ws = topo._workspace()
+        dist, parent, visited, touched = ws.dist, ws.parent, ws.visited, ws.touched
+        heap = []
+        for u, (d, _) in starts.items():
+            dist[u] = d
+            parent[u] = -2
+            touched.append(u)
+            heappush(heap, (d + hypot(xs[u] - xt, ys[u] - yt) / speed, u))
+        expanded = 0
+        pushes = max_heap = len(heap)
+        try:
+            while heap:
+                f, u = heappop(heap)
+                if f >= best:
+                    break
+                if visited[u]:
+                    continue
+                visited[u] = 1
+                expanded += 1
+                du = dist[u]
+                goal = goals.get(u)
+                if goal is not None:
+                    for arcs, first in goal:
+                        arrive = self.traverse(du, arcs, speed, live, window)
+                        if arrive < best:
+                            best, exit_core, exit_first = arrive, u, first
+                b = int(du // bs)
+                end = (b + 1) * bs
+                cost = chain_cost[b % nb]
+                for k in range(t_offsets[u], t_offsets[u + 1]):
+                    v = t_targets[k]
+                    if visited[v]:
+                        continue
+                    c = t_chain[k]
+                    nd = du + cost[c] / speed
+                    if nd > end or (chain_live is not None and chain_live[c]):
+                        nd = self._chain(du, c, t_forward[k], speed, live, window)
+                    if nd < dist[v]:
+                        if parent[v] == -1:
+                            touched.append(v)
+                        dist[v] = nd
+                        parent[v] = k
+                        heappush(heap, (nd + hypot(xs[v] - xt, ys[v] - yt) / speed, v))
+                        pushes += 1
+                if len(heap) > max_heap:
+                    max_heap = len(heap)
+            if best == INF:
+                return routing.Route(INF, [], expanded, pushes, max_heap)
+            if exit_core < 0:
+                return routing.Route(best - depart, topo._direct(source, target), expanded, pushes, max_heap)
+            path = topo._expand(parent, source, target, exit_core, starts, exit_first)
+            return routing.Route(best - depart, path, expanded, pushes, max_heap)
+        finally:
+            ws.reset()
+
+
+def main():
+    import graph_store
+    parser = argparse.ArgumentParser(description="Dựng hồ sơ giao thông theo khung giờ từ dữ liệu GPS lịch sử (CSV/JSONL)")
+    parser.add_argument('paths', nargs='+', help="file .csv hoặc .jsonl; '-' là stdin (JSONL)")
+    parser.add_argument('--graphml', default=GRAPHML_FILE)
+    parser.add_argument('--out', default=None, help="thư mục hồ sơ (mặc định cạnh file GraphML)")
+    parser.add_argument('--batch', type=int, default=traffic_ingest.BATCH_SIZE)
+    parser.add_argument('--free-flow-kmh', type=float, default=traffic_ingest.FREE_FLOW_SPEED * 3.6)
+    parser.add_argument('--min-samples', type=int, default=MIN_SAMPLES)
+    args = parser.parse_args()
+    out = args.out or default_path(args.graphml)
+    cg = graph_store.build_or_load(args.graphml)
+    builder = ProfileBuilder(cg, free_flow_speed=args.free_flow_kmh / 3.6, min_samples=args.min_samples)
+    fixes = (fix for path in args.paths for fix in traffic_ingest.read_fixes(path))
+    start = time.perf_counter()
+    for batch in traffic_ingest.batched(fixes, args.batch):
+        builder.add(batch)
+    profiles = builder.profiles()
+    save(profiles, out)
+    elapsed = time.perf_counter() - start
+    covered = int((np.asarray(profiles.edge_profile) != 0).sum())
+    print(f"✅ Đã ghi {out}: {builder.fixes} điểm trong {elapsed:.1f} s, {len(profiles.profiles)} hồ sơ, "
+          f"{covered}/{cg.num_edges} cạnh có giờ tắc, {profiles.nbytes / 1024:.0f} KB")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,153 @@
+# Kho độ tắc đường dùng chung cho cả tiến trình (và giữa các tiến trình qua SQLite)
+#
+# Mức tắc được lưu trong một mảng uint8 đánh chỉ số theo ID cạnh của đồ thị đã biên
+# dịch, nên bộ nhớ không phụ thuộc số người dùng. Mỗi lần ghi theo lô tạo ra một mảng
+# mới (copy-on-write) cùng số phiên bản tăng dần rồi mới thay con trỏ snapshot, vì
+# vậy người đọc chỉ cần lấy snapshot() mà không phải chờ khóa của người ghi.
+# Nếu có đường dẫn file, mọi thay đổi được ghi vào SQLite (chế độ WAL); refresh()
+# nạp lại thay đổi do tiến trình khác ghi.
+import sqlite3
+import threading
+from typing import NamedTuple
+
+import numpy as np
+
+DEFAULT_LEVEL = 1
+
+
+class TrafficSnapshot(NamedTuple):
+    version: int
+    levels: np.ndarray  # uint8 chỉ đọc, một phần tử cho mỗi ID cạnh
+
+
+class TrafficChange(NamedTuple):
+    old_version: int
+    new_version: int
+    edges: np.ndarray  # ID các cạnh đổi mức
+    improved: bool     # có cạnh nào giảm mức tắc (đi nhanh hơn) hay không
+
+
+def _frozen(levels):
+    levels.setflags(write=False)
+    return levels
+
+
+class TrafficStore:
+    def __init__(self, num_edges, path=None, fingerprint=None):
+        self.num_edges = num_edges
+        self.path = path
+        self.fingerprint = fingerprint
+        self._lock = threading.Lock()
+        self._listeners = []
+        self._db = None
+        levels = np.full(num_edges, DEFAULT_LEVEL, dtype=np.uint8)
+        version = 0
+        if path:
+            self._db = sqlite3.connect(path, check_same_thread=False)
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT NOT NULL)")
+            self._db.execute("CREATE TABLE IF NOT EXISTS edge_level (edge_id INTEGER PRIMARY KEY, level INTEGER NOT NULL)")
+            if self._read_meta('fingerprint') != str(fingerprint):
+                # Đồ thị đã đổi: ID cạnh cũ không còn ý nghĩa
+                with self._db:
+                    self._db.execute("DELETE FROM edge_level")
+                    self._write_meta('fingerprint', fingerprint)
+                    self._write_meta('version', int(self._read_meta('version') or 0) + 1)
+            version, levels = self._load()
+        self._snapshot = TrafficSnapshot(version, _frozen(levels))
+
+    def snapshot(self):
+        return self._snapshot
+
+    @property
+    def version(self):
+        return self._snapshot.version
+
+    def subscribe(self, callback):
+        # callback(change, snapshot) được gọi sau mỗi thay đổi, theo đúng thứ tự phiên bản
+        self._listeners.append(callback)
+
+    def update(self, edge_ids, levels):
+        edge_ids = np.asarray(edge_ids, dtype=np.int64).ravel()
+        levels = np.broadcast_to(np.asarray(levels, dtype=np.uint8), edge_ids.shape)
+        with self._lock:
+            if self._db is None:
+                return self._apply(edge_ids, levels)
+            # Khóa ghi của SQLite giữ cho các tiến trình cấp số phiên bản lần lượt
+            self._db.execute("BEGIN IMMEDIATE")
+            try:
+                self._refresh_locked()
+                change = self._apply(edge_ids, levels, persist=True)
+                self._db.commit()
+            except BaseException:
+                self._db.rollback()
+                raise
+            if change is not None:
+                self._publish(*change)
+                return change[0]
+            return None
+
+    def refresh(self):
+        if self._db is None:
+            return None
+        with self._lock:
+            return self._refresh_locked()
+
+    def close(self):
+        if self._db is not None:
+            self._db.close()
+            self._db = None
+
+    def _refresh_locked(self):
+        version = int(self._read_meta('version') or 0)
+        current = self._snapshot
+        if version == current.version:
+            return None
+        version, levels = self._load()
+        edges = np.flatnonzero(levels != current.levels)
+        improved = bool((levels[edges] < current.levels[edges]).any())
+        return self._publish(TrafficChange(current.version, version, edges, improved), levels)
+
+    def _apply(self, edge_ids, levels, persist=False):
+        current = self._snapshot
+        changed = current.levels[edge_ids] != levels
+        if not changed.any():
+            return None
+        edge_ids, levels = edge_ids[changed], levels[changed]
+        new_levels = current.levels.copy()
+        new_levels[edge_ids] = levels
+        improved = bool((levels < current.levels[edge_ids]).any())
+        change = TrafficChange(current.version, current.version + 1, edge_ids, improved)
+        if not persist:
+            return self._publish(change, new_levels)
+        rows = list(zip(edge_ids.tolist(), levels.tolist()))
+        self._db.executemany("DELETE FROM edge_level WHERE edge_id = ?",
+                             [(e,) for e, level in rows if level == DEFAULT_LEVEL])
+        self._db.executemany("INSERT OR REPLACE INTO edge_level (edge_id, level) VALUES (?, ?)",
+                             [(e, level) for e, level in rows if level != DEFAULT_LEVEL])
+        self._write_meta('version', change.new_version)
+        return change, new_levels
+
+    def _publish(self, change, levels):
+        self._snapshot = TrafficSnapshot(change.new_version, _frozen(levels))
+        for callback in self._listeners:
+            callback(change, self._snapshot)
+        return change
+
+    def _load(self):
+        # Đọc phiên bản trước: nếu có ghi chen giữa, lần refresh sau sẽ nạp lại chứ không bỏ sót
+        levels = np.full(self.num_edges, DEFAULT_LEVEL, dtype=np.uint8)
+        version = int(self._read_meta('version') or 0)
+        rows = self._db.execute("SELECT edge_id, level FROM edge_level").fetchall()
+        if rows:
+            data = np.array(rows, dtype=np.int64)
+            data = data[data[:, 0] < self.num_edges]
+            levels[data[:, 0]] = data[:, 1]
+        return version, levels
+
+    def _read_meta(self, key):
+        row = self._db.execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+        return row[0] if row else None
+
+    def _write_meta(self, key, value):
+        self._db.execute("INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)", (key, str(value)))